@@ -1,620 +1,1214 @@
-import pygame, random
+import time
+START_TIME = time.perf_counter() # Before the other imports, so the startup time counts them
+import functools, gc, math, os, pygame, threading
+from assets import assets, GAME_IMAGES
+from text_cache import text_cache, GAME_FONT
+from renderer import Renderer, circle_image
+from timeline import Timeline
+from unit import Unit, unit_pool, names
+from encounters import EncounterEngine, load_regions
+from tilemap import TileMap, Camera
+from spatial import SpatialGrid
+import combat
+from policy import policy_table, precompute
+from rng import SessionRNG
+from replay import InputRecorder, InputReplay
+from profiler import FrameTimer, allocations, OVERLAY_FONT
+from gamelog import GameLog, channel
+from savegame import SaveSlot, Autosaver, SaveState, WorldState, load, QUICKSAVE_PATH
+
+# Every fight's events, for replays and analysis
+combat_log = channel("combat")
+
+# How long the game takes to show its first screens
+startup_log = channel("startup")
+
+# The font of the hp shown on each enemy when there are several
+SMALL_FONT = ('Arial', 14, True)
+
+# Every font the scenes draw with, looked up before the first frame
+GAME_FONTS = [GAME_FONT, SMALL_FONT, OVERLAY_FONT]
+
+# Cell size of a scene's button grid, about the size of a button
+BUTTON_CELL = 32
+
+# The keys that walk the hero: key -> (axis, step)
+WALK_KEYS = {pygame.K_UP: (1, -1), pygame.K_DOWN: (1, 1), pygame.K_RIGHT: (0, 1), pygame.K_LEFT: (0, -1)}
 
 def main():
-    # initialize all pygame modules (some need initialization)
-    pygame.init()
+    # DQ_REPLAY=file plays a recorded session back headlessly at full speed,
+    # DQ_RECORD=file records this session, DQ_SEED=number fixes the seed,
+    # DQ_LOAD=file continues a save instead of showing the select screen
+    replay_path = os.environ.get("DQ_REPLAY")
+    if replay_path:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        events = InputReplay(replay_path)
+        rng = SessionRNG(events.seed)
+        # a replay starts from the saves in its recording and keeps its
+        # quick-saves in memory, never touching the player's files
+        loaded = events.loaded
+        quick_saved = events.quick_saved
+        slot_path = None
+    else:
+        seed = os.environ.get("DQ_SEED")
+        rng = SessionRNG(int(seed) if seed else None)
+        load_path = os.environ.get("DQ_LOAD")
+        loaded = load(load_path) if load_path else None
+        record_path = os.environ.get("DQ_RECORD")
+        quick_saved = None # the real slot already holds it
+        recorded_quick_save = None
+        if record_path and os.path.exists(QUICKSAVE_PATH):
+            slot = SaveSlot(QUICKSAVE_PATH)
+            recorded_quick_save = slot.read()
+            slot.close()
+        events = InputRecorder(rng.seed, record_path, loaded=loaded, quick_saved=recorded_quick_save)
+        slot_path = QUICKSAVE_PATH
+    
+    # DQ_TRACE=file.csv or file.json writes every frame's phase times,
+    # DQ_PROFILE=1 runs cProfile from the start, DQ_OVERLAY=1 shows frame stats
+    timer = FrameTimer(Game.FPS, os.environ.get("DQ_TRACE"))
+    if os.environ.get("DQ_PROFILE"):
+        timer.toggle_profile()
+    if os.environ.get("DQ_OVERLAY"):
+        timer.toggle_overlay()
+    
+    # DQ_LOG=file writes the log as JSON lines, DQ_DEBUG=encounter,render
+    # (or all) turns on those channels' debug messages
+    debug = os.environ.get("DQ_DEBUG", "")
+    log = GameLog(os.environ.get("DQ_LOG"), [name for name in debug.split(",") if name])
+    
+    # initialize only the pygame modules the game uses: the display (which
+    # brings the event queue) and fonts. pygame.init() would also start
+    # audio and joysticks, which the game never touches
+    pygame.display.init()
+    pygame.font.init()
     # create a pygame display window
     pygame.display.set_mode((500, 400))
     # set the title of the display window
     pygame.display.set_caption('Dragon Quest Model')   
     # get the display surface
     w_surface = pygame.display.get_surface() 
+    # decode every image once, now that the display format is known
+    assets.preload(GAME_IMAGES)
+    text_cache.preload(GAME_FONTS)
+    # solve the hint's policy table of every matchup while the first
+    # screens wait for the player, so no frame waits for one
+    solver = threading.Thread(target=precompute, args=(names("hero"), names("enemy")), daemon=True)
+    solver.start()
+    # what is loaded so far lasts the whole game: freezing it keeps the
+    # garbage collector from scanning it again, so a collection takes
+    # well under a millisecond
+    gc.collect()
+    gc.freeze()
+    # DQ_MEMORY=file writes what each scene allocated and kept,
+    # DQ_STEADY=n fails once memory grows after every n encounters
+    memory_path = os.environ.get("DQ_MEMORY")
+    steady = os.environ.get("DQ_STEADY")
+    if memory_path or steady:
+        allocations.start(steady=int(steady) if steady else None)
+    # a replay never autosaves over the player's game
+    autosaver = None if replay_path else Autosaver()
     # create a game object
-    game = Game(w_surface)
+    game = Game(w_surface, events, rng, timer, autosaver, slot_path, solver)
+    game.begin(loaded, quick_saved)
     # start the main game loop by calling the play method on the game object
     game.play() 
+    game.close()
+    events.close()
+    timer.close()
+    allocations.close(memory_path)
+    log.close()
     # quit pygame and clean up the pygame window
     pygame.quit() 
     
     
 class Game:
-    # An object in this class represents a complete game.
+    # An object in this class represents a complete game. It runs the game's
+    # one loop over a stack of scenes (select, overworld, battle, game
+    # over): each frame the events are read once and dispatched to the top
+    # scene, which then updates, draws and presents, all timed by one clock
+    # and one FrameTimer. Scenes under the top keep their state and
+    # surfaces, so going back to one rebuilds nothing.
+    
+    FPS = 144
     
-    def __init__(self, surface):
-        # Initialize a Game.
+    def __init__(self, surface, events, rng, timer, autosaver=None, slot_path=None, solver=None):
+        # Initialize a Game with no scenes.
         # - self is the Game to initialize
         # - surface is the display window surface object
+        # - events is the InputRecorder or InputReplay every scene reads input from
+        # - rng is the SessionRNG every random roll comes from
+        # - timer is the FrameTimer every frame is reported to
+        # - autosaver is the Autosaver that saves after every fight, or None
+        # - slot_path is the quick-save slot's file, or None to keep the
+        #   slot in memory for this game only
+        # - solver is the thread solving the policy tables, or None
     
         # === objects that are part of every game that we will discuss
         self.surface = surface
-        self.bg_color = pygame.Color('black')
-    
-        self.FPS = 144
+        self.events = events
+        self.rng = rng
+        self.timer = timer
         self.game_Clock = pygame.time.Clock()
-        self.close_clicked = False
-        self.continue_game = True  
-        self.encounter = False
+        self.frame_time = 0 # ms the last frame took, for the scenes' animations
+        self.drawing = True # False while playing frames no one watches
+        self.scenes = [] # The scene stack; the last one is playing
+        self.next_scenes = None # The stack to switch to once the frame ends
         
         # === game specific objects
-        self.overworld_character = Character(self.surface)
-        hero_chosen = self.overworld_character.chosen
+        self.hero = None # The hero's Unit, once picked
+        self.overworld = None # Built once the hero is picked
+        self.battle_scene = None # Built at the first encounter
+        self.game_over_scene = None # Built when the hero first falls
+        self.world = WorldState() # Story flags and items
+        self.autosaver = autosaver
+        self.slot_path = slot_path
+        self.solver = solver # Waited for before the first fight
+        self.quick_slot = None # Mapped at the first quick-save or quick-load
+        
+        # Keys that work in every scene, looked up when the scene has none
+        self.key_down = {pygame.K_F3: self.timer.toggle_overlay, pygame.K_F9: self.timer.toggle_profile}
+        
+        allocations.join(self) # The steady-state check waits on this game's encounters too
+        
+        # What each type of event does: one lookup per event
+        self.dispatch = {pygame.QUIT: self.handle_quit, pygame.KEYDOWN: self.handle_keydown,
+                         pygame.KEYUP: self.handle_keyup, pygame.MOUSEBUTTONUP: self.handle_mouse_up,
+                         pygame.VIDEOEXPOSE: self.handle_expose, pygame.WINDOWEXPOSED: self.handle_expose}
+        
+    @property
+    def battle(self):
+        # The battle scene, built the first time the hero meets an enemy so
+        # the overworld comes up without waiting for it. By then the policy
+        # tables have long been solved, but the first fight makes sure.
+        
+        if self.battle_scene is None:
+            if self.solver is not None:
+                self.solver.join()
+                self.solver = None
+            self.battle_scene = Battle(self)
+        return self.battle_scene
+        
+    @property
+    def game_over(self):
+        # The game over scene, built the first time the hero falls
+        
+        if self.game_over_scene is None:
+            self.game_over_scene = GameOver(self)
+        return self.game_over_scene
+        
+    def start(self, hero_chosen):
+        # Begin the game with a hero: build the overworld around them and
+        # make it the only scene
+        # - hero_chosen is the name of the hero picked
+        
         self.hero = Unit(hero_chosen)
-        self.game_map = Map(self.surface)
-        self.battle = Battle(self.surface)
-        self.list_of_enemies = ["slime","ghost","jaskirat"]
+        self.overworld = Overworld(self, hero_chosen)
+        self.switch([self.overworld])
+        
+    def push(self, scene):
+        # Play scene on top of the current one once this frame ends
+        # - scene is the Scene to play
+        
+        self.switch(self.stack() + [scene])
+        
+    def pop(self):
+        # Go back to the scene under the top one once this frame ends
+        
+        self.switch(self.stack()[:-1])
+        
+    def replace(self, scene):
+        # Play scene instead of the top one once this frame ends
+        # - scene is the Scene to play
+        
+        self.switch(self.stack()[:-1] + [scene])
+        
+    def stack(self):
+        # Return the scene stack as it will be once this frame ends
+        
+        return list(self.scenes if self.next_scenes is None else self.next_scenes)
+        
+    def switch(self, scenes):
+        # Make scenes the stack once this frame ends. Switching between
+        # frames means a frame is only ever handled by one scene.
+        # - scenes is the new stack, top last
+        
+        self.next_scenes = scenes
+        
+    def switch_scenes(self):
+        # Apply a switch asked for during the frame, letting the new top
+        # scene know it is playing again
+        
+        if self.next_scenes is None:
+            return
+        
+        top = self.scenes[-1] if self.scenes else None
+        self.scenes = self.next_scenes
+        self.next_scenes = None
+        if self.scenes and self.scenes[-1] is not top:
+            allocations.enter(self.scenes[-1].name)
+            self.scenes[-1].enter()
         
     def play(self):
         # Play the game until the player presses the close box.
         # - self is the Game that should be continued or not.
     
-        while not self.close_clicked:  # until player clicks close box
-            # play frame
-            self.handle_events()
-                        
-            if self.continue_game:
-                self.draw()
-                self.update()
-                self.decide_continue()
-            else:
-                self.draw_end_screen()
-            self.game_Clock.tick(self.FPS) # run at most with FPS Frames Per Second         
-    
-    def handle_events(self):
-        # Handle each user event by changing the game state appropriately.
-        # - self is the Game whose events will be handled
+        self.switch_scenes()
+        while self.scenes:  # until player clicks close box
+            self.step()
+            
+    def step(self, draw=True, elapsed=None):
+        # Play one frame of the top scene, make any scene switch it asked
+        # for, and set the time the frame took. Returns True when nothing
+        # changes until the player acts.
+        # - self is the Game
+        # - draw is False to skip drawing and presenting, for a game no
+        #   one watches
+        # - elapsed is the ms the frame took, or None to wait on the clock,
+        #   sleeping until an event arrives when the frame was idle
+        
+        scene = self.scenes[-1]
+        self.drawing = draw
+        
+        # play frame
+        self.timer.start_frame()
+        for event in self.events.get():
+            handler = self.dispatch.get(event.type)
+            if handler is not None:
+                handler(scene, event)
+        self.timer.mark("handle_events")
+        scene.update()
+        self.timer.mark("update")
+        if draw:
+            scene.draw()
+            self.timer.mark("draw")
+            scene.renderer.present() # only the areas that changed are updated
+            self.timer.mark("present")
+            if not scene.shown:
+                self.log_shown(scene)
+        else:
+            scene.renderer.skip()
+        self.timer.end_frame(scene.name)
+        
+        idle = scene.idle() and not self.timer.show_overlay and self.next_scenes is None
+        self.switch_scenes()
+        switched = self.scenes and self.scenes[-1] is not scene
+        if switched:
+            gc.collect() # Collect between scenes, never in the middle of a frame
+        
+        if elapsed is None:
+            elapsed = self.events.tick(self.game_Clock, scene.FPS, idle) # run at most with FPS Frames Per Second
+        if switched:
+            elapsed = min(elapsed, 1000 // scene.FPS) # Entering a scene is loading, not game time
+        self.frame_time = elapsed
+        return idle
+    
+    def log_shown(self, scene):
+        # Log how long a scene took to come up the first time: the first
+        # scene from launch, the others from when they were built
+        # - scene is the Scene just presented
+        
+        first = self.timer.frames == 0
+        ms = (time.perf_counter() - (START_TIME if first else scene.created)) * 1000
+        since = "launch" if first else "built"
+        startup_log.info("%s shown %.1f ms after %s", scene.name, ms, since, extra={"data": {"screen": scene.name, "ms": ms, "since": since}})
+        scene.shown = True
+        
+    def handle_quit(self, scene, event):
+        # Close the game, whatever scene is playing
+        
+        self.switch([])
+        
+    def handle_expose(self, scene, event):
+        # Redraw the whole window after the system cleared part of it, since
+        # the renderer only presents what changed
+        # - scene is the Scene playing
+        # - event is the window being uncovered
 
-        events = pygame.event.get()
-        for event in events:
-            if event.type == pygame.QUIT:
-                self.close_clicked = True
-            if event.type == pygame.KEYDOWN:
-                self.handle_keydown(event)    
-            if event.type == pygame.KEYUP:
-                self.handle_keyup(event)             
-    
-    def handle_keydown(self, event):
-        
-        if event.key == pygame.K_UP:
-            self.overworld_character.velocity[1] = -1
-        if event.key == pygame.K_DOWN:
-            self.overworld_character.velocity[1] = 1
-        if event.key == pygame.K_RIGHT:
-            self.overworld_character.velocity[0] = 1
-        if event.key == pygame.K_LEFT:
-            self.overworld_character.velocity[0] = -1        
+        scene.renderer.invalidate()
+        
+    def handle_keydown(self, scene, event):
+        # Call what the key does in the scene, or in every scene
+        # - scene is the Scene playing
+        # - event is a key being pressed
+        
+        handler = scene.key_down.get(event.key) or self.key_down.get(event.key)
+        if handler is not None:
+            handler()
             
-    def handle_keyup(self, event):
-        # Hand the keyup user event, changing the velocity of the character
-        # object depending on which keys are released.
-        # - self is the Game that modifies the Paintbrush object.
+    def handle_keyup(self, scene, event):
+        # Call what releasing the key does in the scene
+        # - scene is the Scene playing
         # - event is a key being released
         
-        if event.key == pygame.K_UP:
-            self.overworld_character.velocity[1] = 0
-        if event.key == pygame.K_DOWN:
-            self.overworld_character.velocity[1] = 0
-        if event.key == pygame.K_RIGHT:
-            self.overworld_character.velocity[0] = 0
-        if event.key == pygame.K_LEFT:
-            self.overworld_character.velocity[0] = 0           
+        handler = scene.key_up.get(event.key)
+        if handler is not None:
+            handler()
+            
+    def handle_mouse_up(self, scene, event):
+        # Hand a click to the scene
+        # - scene is the Scene playing
+        # - event is a mouse button being released
+        
+        scene.handle_mouse_up(event.pos)
+        
+    def end_battle(self):
+        # Go back to the overworld after a fight, or on to the game over
+        # screen when the hero fell, autosaving a hero who survived
+        
+        self.pop()
+        self.overworld.character.velocity = [0,0]
+        unit_pool.release(self.battle.enemies) # The next encounters reuse them
+        allocations.encounter(self)
+        
+        if self.hero.current_hp <= 0:
+            combat_log.info("game over", extra={"data": {"hero": self.hero.name}})
+            self.replace(self.game_over)
+        elif self.autosaver is not None:
+            self.autosaver.request(self.snapshot())
+            
+    def begin(self, loaded=None, quick_saved=None):
+        # Show the first scene: the select screen, or the overworld where a
+        # save left the hero
+        # - self is the Game
+        # - loaded is the SaveState to continue, or None
+        # - quick_saved is a SaveState to put in the quick-save slot first,
+        #   for a replay whose recording found one there
+        
+        if quick_saved is not None:
+            self.slot().write(quick_saved)
+        if loaded is not None:
+            self.restore(loaded)
+        else:
+            self.push(CharacterSelect(self))
+            
+    def slot(self):
+        # Return the quick-save SaveSlot, mapping it the first time
+        # - self is the Game
+        
+        if self.quick_slot is None:
+            self.quick_slot = SaveSlot(self.slot_path)
+        return self.quick_slot
+        
+    def quick_save(self):
+        # Save the game to the quick-save slot (F5)
+        
+        self.slot().write(self.snapshot())
+        
+    def quick_load(self):
+        # Go back to the game in the quick-save slot, if there is one (F8)
+        
+        saved = self.slot().read()
+        if saved is not None:
+            self.restore(saved)
+        
+    def snapshot(self):
+        # Return a SaveState of the hero and the world
+        # - self is the Game
+        
+        character = self.overworld.character
+        return SaveState(self.hero.name, self.hero.current_hp, self.hero.attack1_current_pp, self.hero.attack2_current_pp,
+                         0, character.position, self.overworld.game_map.encounters.steps_left, self.world)
+        
+    def restore(self, saved):
+        # Put the hero and the world back as a save left them, on the
+        # overworld
+        # - self is the Game
+        # - saved is the SaveState to restore
+        
+        if self.overworld is None or self.hero.name != saved.hero_name:
+            self.start(saved.hero_name)
+        
+        self.hero.current_hp = saved.current_hp
+        self.hero.attack1_current_pp = saved.attack1_pp
+        self.hero.attack2_current_pp = saved.attack2_pp
+        self.world = saved.world
+        self.overworld.restore(saved.position, saved.steps_left)
+        self.switch([self.overworld])
+        
+    def close(self):
+        # Autosave a living hero and close the save files
+        # - self is the Game
+        
+        if self.autosaver is not None:
+            if self.hero is not None and self.hero.current_hp > 0:
+                self.autosaver.request(self.snapshot())
+            self.autosaver.close()
+        if self.quick_slot is not None:
+            self.quick_slot.close()
+        allocations.leave(self)
+            
+    
+class Scene:
+    # An object in this class is one screen of the game, played by the
+    # Game's loop while it is on top of the scene stack. Input reaches a
+    # scene through dispatch tables, so an event costs one dict lookup, or
+    # one grid cell for a click, however many keys and buttons it has:
+    # - key_down and key_up map a key to the function it calls
+    # - buttons is a SpatialGrid of the areas that can be clicked, each
+    #   with the function a click there calls
+    
+    FPS = Game.FPS
+    name = "scene"
+    
+    def __init__(self, game):
+        # Initialize a Scene.
+        # - self is the Scene to initialize
+        # - game is the Game playing it
+        
+        self.game = game
+        self.renderer = Renderer(game.surface, self.draw_background) # The background is painted when first shown
+        self.key_down = {}
+        self.key_up = {}
+        self.buttons = SpatialGrid(BUTTON_CELL)
+        self.created = time.perf_counter()
+        self.shown = False # Presented at least once
+        
+    def enter(self):
+        # Get ready to play, each time the scene comes to the top: another
+        # scene drew over the screen, so all of it is drawn again
+        # - self is the Scene
+        
+        self.renderer.invalidate()
+        
+    def draw_background(self):
+        # Draw what stays behind the scene's layers, called by the renderer
+        # before the background is shown
+        # - self is the Scene
+        
+        self.renderer.background.fill(pygame.Color("black"))
+        
+    def handle_mouse_up(self, position):
+        # Call what a click does at position
+        # - self is the Scene
+        # - position is where the mouse button was released
+        
+        for handler in self.buttons.query_point(position):
+            handler()
+            
+    def update(self):
+        # Update the scene for the next frame.
+        # - self is the Scene
+        
+        pass
+        
+    def draw(self):
+        # Place what changed on the renderer; the Game presents it
+        # - self is the Scene
+        
+        self.game.timer.place_overlay(self.renderer)
+        
+    def idle(self):
+        # Return True when nothing changes until the player acts, so the
+        # frame can sleep until the next event
+        # - self is the Scene
+        
+        return True
+    
+    
+class CharacterSelect(Scene):
+    # An object in this class is the screen where the player picks a hero,
+    # shown before anything of the overworld is built.
+    
+    FPS = 30 # The select screen never animates
+    name = "select"
+    
+    def __init__(self, game):
+        # Initialize a CharacterSelect.
+        # - self is the CharacterSelect to initialize
+        # - game is the Game playing it
+        
+        Scene.__init__(self, game)
+        
+        self.rect_swordsman = pygame.Rect(125, 200, 32, 32)
+        self.rect_archer = pygame.Rect(375, 200, 32, 32)
+        self.buttons.insert(functools.partial(game.start, "swordsman"), self.rect_swordsman) # If user clicks on swordsman
+        self.buttons.insert(functools.partial(game.start, "archer"), self.rect_archer) # If user clicks on archer
+        
+        text = "Click on the character you want to play as:"
+        self.prompt_image = text_cache.render(text, 'white')
+        self.text_pos = (50,15)
+        
+    def draw_background(self):
+        # The select screen does not change, so it is drawn once
+        # - self is the CharacterSelect
+        
+        background = self.renderer.background
+        background.fill(pygame.Color("black"))
+        background.blits([(assets.get("swordsman"), self.rect_swordsman), (assets.get("archer"), self.rect_archer),
+                          (self.prompt_image, self.text_pos)], False)
+        
+        
+class Overworld(Scene):
+    # An object in this class is the overworld: the hero walking the map
+    # until an enemy appears.
     
+    name = "overworld"
+    
+    def __init__(self, game, hero_chosen):
+        # Initialize an Overworld.
+        # - self is the Overworld to initialize
+        # - game is the Game playing it
+        # - hero_chosen is the name of the hero walking it
+        
+        Scene.__init__(self, game)
+        self.bg_color = pygame.Color('black')
+        self.character = Character(hero_chosen)
+        self.game_map = Map(game.rng) # The map is drawn into the background, again only when it scrolls
+        self.game_map.scroll(self.character.params)
+        
+        # The arrow keys walk while held
+        for key, (axis, step) in WALK_KEYS.items():
+            self.key_down[key] = functools.partial(self.walk, axis, step)
+            self.key_up[key] = functools.partial(self.walk, axis, 0)
+        self.key_down[pygame.K_F5] = game.quick_save
+        self.key_down[pygame.K_F8] = game.quick_load
+        
+    def walk(self, axis, step):
+        # Set the hero's velocity along one axis
+        # - axis is 0 for x, 1 for y
+        # - step is -1, 0 or 1
+        
+        self.character.velocity[axis] = step
+        
+    def idle(self):
+        # Return True when nothing on the overworld changes until the player
+        # presses a key, so the frame can sleep until the next event
+        # - self is the Overworld
+        
+        return self.character.velocity == [0,0]
+        
+    def draw_background(self):
+        # Draw the part of the map the camera sees. Around the map nothing
+        # changes, so that is only filled when the background is new.
+        # - self is the Overworld
+        
+        if self.renderer.background_surface is None:
+            self.renderer.background.fill(self.bg_color)
+        self.game_map.draw(self.renderer.background)
+        
     def draw(self):
         # Draw all game objects.
-        # - self is the Game to draw
+        # - self is the Overworld to draw
         
-        self.surface.fill(self.bg_color) # clear the display surface first
-        self.game_map.draw()
-        self.overworld_character.draw()
-        pygame.display.update() # make the updated surface appear on the display    
+        self.character.draw(self.renderer, self.game_map.camera)
+        self.game.timer.place_overlay(self.renderer)
         
     def update(self):
         # Update the game objects for the next frame.
-        # - self is the Game to update
+        # - self is the Overworld to update
 
-        self.overworld_character.move()
-        self.encounter = self.game_map.random_encounter(self.overworld_character.velocity)
+        distance = self.character.move(self.game_map)
+        if self.game_map.scroll(self.character.params):
+            self.renderer.repaint(self.game_map.viewport)
+        enemy_names = self.game_map.random_encounter(self.character.params.center, distance)
         
-        if self.encounter == True:
-            
-            enemy_name = random.choice(self.list_of_enemies)
+        if enemy_names is not None:
             
-            enemy = Unit(enemy_name)
+            enemies = [unit_pool.acquire(enemy_name) for enemy_name in enemy_names]
             
-            self.battle.commence(enemy, self.hero)
+            self.game.battle.start(enemies, self.game.hero)
+            self.game.push(self.game.battle)
             
-            self.overworld_character.velocity = [0,0]
+    def restore(self, position, steps_left):
+        # Put the hero back where a save left them and redraw the map
+        # - self is the Overworld
+        # - position is the hero's [x, y] in world pixels
+        # - steps_left is how far they walk before the next encounter
         
-    def decide_continue(self):
-        # Check and remember if the game should continue
-        # - self is the Game to check
-
-        if self.hero.current_hp <= 0:
-            self.continue_game = False
-            print("game over")
-            
-    def draw_end_screen(self):
+        character = self.character
+        character.velocity = [0,0]
+        character.position = list(position)
+        character.params = pygame.Rect(character.position, character.dimensions)
         
-        self.surface.fill(pygame.Color("black"))
-        font = pygame.font.SysFont('Arial', 24, 1)
-        game_over_image = font.render("GAME OVER!", True, (148, 33 , 33))
-        game_over_pos = (190, 160)
+        encounters = self.game_map.encounters
+        encounters.region = encounters.region_at(character.params.center)
+        encounters.steps_left = steps_left
+        
+        self.game_map.scroll(character.params)
+        self.renderer.repaint()
+        
+        
+class GameOver(Scene):
+    # An object in this class is the screen shown once the hero falls.
+    
+    name = "game_over"
+    
+    def __init__(self, game):
+        # Initialize a GameOver.
+        # - self is the GameOver to initialize
+        # - game is the Game playing it
         
-        self.surface.blit(game_over_image, game_over_pos)
+        Scene.__init__(self, game)
+        self.key_down[pygame.K_F8] = game.quick_load
+        
+        # The end screen only has to be drawn once
+        game_over_image = text_cache.render("GAME OVER!", (148, 33 , 33))
+        game_over_pos = (190, 160)
+        self.renderer.place("game_over", game_over_image, game_over_pos)
         
-        pygame.display.update() # make the updated surface appear on the display            
     
 class Character:
-    # An object in this class represents a character
+    # An object in this class represents the hero walking the overworld
     
-    def __init__(self, surface):
+    def __init__(self, chosen):
+        # Initialize a Character.
+        # - self is the Character to initialize
+        # - chosen is the name of the hero picked on the select screen
         
-        self.awaiting_character_select = True
-        self.surface = surface
+        self.chosen = chosen
+        self.character_image = assets.get(chosen)
         self.velocity = [0,0]
-        self.position = [15,100] 
+        self.position = [15,20] # In world pixels, the map's top left is 0,0
         self.dimensions = [32,32]
         self.params = pygame.Rect(self.position,self.dimensions)
         
-        # Do this until user choses
-        while self.awaiting_character_select == True:
-            
-            text = "Click on the character you want to play as:"
-            font = pygame.font.SysFont('Arial', 24, 1)
-            prompt_image = font.render(text, True, pygame.Color('white'))
-            text_pos = (50,15)
-            
-            self.rect_swordsman = pygame.Rect(125, 200, 32, 32)
-            self.rect_archer = pygame.Rect(375, 200, 32, 32)
-            
-            self.surface.fill(pygame.Color("black"))
-        
-            self.surface.blit(pygame.image.load("swordsman.png"), self.rect_swordsman)
-            self.surface.blit(pygame.image.load("archer.png"), self.rect_archer)
-            self.surface.blit(prompt_image, text_pos)            
-            
-            pygame.display.update()
-            
-            events = pygame.event.get()
-            for event in events:
-                if event.type == pygame.MOUSEBUTTONUP:
-                    if self.rect_swordsman.collidepoint(event.pos): # If user clicks on swordsman
-                        self.chosen = "swordsman"
-                        self.awaiting_character_select = False
-                        self.character_image = pygame.image.load("swordsman.png")
-                    elif self.rect_archer.collidepoint(event.pos): # If user clicks on archer
-                        self.chosen = "archer"
-                        self.awaiting_character_select = False
-                        self.character_image = pygame.image.load("archer.png")
-        
-    def draw(self):
+    def draw(self, renderer, camera):
+        # Place the character on the overworld scene
+        # - renderer is the Renderer drawing the overworld
+        # - camera is the Camera that turns world positions into screen ones
         
-        self.surface.blit(self.character_image, self.params)
+        renderer.place("hero", self.character_image, camera.to_screen(self.params))
         
-    def move(self):
+    def move(self, game_map):
+        # Move the character by its velocity, staying on the map and out of
+        # walls, and return how many pixels it moved (a diagonal step counts
+        # as one)
+        # - game_map is the Map the character walks on
         
-        size = self.surface.get_size()
+        start = list(self.position)
         
         for i in range(0,2):
             
             self.position[i] = (self.position[i] + self.velocity[i])
             
-            if self.position[0] < 0 or self.position[1] < 80 or self.position[i] + self.dimensions[i] > size[i]:  # check left and top or right and bottom
+            if game_map.blocked(pygame.Rect(self.position, self.dimensions)):  # check the map's edges and walls
                 
-                self.position[i] -= self.velocity[i] # undos the movement made if it made the paintbrush go out of bounds
+                self.position[i] -= self.velocity[i] # undos the movement made if it made the character go off the map or into a wall
             
         self.params = pygame.Rect(self.position, self.dimensions)
+        
+        return max(abs(self.position[0] - start[0]), abs(self.position[1] - start[1]))
     
     
 class Map:
+    # An object in this class is the overworld: a tile map larger than the
+    # screen, seen through a camera that follows the hero.
     
-    def __init__(self, surface):
+    def __init__(self, rng):
+        
+        self.rng = rng
+        self.viewport = pygame.Rect([0,80],[500,320]) # Where on the screen the map is drawn
+        self.tiles = TileMap()
+        self.rect = self.tiles.rect
+        self.camera = Camera(self.viewport, self.rect)
+        self.encounters = EncounterEngine(load_regions(), rng)
+        
+        # Walls, indexed so a query only looks at nearby ones. The placed
+        # walls are kept for good; the walls of solid tiles only for the
+        # chunks around the camera, streamed as it moves.
+        self.walls = SpatialGrid()
+        for map_object in self.tiles.objects:
+            if map_object.kind == "wall":
+                self.walls.insert(map_object, map_object.rect)
+        self.tiles.stream_walls(self.camera.rect, self.walls)
+        
+    def draw(self, surface):
+        # Draw the part of the Map the camera sees
+        # - self is the Map
+        # - surface is the surface to draw on
         
-        self.surface = surface
-        self.color = pygame.Color('brown')
-        self.params = pygame.Rect([0,80],[500,320])
+        self.tiles.draw(surface, self.camera)
         
-    def draw(self):
-        # Draw the Map on the surface
-        # - self is the Map
+    def scroll(self, target):
+        # Move the camera to follow target, bringing the walls around it.
+        # Returns True when it moved, so the map has to be drawn again;
+        # drawing is left to the scene, so a game no one watches never
+        # draws the chunks it passes.
+        # - target is a Rect in world coordinates
         
-        pygame.draw.rect(self.surface, self.color,self.params)
+        if self.camera.follow(target):
+            self.tiles.stream_walls(self.camera.rect, self.walls)
+            return True
+        return False
         
-    def random_encounter(self, velocity):
+    def blocked(self, rect):
+        # Return True when rect is off the map or overlaps a wall
+        # - rect is a Rect in world coordinates
         
-        chance_of_encounter = False
+        return not self.rect.contains(rect) or self.walls.collides(rect)
         
-        for i in range(0,2): # Check for an encounter everytime user moves
-            
-            if velocity[i] != 0:
-                
-                chance_of_encounter = True
+    def random_encounter(self, position, distance):
+        # Return the names of the enemies met after a move, or None
+        # - position is where the character now stands
+        # - distance is how many pixels it moved
         
-        if chance_of_encounter == True:
-            
-            i = random.randrange(288)
-            
-            if i == 1:
-                
-                return True
-                
-            print(i) 
-            
-        return False        
+        return self.encounters.walk(position, distance)
         
-class Battle:
+class Battle(Scene):
+    # An object in this class is a fight between the hero and a group of
+    # enemies. The turn animations run on a Timeline the game's loop
+    # advances, so events are read every frame even while they play.
     
-    def __init__(self, surface):
-        
-        self.surface = surface
+    name = "battle"
+    
+    def __init__(self, game):
+        # Initialize a Battle, ready for its first fight.
+        # - self is the Battle to initialize
+        # - game is the Game playing it
+        
+        Scene.__init__(self, game)
+        self.renderer.full_redraw = False # The intro draws over the overworld; place_fighters shows the fight
+        self.surface = game.surface
+        self.rng = game.rng
+        self.timer = game.timer
         self.background_color = pygame.Color('dark blue')
         self.background_params = pygame.Rect([0,80],[500,320])    
         self.rect_enemy = pygame.Rect(202, 200, 96, 96)
+        self.enemy_area = pygame.Rect(10, 90, 480, 206) # Where a group of enemies stands
+        self.target_images = {} # Target outlines, keyed by size
+        self.layouts = {} # Enemy rects and target grid, keyed by party size
+        self.rect_slice = pygame.Rect(200, 210, 100, 100)
+        self.timeline = Timeline() # Plays the animations without blocking events; idle between fights
         self.rect_attack1 = pygame.Rect([175,0],[32,80])
         self.rect_attack2 = pygame.Rect([207,0],[32,80])
         self.rect_defend = pygame.Rect([239,0],[32,80])
         self.rect_flee = pygame.Rect([271,0],[32,80])
         
+        self.show_hint = False # H key: outline the move with the best chance to win
+        self.autoplay = False # A key: let the solved policy play the fight
+        self.hint_image = pygame.Surface((32, 80), pygame.SRCALPHA)
+        pygame.draw.rect(self.hint_image, pygame.Color('yellow'), self.hint_image.get_rect(), 2)
+        self.action_rects = {combat.ATTACK1: self.rect_attack1, combat.ATTACK2: self.rect_attack2,
+                             combat.DEFEND: self.rect_defend, combat.FLEE: self.rect_flee}
+        for action, rect in self.action_rects.items(): # USER CHOOSES ATTACK
+            self.buttons.insert(functools.partial(self.choose, action), rect)
+        self.key_down[pygame.K_h] = self.toggle_hint
+        self.key_down[pygame.K_a] = self.toggle_autoplay
+        
+    def draw_background(self):
+        # Draw the parts of the battle scene that never change during a fight
+        # into the renderer's background
+        # - self is the Battle
+        
+        background = self.renderer.background
+        background.fill(pygame.Color("black"))
+        
+        pygame.draw.rect(background, self.background_color, self.background_params)   
+        #pygame.draw.rect(self.surface, pygame.Color("white"), self.rect_attack)
+        background.blits([(assets.get("attack1"), self.rect_attack1), (assets.get("attack2"), self.rect_attack2),
+                          (assets.get("defend"), self.rect_defend), (assets.get("flee"), self.rect_flee)], False)
+        
+    def place_fighters(self):
+        # Put the enemies and their HUD on a freshly painted battle scene
+        # - self is the Battle
+        
+        self.renderer.clear()
+        self.hud_values = None # The HUD text went with the other layers
+        for slot in range(len(self.enemies)):
+            enemy = self.enemies[slot]
+            rect = self.enemy_rects[slot]
+            self.renderer.place("enemy_" + str(slot), assets.scaled(enemy.template.image_name, rect.size), rect)
+        self.update_enemy_hud(range(len(self.enemies)))
+        self.renderer.repaint()
+        
+    def enemy_layout(self, count):
+        # Return the rect each enemy stands in: one row of full size sprites
+        # for up to four enemies, then a grid of smaller sprites that fills
+        # the battle area
+        # - count is the number of enemies
+        
+        if count <= 4:
+            columns, rows, size = count, 1, self.rect_enemy.width
+        else:
+            columns = math.ceil(math.sqrt(count * self.enemy_area.width / self.enemy_area.height))
+            rows = math.ceil(count / columns)
+            size = min(self.rect_enemy.width, self.enemy_area.width // columns, self.enemy_area.height // rows)
+        
+        left = self.enemy_area.centerx - columns * size // 2
+        top = self.enemy_area.bottom - rows * size
+        return [pygame.Rect(left + (i % columns) * size, top + (i // columns) * size, size, size) for i in range(count)]
+        
+    def update_enemy_hud(self, slots):
+        # Update what the HUD shows about some enemies after their hp
+        # changed: their hp labels, the enemy total and the target outline.
+        # Only the enemies in slots are touched, so a frame never loops over
+        # the whole group.
+        # - slots are the numbers of the enemies that changed
+        
+        group = len(self.enemies) > 1
+        for slot in slots:
+            enemy = self.enemies[slot]
+            if enemy.current_hp <= 0:
+                self.renderer.remove("enemy_" + str(slot), "enemy_hp_" + str(slot))
+            elif group:
+                self.renderer.place("enemy_hp_" + str(slot), text_cache.render(str(enemy.current_hp), 'white', SMALL_FONT), self.enemy_rects[slot])
+        
+        standing = [enemy for enemy in self.enemies if enemy.current_hp > 0]
+        if not group:
+            self.enemy_text = self.enemies[0].name.capitalize() + "! | " + str(self.enemies[0].current_hp) + "/" + str(self.enemies[0].health) # enemy health
+        else:
+            self.enemy_text = str(len(standing)) + " left | " + str(sum(enemy.current_hp for enemy in standing)) + "/" + str(sum(enemy.health for enemy in self.enemies))
+        
+        if self.enemies[self.target].current_hp <= 0 and standing:
+            self.target = self.enemies.index(standing[0])
+        if group and standing:
+            rect = self.enemy_rects[self.target]
+            self.renderer.place("target", self.target_image(rect.size), rect)
+        else:
+            self.renderer.remove("target")
+        
+    def target_image(self, size):
+        # Return the outline drawn around the targeted enemy, drawing each
+        # size once
+        # - size is the (width, height) of the enemy's rect
+        
+        image = self.target_images.get(size)
+        if image is None:
+            image = pygame.Surface(size, pygame.SRCALPHA)
+            pygame.draw.rect(image, pygame.Color('yellow'), image.get_rect(), 2)
+            self.target_images[size] = image
+        return image
         
     def draw(self):
-        # Draw the Map on the surface
-        # - self is the Map
+        # Place the HUD, unless an animation is drawing its own frames
+        # - self is the Battle
         
-        self.surface.fill(pygame.Color("black"))
+        if not self.timeline.busy():
+            self.draw_hud()
         
-        pygame.draw.rect(self.surface, self.background_color, self.background_params)   
-        #pygame.draw.rect(self.surface, pygame.Color("white"), self.rect_attack)
-        self.surface.blit(pygame.image.load("attack1.png"), self.rect_attack1)
-        self.surface.blit(pygame.image.load("attack2.png"), self.rect_attack2)
-        self.surface.blit(pygame.image.load("defend.png"), self.rect_defend)
-        self.surface.blit(pygame.image.load("flee.png"), self.rect_flee)
+    def refresh(self):
+        # Place the HUD and show it now, between an animation's keyframes
+        # - self is the Battle
+        
+        self.draw_hud()
+        self.show() # only the HUD boxes that changed are updated
+        
+    def show(self):
+        # Show what an animation placed now rather than at the end of the
+        # frame, unless no one watches the game
+        # - self is the Battle
         
-        self.surface.blit(pygame.image.load("enemy_" + self.enemy.name + ".png"), self.rect_enemy)
+        if self.game.drawing:
+            self.renderer.present()
+        
+    def draw_hud(self):
+        # Place the HUD, updating only the text that changed, and remove
+        # any attack text or animation frame left on screen
+        # - self is the Battle
+        
+        self.renderer.remove("effect", "connected", "crit_shadow", "crit", "winner")
+        
+        # Most frames show the same numbers, so the text is only looked up
+        # again when one of them changed
+        values = (self.hero.current_hp, self.hero.attack1_current_pp, self.hero.attack2_current_pp, self.enemy_text)
+        if values != self.hud_values:
+            self.hud_values = values
+            self.place_hud_text()
+        
+        if self.show_hint and self.can_attack:
+            self.renderer.place("hint", self.hint_image, self.action_rects[self.best_action()])
+        else:
+            self.renderer.remove("hint")
+        
+        self.timer.place_overlay(self.renderer)
+        
+    def place_hud_text(self):
+        # Place the hp and pp text of the HUD
+        # - self is the Battle
         
         hero_hp_text = str(self.hero.current_hp) + "/" + str(self.hero.health) # hero health
-        enemy_text = self.enemy.name.capitalize() + "! | " + str(self.enemy.current_hp) + "/" + str(self.enemy.health) # enemy health
         hero_attack1_pp_text = str(self.hero.attack1_current_pp) # hero attack 1 pp
         hero_attack2_pp_text = str(self.hero.attack2_current_pp) # hero attack 2 pp
         
-        font = pygame.font.SysFont('Arial', 24, 1)
-        enemy_image = font.render(enemy_text, True, pygame.Color('white'))
+        # Rendered strings are cached, so only values that changed are re-rendered
+        enemy_image = text_cache.render(self.enemy_text, 'white')
         enemy_text_pos = (340,25)    
-        hero_image = font.render(hero_hp_text, True, pygame.Color('white'))
+        hero_image = text_cache.render(hero_hp_text, 'white')
         hero_text_pos = (60, 25)
         
         #------------------------
         
-        font_options = pygame.font.SysFont('Arial', 24, 1)
-        hero_attack1_pp_image = font_options.render(hero_attack1_pp_text, True, pygame.Color('black'))
-        hero_attack2_pp_image = font_options.render(hero_attack2_pp_text, True, pygame.Color('black'))
+        hero_attack1_pp_image = text_cache.render(hero_attack1_pp_text, 'black')
+        hero_attack2_pp_image = text_cache.render(hero_attack2_pp_text, 'black')
         hero_attack1_pp_text_pos = (180, 48)
         hero_attack2_pp_text_pos = (218, 48)   
         
-        self.surface.blit(enemy_image, enemy_text_pos)  
-        self.surface.blit(hero_image, hero_text_pos)
-        self.surface.blit(hero_attack1_pp_image, hero_attack1_pp_text_pos)
-        self.surface.blit(hero_attack2_pp_image, hero_attack2_pp_text_pos)
-        
-         
-        
-        pygame.display.update() # make the updated surface appear on the display    
+        self.renderer.place("enemy_text", enemy_image, enemy_text_pos)  
+        self.renderer.place("hero_text", hero_image, hero_text_pos)
+        self.renderer.place("attack1_pp", hero_attack1_pp_image, hero_attack1_pp_text_pos)
+        self.renderer.place("attack2_pp", hero_attack2_pp_image, hero_attack2_pp_text_pos)
+
+    def start(self, enemies, hero):
+        # Set up a new fight without drawing anything
+        # - enemies is the list of enemy Units and hero the hero's Unit
 
-    def commence(self, enemy, hero):
-        # Draws the intro animation to fight encounter
-        # Play the game until the player presses the close box.
-        # - self is the Game that should be continued or not.
-        
         self.hero = hero
-        self.enemy = enemy
+        self.enemies = enemies
+        self.enemy_rects, self.targets = self.layout(len(enemies))
+        self.target = 0 # The enemy the hero's attacks aim at
+        self.enemy_text = ""
+        self.hud_values = None
         self.can_attack = True
-        self.close_clicked = False
-        self.continue_game = True 
-        self.game_Clock = pygame.time.Clock()
         
-        pygame.draw.circle(self.surface, pygame.Color('black'), [250,200], 25)
-        pygame.display.update()
-        pygame.time.delay(500)
-        pygame.draw.circle(self.surface, pygame.Color('black'), [250,200], 100)
-        pygame.display.update()
-        pygame.time.delay(500)
-        pygame.draw.circle(self.surface, pygame.Color('black'), [250,200], 175)
-        pygame.display.update()
-        pygame.time.delay(500)      
-        
-        while self.can_attack:  # until player clicks close box
-            # play frame
-            self.handle_events()
-            self.draw()            
-            if self.continue_game:
-                self.update()
-                self.decide_continue()
-            self.game_Clock.tick(144) # run at most with FPS Frames Per Second  
+    def layout(self, count):
+        # Return the rects a party of count enemies stands in and the grid
+        # that finds the one clicked, building them for the first party of
+        # that size only
+        # - count is the number of enemies
+        
+        found = self.layouts.get(count)
+        if found is None:
+            rects = self.enemy_layout(count)
+            targets = SpatialGrid(BUTTON_CELL) # Clicking a standing enemy targets it
+            if count > 1:
+                for slot in range(count):
+                    targets.insert(slot, rects[slot])
+            found = (rects, targets)
+            self.layouts[count] = found
+        return found
+        
+    def enter(self):
+        # Begin the fight with the intro animation
+        # - self is the Battle
+        
+        combat_log.info("battle starts", extra={"data": {"hero": self.hero.name, "enemies": [enemy.name for enemy in self.enemies]}})
+        self.timeline.start(self.intro(), "intro")
+
+    def idle(self):
+        # Return True when nothing in the battle changes until the player
+        # clicks, so the frame can sleep until the next event
+        # - self is the Battle
+        
+        return self.can_attack and not self.timeline.busy() and not self.autoplay
+        
+    def intro(self):
+        # Animation: the circles that close over the overworld before a fight
+        # - self is the Battle
+        
+        for radius in (25, 100, 175):
+            if self.game.drawing: # Drawn over the overworld's last frame, outside the renderer
+                pygame.display.update(pygame.draw.circle(self.surface, pygame.Color('black'), [250,200], radius))
+            yield 500
+        
+        self.place_fighters()
         
     def update(self):
-        # Update the game objects for the next frame.
-        # - self is the Game to update
+        # Play the animations for the time the last frame took, let autoplay
+        # move, and leave once the fight is over
+        # - self is the Battle to update
         
-        pass
+        self.timeline.advance(self.game.frame_time)
+        if self.timeline.busy():
+            return
         
+        if not self.can_attack:
+            self.game.end_battle()
+        elif self.autoplay:
+            self.start_turn(self.best_action())
         
-    def handle_events(self):
-        # Handle each user event by changing the game state appropriately.
-        # - self is the Game whose events will be handled
-
-        events = pygame.event.get()
-        for event in events:
-            if event.type == pygame.QUIT:
-                self.close_clicked = True
-            if event.type == pygame.MOUSEBUTTONUP:
-                self.handle_mouse_up(event.pos)
+    def best_action(self):
+        # Return the move with the best chance to win from the current state,
+        # looked up in the solved policy table of the hero against the
+        # targeted enemy (with a group, the best move against that enemy
+        # alone)
+        # - self is the Battle
+        
+        enemy = self.enemies[self.target]
+        return policy_table(self.hero.name, enemy.name).best_action(self.hero, enemy)
+        
+    def toggle_hint(self):
+        # Outline the move with the best chance to win, or stop (H)
+        
+        self.show_hint = not self.show_hint
+        
+    def toggle_autoplay(self):
+        # Let the solved policy play the fight, or stop (A)
+        
+        self.autoplay = not self.autoplay
         
     def handle_mouse_up(self, position):
-        # handles the MOUSEBUTTONUP event
-        # USER CHOOSES ATTACK
-        # -self is the Game object         
+        # Pick the enemy or the move clicked
+        # - self is the Battle
+        # - position is where the mouse button was released
         
-        # FIRST ATTACK
-        if self.rect_attack1.collidepoint(position) and self.hero.attack1_current_pp > 0 and self.can_attack == True : # If user clicks on the first attack
-            
-            slice_pos = (175, 360)
-            self.rect_slice= pygame.Rect(200, 210, 100, 100)
-                          
-            self.surface.blit(pygame.image.load("slice_frame1.png"), self.rect_slice)
-            pygame.display.update()
-            pygame.time.delay(60)
-            self.draw()
-            
-            self.surface.blit(pygame.image.load("slice_frame2.png"), self.rect_slice)
-            pygame.display.update()
-            pygame.time.delay(60)
-            self.draw()
-            
-            self.surface.blit(pygame.image.load("slice_frame3.png"), self.rect_slice)
-            pygame.display.update()
-            pygame.time.delay(60)
-            self.draw()            
-            
-            pygame.time.delay(500) # delay before attack
-            self.hero.attack1_current_pp = self.hero.attack1_current_pp - 1
-            self.attacks(self.hero, self.enemy, self.hero.attack)
-            
-            if self.enemy.current_hp > 0 and self.can_attack == True:
-                
-                self.attacks(self.enemy, self.hero, self.enemy.attack) # Swaps attacker and defender positions         
+        if self.timeline.busy(): # Clicks during an animation are not buffered
+            return
         
-        # SECOND ATTACK
-        if self.rect_attack2.collidepoint(position) and self.hero.attack2_current_pp > 0 and self.can_attack == True : # If user clicks on the second attack
-            
-            
-            pygame.draw.circle(self.surface, pygame.Color('red'), [250,260], 175)
-            pygame.display.update()
-            pygame.time.delay(500)
-            self.draw()
-            
-            pygame.draw.circle(self.surface, pygame.Color('red'), [250,260], 100)
-            pygame.display.update()
-            pygame.time.delay(500)
-            self.draw()
-            
-            pygame.draw.circle(self.surface, pygame.Color('red'), [250,260], 25)
-            pygame.display.update()            
-            pygame.time.delay(500)    
-            self.draw()
-            
-            self.hero.attack2_current_pp = self.hero.attack2_current_pp - 1
-            self.attacks(self.hero, self.enemy, self.hero.attack2)
-            
-            if self.enemy.current_hp > 0 and self.can_attack == True:
-                
-                self.attacks(self.enemy, self.hero, self.enemy.attack) # Swaps attacker and defender positions      
+        # PICK A TARGET
+        for slot in self.targets.query_point(position):
+            if self.enemies[slot].current_hp > 0:
+                self.target = slot
+                self.update_enemy_hud([])
         
-        # DEFEND MOVE
-        if self.rect_defend.collidepoint(position) and self.can_attack == True : # If user clicks on defend
-            pygame.time.delay(500) # delay before attack
-            
-            print("The hero is defending!")
-            
-            self.hero.defense = self.hero.defense + self.hero.increased_defence # Raise defense
-            
-            if self.enemy.current_hp > 0 and self.can_attack == True:
-                
-                self.attacks(self.enemy, self.hero, self.enemy.attack) # Swaps attacker and defender positions    
-            
-            self.hero.defense = self.hero.defense - self.hero.increased_defence # Remove defense
-         
-        # RUN MOVE   
-        if self.rect_flee.collidepoint(position) and self.can_attack == True : # If user clicks on flee
-            pygame.time.delay(500) # delay before attack
-            
-            print("The hero fled!")
-            
-            self.can_attack = False
-            
-    def decide_continue(self):
-        # Check and remember if the game should continue
-        # - self is the Game to check
-
-        pass        
+        Scene.handle_mouse_up(self, position)
+        
+    def choose(self, action):
+        # Start the hero's move, when it can be made now
+        # - action is one of combat.ACTIONS
+        
+        if self.can_attack and not self.timeline.busy() and action in combat.legal_actions(self.hero):
+            self.start_turn(action)
     
-    def attacks(self, attacker, defender, attack):
-        # Used to attack for both player and enemy
+    def start_turn(self, action):
+        # Queue the animation of the hero's move
+        # - action is one of combat.ACTIONS
         
-        attacker_name = attacker.name
-        self.str_connected = ""
-        self.str_crit = ""
+        turns = {combat.ATTACK1: self.attack1_turn, combat.ATTACK2: self.attack2_turn,
+                 combat.DEFEND: self.defend_turn, combat.FLEE: self.flee_turn}
+        
+        self.timeline.start(turns[action](), action)
+    
+    def attack1_turn(self):
+        # Animation: the hero slices with the first attack, then the enemy
+        # strikes back if it survived
+        # - self is the Battle
         
-        print("The " + attacker_name + " attacks!")
+        self.rect_slice.center = self.enemy_rects[self.target].center
+        
+        for frame, duration in assets.animation("slice"):
+            self.renderer.place("effect", frame, self.rect_slice)
+            self.show()
+            yield duration
+            self.refresh()
+        
+        yield 500 # delay before attack
+        yield from self.play_turn(combat.ATTACK1)
+    
+    def attack2_turn(self):
+        # Animation: the hero's second attack closes in on the enemy in red
+        # circles, then the enemy strikes back if it survived
+        # - self is the Battle
+        
+        center = self.enemy_rects[self.target].center
+        for radius in (175, 100, 25):
+            self.renderer.place("effect", circle_image('red', radius), [center[0] - radius, center[1] + 12 - radius])
+            self.show()
+            yield 500
+            self.refresh()
+        
+        yield from self.play_turn(combat.ATTACK2)
+    
+    def defend_turn(self):
+        # Animation: the hero raises their defense for one enemy attack
+        # - self is the Battle
+        
+        yield 500 # delay before attack
+        yield from self.play_turn(combat.DEFEND)
+    
+    def flee_turn(self):
+        # Animation: the hero runs from the fight
+        # - self is the Battle
+        
+        yield 500 # delay before attack
+        yield from self.play_turn(combat.FLEE)
+    
+    def play_turn(self, action):
+        # Animation: resolves the turn with the combat rules and shows each
+        # step as it happens
+        # - self is the Battle
+        # - action is the hero's move, one of combat.ACTIONS
+        
+        for step in combat.turn(self.hero, self.enemies, action, self.rng.combat, self.target):
+            yield from self.show_event(step)
+            
+    def show_event(self, step):
+        # Used to show the attacks of both player and enemy
+        # Animation: yields the ms each step stays on screen
+        # - step is the list of combat.Events of one step of the turn: one
+        #   strike, or a line up or enemies striking back to back
         
-        new_damage = 0
+        for event in step:
+            combat_log.info("%s %s %s", event.actor, event.action, event.target, extra={"data": event._asdict()})
         
-        i = random.randrange(100)
+        event = step[0]
         
-        if i >= defender.dodge_chance: # Check to see if move dodges       
-            print("The move will land!")
+        if event.action == combat.DEFEND:
+            return
+        
+        if event.action == combat.FLEE:
+            self.can_attack = False
+            return
+        
+        attacker_name = event.actor
+        self.str_connected = ""
+        self.str_crit = ""
+        hits = sum(1 for event in step if event.hit)
+        
+        if len(step) > 1 and event.actor == self.hero.name:
+            self.str_connected = "LINE UP! " + str(hits) + " of " + str(len(step)) + " hit!"
+        elif len(step) > 1:
+            self.str_connected = str(len(step)) + " enemies attack, " + str(hits) + " hit!"
+        elif event.hit: # Check to see if move dodges       
             self.str_connected = "The " + attacker_name.capitalize() + "'s move hit!"
-            new_damage = attack
-            i = random.randrange(100)
-            if i <= attacker.crit_chance:
-                new_damage = attack * 2
-                print("CRIT")
-                self.str_crit = "CRIT!"
-            if new_damage < defender.defense: # Atleast deal 1 damage
-                new_damage = 1
-            else:
-                new_damage = new_damage - defender.defense
         else:
-            print("The move missed")
             self.str_connected = attacker_name.capitalize() + "'s move missed!"
+        if any(event.crit for event in step):
+            self.str_crit = "CRIT!"
         
-        defender.current_hp = defender.current_hp - new_damage
-        print(str(new_damage) + " damage is dealt!")
+        if event.actor == self.hero.name:
+            self.update_enemy_hud([event.slot for event in step])
         
-        if defender.current_hp <= 0:
-            
-            defender.current_hp = 0 # No negative numbers displayed   
-        
-        self.draw() # Update health
+        self.refresh() # Update health
         
         self.text_attack() # Display attack info
             
-        pygame.time.delay(1000) # Display attack's text
+        yield 1000 # Display attack's text
             
-        self.check_for_deaths(attacker, defender)
+        yield from self.check_for_deaths(step)
         
-    def check_for_deaths(self, attacker, defender):
+    def check_for_deaths(self, step):
+        # Animation: declares the winner once the hero or every enemy is out
+        # of hp
+        # - step is the list of combat.Events just shown
         
-        if defender.current_hp <= 0:
+        if self.hero.current_hp <= 0:
+            winner = step[-1].actor # The enemy that struck last
+        elif all(enemy.current_hp <= 0 for enemy in self.enemies):
+            winner = self.hero.name
+        else:
+            return
             
-            pygame.time.delay(1000) # Delay before deaths
-            self.winner_declared(attacker.name.upper() + " WINS!")         
-            self.can_attack = False # Stop combat phase
+        yield 1000 # Delay before deaths
+        yield from self.winner_declared(winner.upper() + " WINS!")         
+        self.can_attack = False # Stop combat phase
             
                 
     def winner_declared(self, winner):
+        # Animation: shows the winner for a moment before the fight ends
         
-        font = pygame.font.SysFont('Arial', 24, 1)
-        
-        winner_image = font.render(winner, True, pygame.Color('white'))
+        winner_image = text_cache.render(winner, 'white')
         winner_text_pos = (175, 360)
                       
         
-        self.surface.blit(winner_image, winner_text_pos)
+        self.renderer.place("winner", winner_image, winner_text_pos)
         
-        pygame.display.update() # make the updated surface appear on the display   
+        self.show() # make the updated surface appear on the display   
         
-        pygame.time.delay(500)
-        pygame.time.delay(500)
-        pygame.time.delay(500) # Done to avoid windows thinking it froze
+        yield 1500
                 
     def text_attack(self):
         
-        font = pygame.font.SysFont('Arial', 24, 1)
-        
-        connected_image = font.render(self.str_connected, True, pygame.Color('white'))
+        connected_image = text_cache.render(self.str_connected, 'white')
         connected_text_pos = (175, 310)
             
         
-        crit_image1 = font.render(self.str_crit, True, (148, 33 , 33))
-        crit_image2 = font.render(self.str_crit, True, pygame.Color('Red'))
+        crit_image1 = text_cache.render(self.str_crit, (148, 33 , 33))
+        crit_image2 = text_cache.render(self.str_crit, 'Red')
         crit_text_pos1 = (175, 340)
         crit_text_pos2 = (177, 338)
                       
         
-        self.surface.blit(crit_image1, crit_text_pos1)
-        self.surface.blit(crit_image2, crit_text_pos2)
-        self.surface.blit(connected_image, connected_text_pos)         
+        self.renderer.place("crit_shadow", crit_image1, crit_text_pos1)
+        self.renderer.place("crit", crit_image2, crit_text_pos2)
+        self.renderer.place("connected", connected_image, connected_text_pos)         
         
-        pygame.display.update() # make the updated surface appear on the display    
+        self.show() # make the updated surface appear on the display    
                 
     
 
-class Unit:
-    # An object here represents a hero or enemy unit
-    
-    def __init__(self, name):
-        
-        self.name = name
-        
-        if self.name == "slime":
-            self.slime_class()
-        elif self.name == "ghost":
-            self.ghost_class()
-        elif self.name == "jaskirat":
-            self.jaskirat_class()   
-        elif self.name == "swordsman":
-            self.hero_swordsman_class()
-        elif self.name == "archer":
-            self.hero_archer_class()
-        
-    def slime_class(self):
-        self.health = 15
-        self.attack = 5
-        self.defense = 2
-        self.speed = 9
-        self.current_hp = self.health
-        self.line_up_chance = -1
-        self.dodge_chance = 1
-        self.crit_chance = 1
-        self.character_image = pygame.image.load("enemy_slime.png")        
-        
-    def ghost_class(self):
-        self.health = 13
-        self.attack = 9
-        self.defense = 1
-        self.speed = 9
-        self.current_hp = self.health
-        self.line_up_chance = -1
-        self.dodge_chance = 9
-        self.crit_chance = 4
-        self.character_image = pygame.image.load("enemy_ghost.png")       
-        
-    def jaskirat_class(self):
-        self.health = 10
-        self.attack = 1
-        self.defense = 1
-        self.speed = 0
-        self.current_hp = self.health
-        self.line_up_chance = -1
-        self.dodge_chance = 0
-        self.crit_chance = 100
-        self.character_image = pygame.image.load("enemy_jaskirat.png")     
-    
-    def hero_swordsman_class(self):
-        self.health = 20 # Total damage a user can take before dying
-        self.attack = 6 # Total damage a user can deal in a turn
-        self.attack2 = 8
-        self.defense = 4 # Total damage a user can nullify per attack
-        self.speed = 5 # Order of which player moves first
-        self.current_hp = 20
-        self.line_up_chance = -1 # Chance to strike all enemies
-        self.dodge_chance = 5 # Chance for user to dodge attack
-        self.crit_chance = 10 # % Chance to deal a critical hit
-        self.attack1_max_pp = 15
-        self.attack1_current_pp = 15
-        self.attack2_max_pp = 7
-        self.attack2_current_pp = 7
-        self.increased_defence = 5
-        self.character_image = pygame.image.load("swordsman.png")
-        
-    def hero_archer_class(self):
-        self.health = 16
-        self.attack = 4
-        self.attack2 = 11
-        self.defense = 3
-        self.speed = 9
-        self.current_hp = 16
-        self.line_up_chance = 20
-        self.dodge_chance = 9
-        self.crit_chance = 7
-        self.attack1_max_pp = 18
-        self.attack1_current_pp = 18
-        self.attack2_max_pp = 5
-        self.attack2_current_pp = 5       
-        self.increased_defence = 3
-        self.character_image = pygame.image.load("archer.png")
-        
-    
-    
-main()
+if __name__ == "__main__":
+    main()
 
 # ---------------------------------------------------------------------- GOALS
 # DONE - Game over @ 0 hero hp
@@ -625,7 +1219,7 @@ main()
 # Defend and Run animations
 # Speed Calc
 # Exp
-# Make handle_mouse_up more efficient
+# DONE - Make handle_mouse_up more efficient
 
 # Defending adds additional evasiveness
 # Line up
@@ -635,5 +1229,5 @@ main()
 # Typing
 
 # ---------------------------------------------------------------------- KNOWN BUGS
-# Attacks can be bufferred by clicking twice
-# Fix close button during combat
\ No newline at end of file
+# DONE - Attacks can be bufferred by clicking twice
+# DONE - Fix close button during combat
\ No newline at end of file
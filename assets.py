@@ -0,0 +1,149 @@
+import json, os, pygame
+
+# Folder the png files live in (the same folder as the game code)
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Images that have no transparent pixels and can be converted without alpha
+OPAQUE_IMAGES = ["attack1", "attack2", "defend", "flee"]
+
+# Images every battle and the overworld draws from
+GAME_IMAGES = ["swordsman", "archer",
+               "attack1", "attack2", "defend", "flee",
+               "slice_frame1", "slice_frame2", "slice_frame3",
+               "enemy_slime", "enemy_ghost", "enemy_jaskirat"]
+
+# Animations drawn from separate png files: name -> (frames, ms per frame)
+ANIMATIONS = {"slice": (["slice_frame1", "slice_frame2", "slice_frame3"], 60)}
+
+# The manifest of the texture every game image is packed into (built by
+# atlas.py); it lists each image's rect and the animations made from them
+ATLAS_MANIFEST = os.path.join(ASSET_DIR, "atlas.json")
+
+
+class AssetCache:
+    # An object in this class holds every image the game draws. Each png is
+    # decoded from disk once and kept as a surface converted to the display
+    # format, keyed by its file name without the ".png". When an atlas is
+    # loaded, its images are subsurfaces of one texture instead, read from
+    # disk in a single file open.
+
+    def __init__(self, directory=ASSET_DIR):
+        # Initialize an AssetCache.
+        # - self is the AssetCache to initialize
+        # - directory is the folder the png files are loaded from
+
+        self.directory = directory
+        self.surfaces = {}
+        self.atlas = None # The atlas texture, once loaded
+        self.animations = {} # name -> list of (surface, ms)
+        self.loads = 0 # Number of times a png was actually read from disk
+
+    def preload(self, names, manifest_path=ATLAS_MANIFEST):
+        # Decode every named image now so no frame has to load from disk,
+        # from the atlas when there is one.
+        # - self is the AssetCache
+        # - names is a list of image names (file names without ".png")
+        # - manifest_path is the atlas manifest to load first, if it exists
+
+        if self.atlas is None and manifest_path is not None and os.path.exists(manifest_path):
+            self.load_atlas(manifest_path)
+
+        for name in names:
+            self.get(name)
+
+    def load_atlas(self, manifest_path=ATLAS_MANIFEST):
+        # Load an atlas texture and cache a subsurface for every image in it.
+        # - self is the AssetCache
+        # - manifest_path is the atlas manifest
+
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+        self.atlas = self.load(os.path.splitext(manifest["image"])[0], True, os.path.dirname(manifest_path))
+        for name, rect in manifest["frames"].items():
+            self.surfaces[name] = self.atlas.subsurface(rect)
+
+        for name, animation in manifest["animations"].items():
+            self.animations[name] = [(self.surfaces[frame], duration)
+                                     for frame, duration in zip(animation["frames"], animation["durations"])]
+
+    def animation(self, name):
+        # Return an animation as a list of (surface, ms), from the atlas or,
+        # without one, from its separate png frames.
+        # - self is the AssetCache
+        # - name is the animation's name, like "slice"
+
+        if name not in self.animations:
+            frames, duration = ANIMATIONS[name]
+            self.animations[name] = [(self.get(frame), duration) for frame in frames]
+
+        return self.animations[name]
+
+    def get(self, name):
+        # Return the surface for an image, loading it the first time only.
+        # - self is the AssetCache
+        # - name is the image name (file name without ".png")
+
+        surface = self.surfaces.get(name)
+
+        if surface is None:
+            surface = self.load(name, name not in OPAQUE_IMAGES)
+            self.surfaces[name] = surface
+
+        return surface
+
+    def scaled(self, name, size):
+        # Return an image scaled to a size, scaling each (image, size) pair
+        # only once.
+        # - self is the AssetCache
+        # - name is the image name
+        # - size is the (width, height) to scale to
+
+        image = self.get(name)
+        if image.get_size() == tuple(size):
+            return image
+
+        key = (name, tuple(size))
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = pygame.transform.smoothscale(image, size)
+            self.surfaces[key] = surface
+        return surface
+
+    def evict(self, name=None):
+        # Drop an image and its scaled copies from the cache, or every image
+        # when name is None.
+        # - self is the AssetCache
+        # - name is the image name to drop
+
+        if name is None:
+            self.surfaces.clear()
+            self.animations.clear()
+            self.atlas = None
+        else:
+            self.surfaces.pop(name, None)
+            for key in [key for key in self.surfaces if isinstance(key, tuple) and key[0] == name]:
+                del self.surfaces[key] # The (name, size) copies scaled() made
+
+    def load(self, name, alpha, directory=None):
+        # Read one png from disk and convert it to the display's pixel format.
+        # Conversion needs a display mode, so without one the raw image is kept.
+        # - self is the AssetCache
+        # - name is the image name (file name without ".png")
+        # - alpha is False for images with no transparent pixels
+        # - directory is the folder to read from, the cache's own when None
+
+        surface = pygame.image.load(os.path.join(directory or self.directory, name + ".png"))
+        self.loads = self.loads + 1
+
+        if pygame.display.get_surface() is not None:
+            if alpha:
+                surface = surface.convert_alpha()
+            else:
+                surface = surface.convert()
+
+        return surface
+
+
+# The one cache shared by Battle, Character and Unit
+assets = AssetCache()
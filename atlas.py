@@ -0,0 +1,183 @@
+import json, os, struct, zlib
+import pygame
+from assets import ASSET_DIR, GAME_IMAGES, ANIMATIONS, ATLAS_MANIFEST
+
+# Width of the packed atlas texture in pixels
+ATLAS_WIDTH = 512
+
+# Empty pixels kept between images, so no image bleeds into its neighbour
+PADDING = 1
+
+# Aseprite chunk types read by read_aseprite
+LAYER_CHUNK = 0x2004
+CEL_CHUNK = 0x2005
+TAGS_CHUNK = 0x2018
+
+
+def read_string(data, offset):
+    # Return an aseprite STRING (a WORD length then utf-8 bytes) and the
+    # offset just past it.
+
+    length = struct.unpack_from("<H", data, offset)[0]
+    return data[offset + 2:offset + 2 + length].decode("utf-8"), offset + 2 + length
+
+
+def read_aseprite(path):
+    # Read an aseprite file and return its frames and tags. Each frame is
+    # its visible layers drawn together as (surface, ms to show it), and
+    # each tag is (name, first frame, last frame, direction). Only RGBA
+    # files are supported.
+    # - path is the .aseprite file to read
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    size, magic, frame_count, width, height, depth, flags = struct.unpack_from("<IHHHHHI", data, 0)
+    if magic != 0xA5E0:
+        raise ValueError(path + " is not an aseprite file")
+    if depth != 32:
+        raise ValueError(path + " is not an RGBA aseprite file")
+
+    layers = [] # [visible, opacity] per layer
+    frames = []
+    tags = []
+    offset = 128
+
+    for frame_number in range(frame_count):
+        frame_size, frame_magic, old_chunks, duration = struct.unpack_from("<IHHH", data, offset)
+        chunk_count = struct.unpack_from("<I", data, offset + 12)[0] or old_chunks
+        canvas = pygame.Surface((width, height), pygame.SRCALPHA)
+        cels = []
+
+        chunk = offset + 16
+        for chunk_number in range(chunk_count):
+            chunk_size, chunk_type = struct.unpack_from("<IH", data, chunk)
+            body = chunk + 6
+
+            if chunk_type == LAYER_CHUNK:
+                layer_flags = struct.unpack_from("<H", data, body)[0]
+                opacity = data[body + 12] if flags & 1 else 255
+                layers.append([layer_flags & 1, opacity])
+
+            elif chunk_type == CEL_CHUNK:
+                layer, x, y, opacity, cel_type = struct.unpack_from("<HhhBH", data, body)
+                if cel_type == 1: # Linked: the same image as an earlier frame
+                    linked = struct.unpack_from("<H", data, body + 16)[0]
+                    cels.append((layer, frames[linked][2][layer]))
+                elif cel_type in (0, 2):
+                    cel_width, cel_height = struct.unpack_from("<HH", data, body + 16)
+                    pixels = data[body + 20:chunk + chunk_size]
+                    if cel_type == 2:
+                        pixels = zlib.decompress(pixels)
+                    image = pygame.image.frombuffer(bytes(pixels), (cel_width, cel_height), "RGBA").copy()
+                    cels.append((layer, (image, (x, y), opacity)))
+
+            elif chunk_type == TAGS_CHUNK:
+                tag_count = struct.unpack_from("<H", data, body)[0]
+                tag = body + 10
+                for tag_number in range(tag_count):
+                    first, last, direction = struct.unpack_from("<HHB", data, tag)
+                    name, tag = read_string(data, tag + 17)
+                    tags.append((name, first, last, direction))
+
+            chunk = chunk + chunk_size
+
+        by_layer = {}
+        for layer, cel in sorted(cels, key=lambda cel: cel[0]):
+            by_layer[layer] = cel
+            image, position, opacity = cel
+            visible, layer_opacity = layers[layer] if layer < len(layers) else (1, 255)
+            if visible:
+                image = image.copy()
+                image.set_alpha(opacity * layer_opacity // 255)
+                canvas.blit(image, position)
+
+        frames.append((canvas, duration, by_layer))
+        offset = offset + frame_size
+
+    return [(canvas, duration) for canvas, duration, by_layer in frames], tags
+
+
+def pack(sizes, width=ATLAS_WIDTH):
+    # Place rectangles in rows ("shelves"), tallest first, and return each
+    # one's position and the height the rows need.
+    # - sizes is a dict from name to (width, height)
+    # - width is the width of the texture to fill
+
+    positions = {}
+    x = y = shelf_height = 0
+
+    for name in sorted(sizes, key=lambda name: (-sizes[name][1], name)):
+        w, h = sizes[name]
+        if w > width:
+            raise ValueError(name + " is wider than the atlas")
+        if x + w > width:
+            x = 0
+            y = y + shelf_height + PADDING
+            shelf_height = 0
+        positions[name] = (x, y)
+        x = x + w + PADDING
+        shelf_height = max(shelf_height, h)
+
+    return positions, y + shelf_height
+
+
+def build(names=GAME_IMAGES, directory=ASSET_DIR, manifest_path=ATLAS_MANIFEST):
+    # Pack every game image into one png and write a manifest of where each
+    # one is, plus the animations made from them. An image with an
+    # .aseprite source is read from it: its first frame keeps the image's
+    # name, later frames are named image_1, image_2..., and its tags become
+    # animations ("image" when it has none).
+    # - names are the images to pack (file names without extension)
+    # - directory is the folder the images live in
+    # - manifest_path is the manifest to write; the png goes next to it
+
+    images = {}
+    animations = {}
+
+    for name in names:
+        source = os.path.join(directory, name + ".aseprite")
+        if not os.path.exists(source):
+            images[name] = pygame.image.load(os.path.join(directory, name + ".png"))
+            continue
+
+        frames, tags = read_aseprite(source)
+        frame_names = [name] + [name + "_" + str(number) for number in range(1, len(frames))]
+        for frame_name, (canvas, duration) in zip(frame_names, frames):
+            images[frame_name] = canvas
+        for tag, first, last, direction in tags or [(name, 0, len(frames) - 1, 0)]:
+            order = list(range(first, last + 1))
+            if direction == 1: # Reverse
+                order.reverse()
+            elif direction == 2: # Ping-pong
+                order = order + order[-2:0:-1]
+            animations[tag] = {"frames": [frame_names[i] for i in order],
+                               "durations": [frames[i][1] for i in order]}
+
+    for animation, (frame_names, duration) in ANIMATIONS.items():
+        animations[animation] = {"frames": frame_names, "durations": [duration] * len(frame_names)}
+
+    positions, height = pack({name: image.get_size() for name, image in images.items()})
+    texture = pygame.Surface((ATLAS_WIDTH, height), pygame.SRCALPHA)
+    frames = {}
+    for name in names + sorted(set(images) - set(names)):
+        texture.blit(images[name], positions[name])
+        frames[name] = list(positions[name]) + list(images[name].get_size())
+
+    image_name = os.path.splitext(os.path.basename(manifest_path))[0] + ".png"
+    pygame.image.save(texture, os.path.join(os.path.dirname(manifest_path), image_name))
+
+    # One line per image and animation keeps the manifest easy to diff
+    lines = ['{', '  "image": ' + json.dumps(image_name) + ',', '  "frames": {']
+    lines.append(",\n".join("    %s: %s" % (json.dumps(name), json.dumps(rect)) for name, rect in frames.items()))
+    lines.append('  },')
+    lines.append('  "animations": {')
+    lines.append(",\n".join("    %s: %s" % (json.dumps(name), json.dumps(animation)) for name, animation in animations.items()))
+    lines.append('  }')
+    lines.append('}')
+    with open(manifest_path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,171 @@
+import argparse, time
+import numpy as np
+import combat
+from unit import Unit, names
+
+# Every hero and enemy a balance report covers
+HEROES = names("hero")
+ENEMIES = names("enemy")
+
+# Moves as numbers, so a whole population's choices fit in one array
+ATTACK1, ATTACK2, DEFEND = 0, 1, 2
+
+# Fights still going after this many turns count as draws
+MAX_TURNS = 500
+
+
+def strongest_policy(pp1, pp2):
+    # Use the second attack while it has pp, then the first, then defend.
+    # - pp1 and pp2 are arrays of each fight's remaining attack pp
+
+    return np.where(pp2 > 0, ATTACK2, np.where(pp1 > 0, ATTACK1, DEFEND))
+
+
+def attack1_policy(pp1, pp2):
+    # Use the first attack while it has pp, then the second, then defend.
+    # - pp1 and pp2 are arrays of each fight's remaining attack pp
+
+    return np.where(pp1 > 0, ATTACK1, np.where(pp2 > 0, ATTACK2, DEFEND))
+
+
+POLICIES = {"strongest": strongest_policy, "attack1": attack1_policy}
+
+
+def strike(rng, attack, crit_chance, defender_defense, dodge_chance):
+    # Roll one swing for every fight at once and return the damage dealt,
+    # using the same rules as combat.strike.
+    # - rng is a numpy Generator
+    # - attack is an array (or number) of each swing's move damage
+    # - crit_chance is the attacker's crit chance
+    # - defender_defense is an array (or number) of the defender's defense
+    # - dodge_chance is the defender's dodge chance
+
+    return combat.rolls(rng, attack, crit_chance, defender_defense, dodge_chance)[2]
+
+
+def simulate(hero, enemy, n, rng, policy=strongest_policy):
+    # Play n fights between hero and enemy at once and return, for each
+    # fight, whether the hero won, how many turns it took and the hero's
+    # hp at the end. Fights that are over are dropped from the arrays, so
+    # each turn only costs as much as the fights still going. A faster
+    # enemy strikes before the hero moves, like combat.initiative orders it.
+    # - hero and enemy are units (any objects with Unit's stats)
+    # - n is the number of fights
+    # - rng is a numpy Generator
+    # - policy picks the hero's moves from their remaining pp
+
+    won = np.zeros(n, dtype=bool)
+    turns = np.full(n, MAX_TURNS, dtype=np.int32)
+    hero_hp_left = np.zeros(n, dtype=np.int32)
+
+    index = np.arange(n)
+    hero_hp = np.full(n, hero.current_hp, dtype=np.int32)
+    enemy_hp = np.full(n, enemy.current_hp, dtype=np.int32)
+    pp1 = np.full(n, hero.attack1_current_pp, dtype=np.int32)
+    pp2 = np.full(n, hero.attack2_current_pp, dtype=np.int32)
+
+    for turn in range(1, MAX_TURNS + 1):
+        if len(index) == 0:
+            break
+
+        action = policy(pp1, pp2)
+        attacking = action != DEFEND
+        pp1 = pp1 - (action == ATTACK1)
+        pp2 = pp2 - (action == ATTACK2)
+
+        power = np.where(action == ATTACK2, hero.attack2, hero.attack)
+        defense = np.where(attacking, hero.defense, hero.defense + hero.increased_defence)
+
+        if enemy.speed > hero.speed:
+            # The enemy strikes first, then the hero moves if they survived
+            hero_hp = hero_hp - strike(rng, enemy.attack, enemy.crit_chance, defense, hero.dodge_chance)
+            damage = strike(rng, power, hero.crit_chance, enemy.defense, enemy.dodge_chance)
+            enemy_hp = enemy_hp - np.where(attacking & (hero_hp > 0), damage, 0)
+        else:
+            # The hero moves first, then the enemy strikes back if it survived
+            damage = strike(rng, power, hero.crit_chance, enemy.defense, enemy.dodge_chance)
+            enemy_hp = enemy_hp - np.where(attacking, damage, 0)
+            damage = strike(rng, enemy.attack, enemy.crit_chance, defense, hero.dodge_chance)
+            hero_hp = hero_hp - np.where(enemy_hp > 0, damage, 0)
+        enemy_alive = enemy_hp > 0
+
+        # Record the fights that ended and keep only the ones still going
+        over = ~enemy_alive | (hero_hp <= 0)
+        ended = index[over]
+        won[ended] = ~enemy_alive[over]
+        turns[ended] = turn
+        hero_hp_left[ended] = np.maximum(hero_hp[over], 0)
+
+        going = ~over
+        index = index[going]
+        hero_hp = hero_hp[going]
+        enemy_hp = enemy_hp[going]
+        pp1 = pp1[going]
+        pp2 = pp2[going]
+
+    hero_hp_left[index] = hero_hp # Draws keep the hp they had left
+    return won, turns, hero_hp_left
+
+
+def undecided(won, hero_hp_left):
+    # Return which fights were still going after MAX_TURNS: the hero is
+    # standing and did not win, so the enemy is standing too. A fight won
+    # or lost on the last turn is not one of them.
+    # - won and hero_hp_left are the arrays simulate returned
+
+    return ~won & (hero_hp_left > 0)
+
+
+def report(hero, enemy, n, rng, policy=strongest_policy):
+    # Simulate one matchup and return a dict of its balance numbers:
+    # win rate, draw rate, expected hp lost, and turn statistics.
+    # - hero and enemy are units
+    # - n is the number of fights
+    # - rng is a numpy Generator
+    # - policy picks the hero's moves from their remaining pp
+
+    won, turns, hero_hp_left = simulate(hero, enemy, n, rng, policy)
+    drawn = undecided(won, hero_hp_left)
+    kill_turns = turns[won]
+
+    return {
+        "hero": hero.name,
+        "enemy": enemy.name,
+        "fights": n,
+        "win_rate": won.mean(),
+        "draw_rate": drawn.mean(),
+        "hp_lost": hero.current_hp - hero_hp_left.mean(),
+        "turns_mean": turns[~drawn].mean() if (~drawn).any() else float("nan"),
+        "kill_turns_p50": np.percentile(kill_turns, 50) if len(kill_turns) else float("nan"),
+        "kill_turns_p95": np.percentile(kill_turns, 95) if len(kill_turns) else float("nan"),
+        "kill_turns": np.bincount(kill_turns), # How many wins took each number of turns
+    }
+
+
+def main():
+    # Print the balance numbers for every hero and enemy pair.
+
+    parser = argparse.ArgumentParser(description="Monte Carlo balance report for every hero/enemy matchup.")
+    parser.add_argument("-n", "--fights", type=int, default=1000000, help="fights per matchup")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="strongest", help="how the hero picks moves")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    policy = POLICIES[args.policy]
+
+    print("%-10s %-10s %8s %8s %8s %8s %6s %6s" % ("hero", "enemy", "win", "draw", "hp lost", "turns", "p50", "p95"))
+
+    for hero_name in HEROES:
+        for enemy_name in ENEMIES:
+            start = time.perf_counter()
+            row = report(Unit(hero_name), Unit(enemy_name), args.fights, rng, policy)
+            seconds = time.perf_counter() - start
+
+            print("%-10s %-10s %7.2f%% %7.2f%% %8.2f %8.2f %6.0f %6.0f  (%.2fs)" % (
+                row["hero"], row["enemy"], row["win_rate"] * 100, row["draw_rate"] * 100,
+                row["hp_lost"], row["turns_mean"], row["kill_turns_p50"], row["kill_turns_p95"], seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse, contextlib, json, os, platform, random, sys, time
+
+# The benchmarks run without a window or GPU
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import combat
+from assets import assets, GAME_IMAGES
+from text_cache import text_cache
+from profiler import FrameTimer
+from replay import InputRecorder
+from rng import SessionRNG
+from unit import Unit
+
+SEED = 1234
+
+# A benchmark is slower than its baseline when it takes this much longer
+DEFAULT_TOLERANCE = 0.25
+
+
+class CallCounter:
+    # An object in this class counts calls to the pygame functions that
+    # should never run inside a frame (image decoding and font lookup), by
+    # wrapping them while a benchmark runs.
+
+    WATCHED = [(pygame.image, "load"), (pygame.font, "SysFont"), (pygame.font, "Font")]
+
+    def __init__(self):
+        # Initialize a CallCounter.
+        # - self is the CallCounter to initialize
+
+        self.counts = {}
+        self.originals = []
+
+    def __enter__(self):
+        for module, name in self.WATCHED:
+            original = getattr(module, name)
+            self.originals.append((module, name, original))
+            setattr(module, name, self.wrap(name, original))
+        return self
+
+    def __exit__(self, *exc):
+        for module, name, original in self.originals:
+            setattr(module, name, original)
+        self.originals = []
+
+    def wrap(self, name, original):
+        # Return a function that counts a call and then makes it.
+
+        def counted(*args, **kwargs):
+            self.counts[name] = self.counts.get(name, 0) + 1
+            return original(*args, **kwargs)
+
+        return counted
+
+
+def make_game(module, seed):
+    # Build a Game the same way main() does once the swordsman is picked.
+    # - module is the game module
+    # - seed is the session seed
+
+    rng = SessionRNG(seed)
+    game = module.Game(pygame.display.get_surface(), InputRecorder(seed), rng, FrameTimer(144))
+    game.start("swordsman")
+    game.switch_scenes()
+    return game
+
+
+def bench_overworld_draw(game, frames):
+    # The overworld frame: scroll, draw and present while the hero walks
+    # back and forth, with every fourth frame standing still.
+
+    overworld = game.overworld
+    character = overworld.character
+    character.position = list(overworld.game_map.tiles.rect.center) # Far enough from the edges to scroll
+    for frame in range(frames):
+        if frame % 4 == 3:
+            character.velocity = [0, 0]
+        else:
+            character.velocity = [1 if frame % 200 < 100 else -1, 0]
+        character.move(overworld.game_map)
+        if overworld.game_map.scroll(character.params):
+            overworld.renderer.repaint(overworld.game_map.viewport)
+        overworld.draw()
+        overworld.renderer.present()
+
+
+def bench_move_encounter(game, frames):
+    # The overworld update: Character.move plus the encounter roll.
+
+    character = game.overworld.character
+    game_map = game.overworld.game_map
+    character.velocity = [1, 1]
+    for frame in range(frames):
+        if frame % 200 == 100:
+            character.velocity = [-character.velocity[0], -character.velocity[1]]
+        distance = character.move(game_map)
+        game_map.random_encounter(character.params.center, distance)
+
+
+def bench_move_walls(game, frames):
+    # Character.move on a map with thousands more walls than the real one,
+    # which should cost about the same as bench_move_encounter.
+
+    game_map = game.overworld.game_map
+    route = game.overworld.character.params.inflate(240, 240) # Where bench_move_encounter walks, kept clear
+    wall_rng = random.Random(SEED)
+    placed = 0
+    while placed < 5000:
+        wall = pygame.Rect(wall_rng.randrange(game_map.tiles.rect.left, game_map.tiles.rect.right - 16, 16),
+                           wall_rng.randrange(game_map.tiles.rect.top, game_map.tiles.rect.bottom - 16, 16), 16, 16)
+        if not wall.colliderect(route):
+            game_map.walls.insert("wall", wall)
+            placed = placed + 1
+    bench_move_encounter(game, frames)
+
+
+def bench_battle_draw(game, frames):
+    # The battle frame: draw the HUD while hp and pp change now and then.
+
+    battle = game.battle
+    hero = Unit("swordsman")
+    enemy = Unit("slime")
+    battle.start([enemy], hero)
+    battle.place_fighters()
+    for frame in range(frames):
+        if frame % 50 == 0:
+            enemy.current_hp = enemy.health - (frame // 50) % enemy.health
+            hero.attack1_current_pp = hero.attack1_max_pp - (frame // 50) % hero.attack1_max_pp
+            battle.update_enemy_hud([0])
+        battle.refresh()
+
+
+def bench_combat_turns(game, turns):
+    # Combat turn resolution with no display involved.
+
+    rng = random.Random(SEED)
+    hero = Unit("swordsman")
+    enemy = Unit("ghost")
+    for i in range(turns):
+        hero.current_hp = hero.health
+        hero.attack1_current_pp = hero.attack1_max_pp
+        enemy.current_hp = enemy.health
+        for step in combat.turn(hero, [enemy], combat.ATTACK1, rng):
+            pass
+
+
+def bench_combat_party(game, turns):
+    # Combat turns against a large party, where the enemies' attacks are
+    # rolled together.
+
+    rng = random.Random(SEED)
+    hero = Unit("archer")
+    enemies = [Unit("slime") for i in range(24)]
+    for i in range(turns):
+        hero.current_hp = hero.health
+        hero.attack1_current_pp = hero.attack1_max_pp
+        for enemy in enemies:
+            enemy.current_hp = enemy.health
+        for step in combat.turn(hero, enemies, combat.ATTACK1, rng):
+            pass
+
+
+# name -> (function, iterations per run)
+BENCHMARKS = {
+    "overworld_draw": (bench_overworld_draw, 2000),
+    "move_encounter": (bench_move_encounter, 20000),
+    "move_walls": (bench_move_walls, 20000),
+    "battle_draw": (bench_battle_draw, 2000),
+    "combat_turns": (bench_combat_turns, 20000),
+    "combat_party": (bench_combat_party, 2000),
+}
+
+
+def run(module, names, repeats, seed):
+    # Run the benchmarks and return their results: the best and median time
+    # per iteration in microseconds, and the watched pygame calls made
+    # over every repeat.
+    # - module is the game module
+    # - names are the benchmarks to run
+    # - repeats is how many times each benchmark is timed
+    # - seed is the session seed
+
+    results = {}
+
+    for name in names:
+        function, iterations = BENCHMARKS[name]
+        times = []
+        calls = {}
+
+        for repeat in range(repeats):
+            game = make_game(module, seed)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), CallCounter() as counter:
+                start = time.perf_counter()
+                function(game, iterations)
+                times.append((time.perf_counter() - start) / iterations * 1e6)
+            for call, count in counter.counts.items():
+                calls[call] = calls.get(call, 0) + count
+
+        times.sort()
+        results[name] = {"iterations": iterations, "best_us": times[0],
+                         "median_us": times[len(times) // 2], "calls": calls}
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Return a list of regressions: any benchmark that loads an image or
+    # looks up a font while it runs, and benchmarks slower than their
+    # baseline by more than tolerance.
+    # - results is a dict from run()
+    # - baseline is a dict from an earlier run(), or None
+    # - tolerance is the allowed slowdown, 0.25 for 25%
+
+    regressions = []
+
+    for name, result in results.items():
+        for call, count in result["calls"].items():
+            regressions.append("%s: %d calls to %s in the hot path" % (name, count, call))
+
+        base = (baseline or {}).get(name)
+        if base is not None and result["best_us"] > base["best_us"] * (1 + tolerance):
+            regressions.append("%s: %.2fus per iteration, baseline %.2fus" % (name, result["best_us"], base["best_us"]))
+
+    return regressions
+
+
+def main():
+    # Run the benchmarks headlessly and compare them with a baseline.
+
+    parser = argparse.ArgumentParser(description="Headless benchmarks of the render, encounter and combat hot paths.")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all of %s)" % ", ".join(BENCHMARKS))
+    parser.add_argument("--repeats", type=int, default=5, help="times each benchmark is timed")
+    parser.add_argument("--seed", type=int, default=SEED, help="session seed")
+    parser.add_argument("--output", default="bench_results.json", help="file to write the results to")
+    parser.add_argument("--baseline", help="results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: " + name)
+
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_mode((500, 400))
+    assets.preload(GAME_IMAGES)
+
+    import DragonQuestModelOptions as module
+    text_cache.preload(module.GAME_FONTS) # As main() does, so no benchmark pays for a font lookup
+
+    results = run(module, names, args.repeats, args.seed)
+
+    with open(args.output, "w") as file:
+        json.dump({"python": platform.python_version(), "pygame": pygame.version.ver,
+                   "seed": args.seed, "results": results}, file, indent=2)
+
+    for name, result in results.items():
+        print("%-16s best %9.2fus  median %9.2fus  calls %s" % (name, result["best_us"], result["median_us"], result["calls"] or "none"))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
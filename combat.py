@@ -0,0 +1,276 @@
+import copy, heapq, itertools
+from collections import namedtuple
+
+# numpy is imported by the functions that roll many swings at once, so a
+# 1v1 fight (and every tool that imports combat) never waits for it to load
+
+# The moves a hero can pick in a battle
+ATTACK1 = "attack1"
+ATTACK2 = "attack2"
+DEFEND = "defend"
+FLEE = "flee"
+ACTIONS = [ATTACK1, ATTACK2, DEFEND, FLEE]
+
+# The hero's place in a turn order; enemies are numbered from 0
+HERO = -1
+
+# One thing that happened in a fight
+# - actor is the name of the unit that acted
+# - action is the move it made (ATTACK1, ATTACK2, DEFEND, FLEE, or
+#   "attack" for an enemy's strike)
+# - target is the name of the unit it was aimed at, None for defend/flee
+# - hit is True when the strike was not dodged
+# - crit is True when the strike dealt double damage
+# - damage is the hp the target lost
+# - target_hp is the target's hp after the strike
+# - slot is the number of the enemy that acted or was struck, None when
+#   only the hero was involved
+Event = namedtuple("Event", "actor action target hit crit damage target_hp slot", defaults=(None,))
+
+# The result of a whole fight
+# - winner is the name of the unit that won, None if nobody died
+# - turns is the number of turns taken
+# - events is the list of every Event in order
+FightResult = namedtuple("FightResult", "winner turns events")
+
+
+def strike(attacker, defender, attack, rng, action="attack", defense=None, slot=None):
+    # Resolve one swing from attacker at defender, lowering the defender's
+    # current_hp, and return the Event describing it.
+    # - attacker and defender are units (any objects with Unit's stats)
+    # - attack is the damage of the move being used
+    # - rng is a random.Random (or the random module) to roll with
+    # - action is the name of the move for the event log
+    # - defense replaces the defender's defense (while defending)
+    # - slot is the enemy's number, for the event
+
+    if defense is None:
+        defense = defender.defense
+
+    new_damage = 0
+    crit = False
+    hit = rng.randrange(100) >= defender.dodge_chance # Check to see if move dodges
+
+    if hit:
+        new_damage = attack
+        if rng.randrange(100) <= attacker.crit_chance:
+            new_damage = attack * 2
+            crit = True
+        if new_damage < defense: # Atleast deal 1 damage
+            new_damage = 1
+        else:
+            new_damage = new_damage - defense
+
+    defender.current_hp = defender.current_hp - new_damage
+
+    if defender.current_hp <= 0:
+        defender.current_hp = 0 # No negative numbers displayed
+
+    return Event(attacker.name, action, defender.name, hit, crit, new_damage, defender.current_hp, slot)
+
+
+def rolls(generator, attack, crit_chance, defense, dodge_chance):
+    # Roll many swings at once with the rules of strike and return three
+    # arrays: which swings hit, which crit, and the damage each dealt.
+    # - generator is a numpy Generator
+    # - attack, crit_chance, defense and dodge_chance are numbers or
+    #   arrays, one entry per swing
+
+    import numpy as np
+    size = np.broadcast(attack, crit_chance, defense, dodge_chance).shape
+    hit = generator.integers(100, size=size) >= dodge_chance
+    crit = generator.integers(100, size=size) <= crit_chance
+
+    damage = np.where(crit, attack * 2, attack)
+    damage = np.where(damage < defense, 1, damage - defense) # Atleast deal 1 damage
+    return hit, hit & crit, np.where(hit, damage, 0)
+
+
+def line_up(hero, enemies, slots, attack, rng, action):
+    # Resolve one swing from the hero at every enemy in slots in a single
+    # vectorized pass, and return the list of Events.
+    # - hero is the hero unit
+    # - enemies is the list of enemy units
+    # - slots are the numbers of the enemies struck
+    # - attack is the damage of the move being used
+    # - rng is a random.Random; one number from it seeds the pass
+    # - action is the name of the move for the event log
+
+    import numpy as np
+    struck = [enemies[slot] for slot in slots]
+    defense = np.array([enemy.defense for enemy in struck])
+    dodge_chance = np.array([enemy.dodge_chance for enemy in struck])
+    hp = np.array([enemy.current_hp for enemy in struck])
+
+    hit, crit, damage = rolls(np.random.default_rng(rng.getrandbits(64)), attack, hero.crit_chance, defense, dodge_chance)
+    hp_left = np.maximum(hp - damage, 0).tolist() # No negative numbers displayed
+
+    events = []
+    for enemy, slot, left, was_hit, was_crit, dealt in zip(struck, slots, hp_left, hit.tolist(), crit.tolist(), damage.tolist()):
+        enemy.current_hp = left
+        events.append(Event(hero.name, action, enemy.name, was_hit, was_crit, dealt, left, slot))
+    return events
+
+
+def volley(hero, enemies, slots, rng, defense=None):
+    # Resolve a strike at the hero from every enemy in slots, in order, and
+    # return the list of Events. More than one strike is rolled in a single
+    # vectorized pass; the strikes stop once the hero is out of hp.
+    # - hero is the hero unit
+    # - enemies is the list of enemy units
+    # - slots are the numbers of the enemies striking, in turn order
+    # - rng is a random.Random
+    # - defense replaces the hero's defense (while defending)
+
+    if len(slots) == 1:
+        return [strike(enemies[slots[0]], hero, enemies[slots[0]].attack, rng, defense=defense, slot=slots[0])]
+
+    import numpy as np
+    if defense is None:
+        defense = hero.defense
+    strikers = [enemies[slot] for slot in slots]
+    attack = np.array([enemy.attack for enemy in strikers])
+    crit_chance = np.array([enemy.crit_chance for enemy in strikers])
+
+    hit, crit, damage = rolls(np.random.default_rng(rng.getrandbits(64)), attack, crit_chance, defense, hero.dodge_chance)
+    hp_left = hero.current_hp - np.cumsum(damage)
+    dead = np.flatnonzero(hp_left <= 0)
+    count = dead[0] + 1 if len(dead) else len(slots) # Strikes after the hero died never happen
+
+    hp_left = np.maximum(hp_left[:count], 0).tolist()
+    hero.current_hp = hp_left[-1]
+    return [Event(enemy.name, "attack", hero.name, was_hit, was_crit, dealt, left, slot)
+            for enemy, slot, left, was_hit, was_crit, dealt
+            in zip(strikers, slots, hp_left, hit.tolist(), crit.tolist(), damage.tolist())]
+
+
+def initiative(hero, enemies):
+    # Return the turn order of everyone still standing, fastest first, as
+    # slots (HERO or an enemy's number). The hero wins ties, then enemies
+    # act in the order they are listed.
+    # - hero is the hero unit
+    # - enemies is the list of enemy units
+
+    queue = [(-hero.speed, -1, HERO)]
+    for slot, enemy in enumerate(enemies):
+        if enemy.current_hp > 0:
+            queue.append((-enemy.speed, slot, slot))
+    heapq.heapify(queue)
+
+    return [heapq.heappop(queue)[2] for i in range(len(queue))]
+
+
+def legal_actions(hero):
+    # Return the moves the hero can pick right now (attacks need pp).
+    # - hero is the hero unit
+
+    actions = []
+    if hero.attack1_current_pp > 0:
+        actions.append(ATTACK1)
+    if hero.attack2_current_pp > 0:
+        actions.append(ATTACK2)
+    actions.append(DEFEND)
+    actions.append(FLEE)
+    return actions
+
+
+def strongest_actions(hero):
+    # Return the endless move sequence of a hero who uses the second attack
+    # while it has pp, then the first attack, then defends.
+    # - hero is the hero unit
+
+    return itertools.chain([ATTACK2] * hero.attack2_current_pp,
+                           [ATTACK1] * hero.attack1_current_pp,
+                           itertools.repeat(DEFEND))
+
+
+def turn(hero, enemies, action, rng, target=0):
+    # Play one turn. Fleeing ends the fight at once and defending raises
+    # the hero's defense for the whole turn; then everyone still standing
+    # acts in initiative order, the hero making their move and each enemy
+    # striking the hero. This is a generator that yields each step of the
+    # turn as a list of Events as it happens (one for a single strike,
+    # more for a line up or for enemies striking back to back), so units
+    # hold the state of that moment when it is shown.
+    # - hero is the hero unit
+    # - enemies is the list of enemy units
+    # - action is one of ACTIONS
+    # - rng is a random.Random (or the random module) to roll with
+    # - target is the number of the enemy the hero attacks, or the first
+    #   one standing when it is down
+
+    if action == ATTACK1 and hero.attack1_current_pp <= 0:
+        raise ValueError("attack1 has no pp left")
+    if action == ATTACK2 and hero.attack2_current_pp <= 0:
+        raise ValueError("attack2 has no pp left")
+    if action not in ACTIONS:
+        raise ValueError("unknown action: " + str(action))
+
+    defense = None
+    if action in (DEFEND, FLEE):
+        yield [Event(hero.name, action, None, False, False, 0, hero.current_hp)]
+        if action == FLEE:
+            return
+        defense = hero.defense + hero.increased_defence # Raise defense for this turn
+
+    order = initiative(hero, enemies)
+    while order:
+        if hero.current_hp <= 0:
+            return
+        standing = [slot for slot in range(len(enemies)) if enemies[slot].current_hp > 0]
+        if not standing:
+            return
+
+        if order[0] != HERO:
+            # Every enemy up to the hero's move strikes back to back
+            count = order.index(HERO) if HERO in order else len(order)
+            slots = [slot for slot in order[:count] if enemies[slot].current_hp > 0]
+            order = order[count:]
+            if slots:
+                yield volley(hero, enemies, slots, rng, defense)
+            continue
+
+        order = order[1:]
+        if defense is not None:
+            continue
+
+        if action == ATTACK1:
+            hero.attack1_current_pp = hero.attack1_current_pp - 1
+            attack = hero.attack
+        else:
+            hero.attack2_current_pp = hero.attack2_current_pp - 1
+            attack = hero.attack2
+
+        if len(standing) > 1 and rng.randrange(100) < hero.line_up_chance: # Strike every enemy at once
+            yield line_up(hero, enemies, standing, attack, rng, action)
+        else:
+            slot = target if target in standing else standing[0]
+            yield [strike(hero, enemies[slot], attack, rng, action, slot=slot)]
+
+
+def fight(hero, enemies, actions, rng):
+    # Play a whole fight without a display and return its FightResult.
+    # The units passed in are copied, not changed.
+    # - hero is the hero unit
+    # - enemies is the list of enemy units
+    # - actions is an iterable of the hero's moves, one per turn
+    # - rng is a random.Random (or the random module) to roll with
+
+    hero = copy.copy(hero)
+    enemies = [copy.copy(enemy) for enemy in enemies]
+    events = []
+    turns = 0
+
+    for action in actions:
+        turns = turns + 1
+        for step in turn(hero, enemies, action, rng):
+            events.extend(step)
+
+        if hero.current_hp <= 0:
+            return FightResult(events[-1].actor, turns, events) # The enemy that struck last
+        if all(enemy.current_hp <= 0 for enemy in enemies):
+            return FightResult(hero.name, turns, events)
+        if action == FLEE:
+            break
+
+    return FightResult(None, turns, events)
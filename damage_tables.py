@@ -0,0 +1,177 @@
+import functools, itertools
+from collections import namedtuple
+import combat
+from unit import Unit
+
+# Fights still going after this many turns count as draws
+MAX_TURNS = 200
+
+# The exact outcome of a fight, turn by turn
+# - win[t] is the chance the hero wins on turn t + 1
+# - loss[t] is the chance the hero dies on turn t + 1
+# - draw is the chance nobody has died after MAX_TURNS turns
+# - win_rate is the chance the hero wins at all
+# - expected_turns is the average length of the fights that end
+FightTable = namedtuple("FightTable", "win loss draw win_rate expected_turns")
+
+
+@functools.lru_cache(maxsize=None)
+def swing_distribution(attack, crit_chance, defense, dodge_chance):
+    # Return the exact damage a swing deals as a tuple of (damage, chance)
+    # pairs, following combat.strike: the swing lands when randrange(100)
+    # >= dodge_chance, and crits when randrange(100) <= crit_chance (so
+    # crit_chance + 1 of the 100 rolls crit).
+    # - attack is the damage of the move being used
+    # - crit_chance is the attacker's crit chance
+    # - defense is the defender's defense at the time of the swing
+    # - dodge_chance is the defender's dodge chance
+
+    hit = min(max(100 - dodge_chance, 0), 100) / 100
+    crit = min(max(crit_chance + 1, 0), 100) / 100
+
+    chances = {}
+    for damage, chance in ((0, 1 - hit), (attack, hit * (1 - crit)), (attack * 2, hit * crit)):
+        if damage > 0:
+            if damage < defense: # Atleast deal 1 damage
+                damage = 1
+            else:
+                damage = damage - defense
+        if chance > 0:
+            chances[damage] = chances.get(damage, 0) + chance
+
+    return tuple(sorted(chances.items()))
+
+
+def hero_swing(hero, enemy, move):
+    # Return the damage distribution of the hero's move against the enemy.
+    # - hero and enemy are units
+    # - move is combat.ATTACK1 or combat.ATTACK2
+
+    attack = hero.attack2 if move == combat.ATTACK2 else hero.attack
+    return swing_distribution(attack, hero.crit_chance, enemy.defense, enemy.dodge_chance)
+
+
+def enemy_swing(hero, enemy, defending):
+    # Return the damage distribution of the enemy's strike against the hero.
+    # - hero and enemy are units
+    # - defending is True when the hero picked defend this turn
+
+    defense = hero.defense + hero.increased_defence if defending else hero.defense
+    return swing_distribution(enemy.attack, enemy.crit_chance, defense, hero.dodge_chance)
+
+
+@functools.lru_cache(maxsize=None)
+def swing_table(attacker_name, defender_name, move):
+    # Return the damage distribution for an (attacker, defender, move)
+    # triple of unit names, computed once. move is combat.ATTACK1,
+    # combat.ATTACK2 or "attack" for an enemy's strike; combat.DEFEND is
+    # the enemy's strike against a defending hero.
+
+    attacker = Unit(attacker_name)
+    defender = Unit(defender_name)
+
+    if move in (combat.ATTACK1, combat.ATTACK2):
+        return hero_swing(attacker, defender, move)
+    return enemy_swing(defender, attacker, move == combat.DEFEND)
+
+
+def fight_distribution(hero, enemy, actions, max_turns=MAX_TURNS):
+    # Return the exact FightTable of a fight where the hero plays actions,
+    # by carrying the chance of every (hero hp, enemy hp) pair from turn to
+    # turn instead of sampling. A faster enemy strikes before the hero
+    # moves, like combat.initiative orders it.
+    # - hero and enemy are units
+    # - actions is an iterable of the hero's moves (attacks and defend)
+
+    states = {(hero.current_hp, enemy.current_hp): 1.0}
+    win = []
+    loss = []
+    enemy_first = enemy.speed > hero.speed
+
+    for action in itertools.islice(actions, max_turns):
+        defending = action == combat.DEFEND
+        if defending:
+            hero_damage = ((0, 1.0),)
+        else:
+            hero_damage = hero_swing(hero, enemy, action)
+        enemy_damage = enemy_swing(hero, enemy, defending)
+
+        next_states = {}
+        won = 0.0
+        lost = 0.0
+
+        for (hero_hp, enemy_hp), chance in states.items():
+            if enemy_first:
+                for damage_back, back_chance in enemy_damage:
+                    hero_left = hero_hp - damage_back
+                    if hero_left <= 0:
+                        lost = lost + chance * back_chance
+                        continue
+                    for damage, hit_chance in hero_damage:
+                        enemy_left = enemy_hp - damage
+                        if enemy_left <= 0:
+                            won = won + chance * back_chance * hit_chance
+                        else:
+                            key = (hero_left, enemy_left)
+                            next_states[key] = next_states.get(key, 0.0) + chance * back_chance * hit_chance
+                continue
+
+            for damage, hit_chance in hero_damage:
+                enemy_left = enemy_hp - damage
+                if enemy_left <= 0:
+                    won = won + chance * hit_chance
+                    continue
+                for damage_back, back_chance in enemy_damage:
+                    hero_left = hero_hp - damage_back
+                    if hero_left <= 0:
+                        lost = lost + chance * hit_chance * back_chance
+                    else:
+                        key = (hero_left, enemy_left)
+                        next_states[key] = next_states.get(key, 0.0) + chance * hit_chance * back_chance
+
+        win.append(won)
+        loss.append(lost)
+        states = next_states
+        if not states:
+            break
+
+    draw = sum(states.values())
+    ended = sum(win) + sum(loss)
+    turns = sum((t + 1) * (win[t] + loss[t]) for t in range(len(win)))
+
+    return FightTable(win, loss, draw, sum(win), turns / ended if ended else float("nan"))
+
+
+@functools.lru_cache(maxsize=None)
+def fight_table(hero_name, enemy_name):
+    # Return the FightTable for a hero and enemy pair when the hero uses
+    # combat.strongest_actions, computed once per pair.
+
+    hero = Unit(hero_name)
+    return fight_distribution(hero, Unit(enemy_name), combat.strongest_actions(hero))
+
+
+def precompute(hero_names, enemy_names):
+    # Fill the swing and fight tables for every pair up front, so later
+    # lookups never compute anything.
+    # - hero_names and enemy_names are lists of unit names
+
+    for hero_name in hero_names:
+        for enemy_name in enemy_names:
+            for move in (combat.ATTACK1, combat.ATTACK2):
+                swing_table(hero_name, enemy_name, move)
+            swing_table(enemy_name, hero_name, "attack")
+            swing_table(enemy_name, hero_name, combat.DEFEND)
+            fight_table(hero_name, enemy_name)
+
+
+if __name__ == "__main__":
+    from balance import HEROES, ENEMIES
+
+    precompute(HEROES, ENEMIES)
+
+    for hero_name in HEROES:
+        for enemy_name in ENEMIES:
+            table = fight_table(hero_name, enemy_name)
+            print("%-10s %-10s win %.4f%%  draw %.4f%%  turns %.3f" % (
+                hero_name, enemy_name, table.win_rate * 100, table.draw * 100, table.expected_turns))
@@ -0,0 +1,176 @@
+import json, math, os
+import pygame
+from assets import ASSET_DIR
+from gamelog import channel
+from spatial import SpatialGrid
+from unit import catalog
+
+# The data file the overworld's encounter regions are read from
+ENCOUNTERS_PATH = os.path.join(ASSET_DIR, "encounters.json")
+
+log = channel("encounter")
+
+
+class AliasTable:
+    # An object in this class picks one of a fixed set of names with given
+    # weights in O(1), using Vose's alias method: every slot of the table
+    # holds a name, the chance of keeping it and the name to take instead.
+    # A pick costs one random number however many names there are.
+
+    def __init__(self, weights):
+        # Initialize an AliasTable.
+        # - self is the AliasTable to initialize
+        # - weights is a dict from name to its (positive) weight
+
+        self.names = list(weights)
+        count = len(self.names)
+        total = sum(weights.values())
+        if count == 0 or total <= 0:
+            raise ValueError("an encounter table needs at least one positive weight")
+
+        scaled = [weights[name] * count / total for name in self.names]
+        self.keep = [1.0] * count
+        self.alias = list(range(count))
+
+        small = [i for i in range(count) if scaled[i] < 1]
+        large = [i for i in range(count) if scaled[i] >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.keep[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def sample(self, rng):
+        # Return a name picked by weight.
+        # - self is the AliasTable
+        # - rng is a random.Random
+
+        roll = rng.random() * len(self.names)
+        slot = int(roll)
+        if roll - slot < self.keep[slot]:
+            return self.names[slot]
+        return self.names[self.alias[slot]]
+
+
+class Region:
+    # An object in this class is one area of the overworld with its own
+    # enemies and encounter rate.
+    # - rect is the area of the map the region covers
+    # - steps is the average number of pixels walked between encounters
+    # - enemies is an AliasTable of the enemies met there
+    # - size is the (fewest, most) enemies met at once
+
+    def __init__(self, name, data):
+        # Initialize a Region.
+        # - self is the Region to initialize
+        # - name is the region's name
+        # - data is the region's dict from the data file
+
+        units = catalog()
+        for enemy_name in data["enemies"]:
+            if enemy_name not in units or units[enemy_name].kind != "enemy":
+                raise ValueError("region " + name + " lists unknown enemy " + enemy_name)
+        if data["steps"] < 1:
+            raise ValueError("region " + name + " needs at least 1 step between encounters")
+
+        self.name = name
+        self.rect = pygame.Rect(data["rect"])
+        self.steps = data["steps"]
+        self.enemies = AliasTable(data["enemies"])
+        self.size = tuple(data.get("size", (1, 1)))
+        if not 1 <= self.size[0] <= self.size[1]:
+            raise ValueError("region " + name + " needs a size of at least 1 enemy")
+
+        # Chance of an encounter on any one step, as a log for steps_until()
+        self.log_miss = math.log(1 - 1 / self.steps) if self.steps > 1 else None
+
+    def steps_until(self, rng):
+        # Return how many steps it takes to meet the next enemy. Drawing the
+        # count once from a geometric distribution gives exactly the same
+        # encounters as rolling a 1 in steps chance on every step.
+        # - self is the Region
+        # - rng is a random.Random
+
+        if self.log_miss is None:
+            return 1
+        return int(math.log(1 - rng.random()) / self.log_miss) + 1
+
+
+class EncounterEngine:
+    # An object in this class decides when the hero meets an enemy on the
+    # overworld. Encounters come from the distance walked, not from frames,
+    # so they happen as often at any frame rate. The steps left until the
+    # next encounter are drawn when the last one ends (or the hero enters a
+    # new region), so walking only rolls the dice when an enemy appears.
+
+    def __init__(self, regions, rng):
+        # Initialize an EncounterEngine.
+        # - self is the EncounterEngine to initialize
+        # - regions is a list of Regions
+        # - rng is the SessionRNG: steps come from its encounter stream and
+        #   enemies from its enemy stream
+
+        self.regions = regions
+        self.rng = rng
+        self.zones = SpatialGrid(256) # Regions are large, so the cells are too
+        for region in regions:
+            self.zones.insert(region, region.rect)
+        self.region = None
+        self.steps_left = 0
+
+    def region_at(self, position):
+        # Return the Region a point of the map is in, or None.
+        # - self is the EncounterEngine
+        # - position is an (x, y) point
+
+        found = self.zones.query_point(position)
+        if found:
+            return found[0]
+        return None
+
+    def walk(self, position, distance):
+        # Count a move of the hero and return the names of the enemies met,
+        # or None when the walk goes on.
+        # - self is the EncounterEngine
+        # - position is where the hero now stands
+        # - distance is how many pixels the hero moved
+
+        if distance == 0:
+            return None
+
+        if self.region is None or not self.region.rect.collidepoint(position):
+            self.region = self.region_at(position)
+            if self.region is None:
+                return None
+            self.steps_left = self.region.steps_until(self.rng.encounter)
+            log.debug("entered %s, next encounter in %d steps", self.region.name, self.steps_left)
+
+        self.steps_left = self.steps_left - distance
+        if self.steps_left > 0:
+            return None
+
+        self.steps_left = self.region.steps_until(self.rng.encounter)
+        count = self.region.size[0]
+        if self.region.size[1] > count:
+            count = self.rng.enemy.randint(count, self.region.size[1])
+        enemy_names = [self.region.enemies.sample(self.rng.enemy) for i in range(count)]
+        log.info("met %s in %s", ", ".join(enemy_names), self.region.name,
+                 extra={"data": {"enemies": enemy_names, "region": self.region.name, "position": list(position)}})
+        log.debug("next encounter in %d steps", self.steps_left)
+        return enemy_names
+
+
+def load_regions(path=ENCOUNTERS_PATH):
+    # Read an encounter data file and return its Regions, in the order the
+    # file lists them (the first one that covers a point wins).
+    # - path is the JSON file to read
+
+    with open(path) as file:
+        data = json.load(file)
+
+    return [Region(name, region) for name, region in data["regions"].items()]
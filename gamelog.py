@@ -0,0 +1,112 @@
+import json, logging, queue
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+
+# The named channels the game logs to, and the level each one starts at.
+# Debug messages are off unless a channel is turned up, and a message below
+# its channel's level is dropped before any of its text is built.
+CHANNELS = {"encounter": logging.INFO, "combat": logging.INFO, "render": logging.WARNING, "startup": logging.INFO,
+            "save": logging.INFO, "memory": logging.INFO, "profile": logging.INFO}
+
+# How many recent records the in-memory ring buffer keeps
+RING_SIZE = 1000
+
+
+def channel(name):
+    # Return the logger of a channel, like channel("combat").
+
+    return logging.getLogger("dq." + name)
+
+
+class RingBufferHandler(logging.Handler):
+    # An object in this class keeps the last records logged in memory, so
+    # a session's recent history can be read back without writing a file.
+
+    def __init__(self, capacity=RING_SIZE):
+        # Initialize a RingBufferHandler.
+        # - self is the RingBufferHandler to initialize
+        # - capacity is how many records it keeps
+
+        logging.Handler.__init__(self)
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def lines(self, name=None):
+        # Return the kept records as formatted lines, oldest first.
+        # - self is the RingBufferHandler
+        # - name is a channel to keep only the lines of, or None for all
+
+        return [self.format(record) for record in list(self.records)
+                if name is None or record.name == "dq." + name]
+
+
+class JsonFormatter(logging.Formatter):
+    # An object in this class writes each record as one line of JSON: its
+    # time, channel, level and message, plus the fields passed to the log
+    # call as extra={"data": {...}}, so a log file can be read back for
+    # analysis.
+
+    def format(self, record):
+        line = {"time": round(record.created, 6), "channel": record.name[3:],
+                "level": record.levelname, "message": record.getMessage()}
+        line.update(getattr(record, "data", {}))
+        return json.dumps(line)
+
+
+class BufferedQueueHandler(QueueHandler):
+    # An object in this class hands records to the background writer as
+    # they are, leaving all formatting to the writer's thread so a log call
+    # costs the game loop one queue put.
+
+    def prepare(self, record):
+        return record
+
+
+class GameLog:
+    # An object in this class sets up the game's logging: every channel
+    # logs into a queue, and a background thread writes the records to a
+    # ring buffer in memory and, when given a path, to a JSON lines file.
+    # No log call ever waits on a file or the console.
+
+    def __init__(self, path=None, debug=(), capacity=RING_SIZE):
+        # Initialize a GameLog and start its writer thread.
+        # - self is the GameLog to initialize
+        # - path is the file to write records to, or None
+        # - debug is a list of channels to log debug messages from, or
+        #   ["all"] for every channel
+        # - capacity is how many records the ring buffer keeps
+
+        self.queue = queue.SimpleQueue()
+        self.ring = RingBufferHandler(capacity)
+        self.ring.setFormatter(JsonFormatter())
+        handlers = [self.ring]
+
+        self.file_handler = None
+        if path is not None:
+            self.file_handler = logging.FileHandler(path, "w")
+            self.file_handler.setFormatter(JsonFormatter())
+            handlers.append(self.file_handler)
+
+        root = logging.getLogger("dq")
+        root.propagate = False # Never reaches the console through the root logger
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(BufferedQueueHandler(self.queue))
+
+        for name, level in CHANNELS.items():
+            if name in debug or "all" in debug:
+                level = logging.DEBUG
+            channel(name).setLevel(level)
+
+        self.listener = QueueListener(self.queue, *handlers)
+        self.listener.start()
+
+    def close(self):
+        # Write out every record still queued and stop the writer thread.
+        # - self is the GameLog
+
+        self.listener.stop()
+        if self.file_handler is not None:
+            self.file_handler.close()
@@ -0,0 +1,168 @@
+import functools
+from array import array
+import combat
+from damage_tables import hero_swing, enemy_swing
+from unit import Unit
+
+# Moves as the numbers stored in a PolicyTable
+CODES = [combat.ATTACK1, combat.ATTACK2, combat.DEFEND, combat.FLEE]
+
+
+class PolicyTable:
+    # An object in this class holds the best move for every state of one
+    # hero/enemy matchup. A state is the hero's hp, both attacks' pp and the
+    # enemy's hp (defending only lasts for the turn it is picked, so it is
+    # not part of the state between turns). The table is solved once with
+    # dynamic programming over the chance of winning, then each decision is
+    # one array lookup.
+
+    def __init__(self, hero, enemy):
+        # Initialize a PolicyTable by solving every state of the matchup.
+        # - self is the PolicyTable to initialize
+        # - hero and enemy are units at full hp and pp
+
+        self.hero_name = hero.name
+        self.enemy_name = enemy.name
+        self.sizes = (hero.health + 1, hero.attack1_max_pp + 1, hero.attack2_max_pp + 1, enemy.health + 1)
+
+        count = self.sizes[0] * self.sizes[1] * self.sizes[2] * self.sizes[3]
+        self.actions = bytearray(count) # Index of the best move in CODES
+        self.values = array('d', bytes(8 * count)) # Chance to win from the state
+
+        self.solve(hero, enemy)
+
+    def index(self, hero_hp, pp1, pp2, enemy_hp):
+        # Return the position of a state in the table's arrays.
+        # - self is the PolicyTable
+
+        return ((hero_hp * self.sizes[1] + pp1) * self.sizes[2] + pp2) * self.sizes[3] + enemy_hp
+
+    def solve(self, hero, enemy):
+        # Fill the table. Every move lowers some hp or pp, so visiting states
+        # from low to high means the states a move leads to are already
+        # solved. Defending can leave the state unchanged when the enemy
+        # misses; that chance q is solved directly as V = S / (1 - q). A
+        # faster enemy strikes before the hero's attack lands, like
+        # combat.initiative orders it.
+        # - self is the PolicyTable
+        # - hero and enemy are units at full hp and pp
+
+        values = self.values
+        index = self.index
+        swings = {combat.ATTACK1: hero_swing(hero, enemy, combat.ATTACK1),
+                  combat.ATTACK2: hero_swing(hero, enemy, combat.ATTACK2)}
+        strikes_back = enemy_swing(hero, enemy, False)
+        strikes_defended = enemy_swing(hero, enemy, True)
+        enemy_first = enemy.speed > hero.speed
+
+        def after_enemy(hero_hp, pp1, pp2, enemy_hp, strikes):
+            # Chance to win once the enemy strikes back from this state
+            total = 0.0
+            for damage, chance in strikes:
+                if hero_hp - damage > 0:
+                    total = total + chance * values[index(hero_hp - damage, pp1, pp2, enemy_hp)]
+            return total
+
+        for hero_hp in range(1, self.sizes[0]):
+            for pp1 in range(self.sizes[1]):
+                for pp2 in range(self.sizes[2]):
+                    for enemy_hp in range(1, self.sizes[3]):
+                        best = 3 # Flee, worth nothing
+                        best_value = 0.0
+
+                        for code, pp_left in ((0, pp1), (1, pp2)):
+                            if pp_left == 0:
+                                continue
+                            next_pp1 = pp1 - 1 if code == 0 else pp1
+                            next_pp2 = pp2 - 1 if code == 1 else pp2
+                            value = 0.0
+                            if enemy_first:
+                                for damage_back, back_chance in strikes_back:
+                                    if hero_hp - damage_back <= 0:
+                                        continue
+                                    for damage, chance in swings[CODES[code]]:
+                                        if enemy_hp - damage <= 0:
+                                            value = value + back_chance * chance
+                                        else:
+                                            value = value + back_chance * chance * values[index(hero_hp - damage_back, next_pp1, next_pp2, enemy_hp - damage)]
+                            else:
+                                for damage, chance in swings[CODES[code]]:
+                                    if enemy_hp - damage <= 0:
+                                        value = value + chance
+                                    else:
+                                        value = value + chance * after_enemy(hero_hp, next_pp1, next_pp2, enemy_hp - damage, strikes_back)
+                            if value > best_value:
+                                best, best_value = code, value
+
+                        # Defend: everything but a miss moves to a solved state
+                        stay = 0.0
+                        value = 0.0
+                        for damage, chance in strikes_defended:
+                            if damage == 0:
+                                stay = chance
+                            elif hero_hp - damage > 0:
+                                value = value + chance * values[index(hero_hp - damage, pp1, pp2, enemy_hp)]
+                        if stay < 1:
+                            value = value / (1 - stay)
+                            if value > best_value:
+                                best, best_value = 2, value
+
+                        position = index(hero_hp, pp1, pp2, enemy_hp)
+                        self.actions[position] = best
+                        values[position] = best_value
+
+    def state(self, hero, enemy):
+        # Return the table position of the current state of a fight.
+        # - self is the PolicyTable
+        # - hero and enemy are the units fighting
+
+        return self.index(hero.current_hp, hero.attack1_current_pp, hero.attack2_current_pp, enemy.current_hp)
+
+    def best_action(self, hero, enemy):
+        # Return the move (one of combat.ACTIONS) with the best chance to win.
+        # - self is the PolicyTable
+        # - hero and enemy are the units fighting
+
+        return CODES[self.actions[self.state(hero, enemy)]]
+
+    def win_chance(self, hero, enemy):
+        # Return the chance the hero wins from here by always playing the
+        # table's moves.
+        # - self is the PolicyTable
+        # - hero and enemy are the units fighting
+
+        return self.values[self.state(hero, enemy)]
+
+
+@functools.lru_cache(maxsize=None)
+def policy_table(hero_name, enemy_name):
+    # Return the PolicyTable for a hero and enemy pair, solving it once.
+
+    return PolicyTable(Unit(hero_name), Unit(enemy_name))
+
+
+def precompute(hero_names, enemy_names):
+    # Solve the policy table of every pair up front, so a hint or autoplay
+    # never waits for a solve.
+    # - hero_names and enemy_names are lists of unit names
+
+    for hero_name in hero_names:
+        for enemy_name in enemy_names:
+            policy_table(hero_name, enemy_name)
+
+
+if __name__ == "__main__":
+    import time
+    from balance import HEROES, ENEMIES
+    from damage_tables import fight_table
+
+    for hero_name in HEROES:
+        for enemy_name in ENEMIES:
+            start = time.perf_counter()
+            table = policy_table(hero_name, enemy_name)
+            seconds = time.perf_counter() - start
+            hero = Unit(hero_name)
+            enemy = Unit(enemy_name)
+            print("%-10s %-10s best %-8s win %.4f%% (fixed policy %.4f%%)  solved in %.2fs" % (
+                hero_name, enemy_name, table.best_action(hero, enemy), table.win_chance(hero, enemy) * 100,
+                fight_table(hero_name, enemy_name).win_rate * 100, seconds))
@@ -0,0 +1,370 @@
+import cProfile, csv, gc, io, json, pstats, time, tracemalloc
+from collections import deque
+from text_cache import text_cache
+from gamelog import channel
+
+# The parts of a frame that are timed, in the order they run
+PHASES = ["handle_events", "update", "draw", "present"]
+
+# The small font the overlay is drawn with
+OVERLAY_FONT = ('Arial', 12, False)
+
+# Bytes the traced memory may grow past its steady-state baseline before
+# the steady-state check fails
+STEADY_TOLERANCE = 64 * 1024
+
+# Allocation sites listed per scene in the memory report
+REPORT_LINES = 8
+
+# Allocations left out of memory snapshots: tracemalloc's own and imports
+SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                    tracemalloc.Filter(False, "<unknown>")]
+
+log = channel("memory")
+profile_log = channel("profile")
+
+
+def percentile(values, fraction):
+    # Return the value below which fraction of the sorted values fall.
+    # - values is a sorted list of numbers
+    # - fraction is between 0 and 1
+
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class FrameTimer:
+    # An object in this class measures what each frame costs. A loop calls
+    # start_frame() at the top of a frame, mark(phase) after each phase and
+    # end_frame() before waiting on its clock. The last window_size frames
+    # are kept for p50/p95/p99 stats, frames whose work took longer than
+    # the frame budget are counted as dropped, and every frame can be
+    # written to a CSV or JSON trace file.
+
+    def __init__(self, fps, trace_path=None, window_size=600):
+        # Initialize a FrameTimer.
+        # - self is the FrameTimer to initialize
+        # - fps is the frame rate target, which sets the frame budget
+        # - trace_path is a .csv or .json file to trace frames to, or None
+        # - window_size is how many recent frames the stats cover
+
+        self.fps = fps
+        self.frames = 0
+        self.dropped = 0
+        self.window = deque(maxlen=window_size) # ms of work per frame
+        self.phase_windows = {}
+        for phase in PHASES:
+            self.phase_windows[phase] = deque(maxlen=window_size)
+        self.phase_times = {}
+        self.frame_start = time.perf_counter()
+        self.last_mark = self.frame_start
+
+        self.show_overlay = False
+        self.overlay = None
+        self.overlay_time = 0.0
+
+        self.profile = None
+        self.profiles = 0
+
+        self.trace_path = trace_path
+        self.trace_json = trace_path is not None and trace_path.endswith(".json")
+        self.trace_rows = []
+        self.trace_writer = None
+        if trace_path is not None and not self.trace_json:
+            self.trace_file = open(trace_path, "w", newline="")
+            self.trace_writer = csv.writer(self.trace_file)
+            self.trace_writer.writerow(["frame", "scene"] + PHASES + ["work", "dropped"])
+
+    def start_frame(self):
+        # Start timing a new frame.
+        # - self is the FrameTimer
+
+        self.frame_start = time.perf_counter()
+        self.last_mark = self.frame_start
+        self.phase_times = {}
+
+    def mark(self, phase):
+        # Charge the time since the last mark to a phase.
+        # - self is the FrameTimer
+        # - phase is one of PHASES
+
+        now = time.perf_counter()
+        self.phase_times[phase] = self.phase_times.get(phase, 0.0) + (now - self.last_mark) * 1000
+        self.last_mark = now
+
+    def end_frame(self, scene=""):
+        # Finish timing the frame and add it to the stats and trace.
+        # - self is the FrameTimer
+        # - scene names the loop that ran the frame, for the trace
+
+        work = (time.perf_counter() - self.frame_start) * 1000
+        dropped = work > 1000 / self.fps
+
+        self.frames = self.frames + 1
+        if dropped:
+            self.dropped = self.dropped + 1
+        self.window.append(work)
+        for phase in PHASES:
+            self.phase_windows[phase].append(self.phase_times.get(phase, 0.0))
+
+        if self.trace_path is not None:
+            row = [self.frames, scene] + [round(self.phase_times.get(phase, 0.0), 4) for phase in PHASES] + [round(work, 4), int(dropped)]
+            if self.trace_writer is not None:
+                self.trace_writer.writerow(row)
+            else:
+                self.trace_rows.append(row)
+
+    def stats(self):
+        # Return a dict of the recent frame stats in ms: p50, p95 and p99 of
+        # the frame's work and of each phase, plus frame and dropped counts.
+        # - self is the FrameTimer
+
+        work = sorted(self.window)
+        result = {"frames": self.frames, "dropped": self.dropped,
+                  "p50": percentile(work, 0.50), "p95": percentile(work, 0.95), "p99": percentile(work, 0.99)}
+
+        for phase in PHASES:
+            times = sorted(self.phase_windows[phase])
+            result[phase] = {"p50": percentile(times, 0.50), "p95": percentile(times, 0.95), "p99": percentile(times, 0.99)}
+
+        return result
+
+    def toggle_overlay(self):
+        # Show or hide the on-screen stats.
+        # - self is the FrameTimer
+
+        self.show_overlay = not self.show_overlay
+        self.overlay = None
+
+    def overlay_image(self):
+        # Return a surface with the recent stats written on it. It is
+        # rebuilt at most twice a second, so the overlay costs little itself.
+        # - self is the FrameTimer
+
+        now = time.perf_counter()
+        if self.overlay is None or now - self.overlay_time > 0.5:
+            stats = self.stats()
+            text = "frame p50 %.2f p95 %.2f p99 %.2f ms | dropped %d/%d" % (
+                stats["p50"], stats["p95"], stats["p99"], stats["dropped"], stats["frames"])
+            self.overlay = text_cache.render(text, 'yellow', OVERLAY_FONT)
+            self.overlay_time = now
+
+        return self.overlay
+
+    def place_overlay(self, renderer):
+        # Put the stats on a scene, or take them off when hidden.
+        # - self is the FrameTimer
+        # - renderer is the scene's Renderer
+
+        if self.show_overlay:
+            renderer.place("profiler", self.overlay_image(), (4, 384))
+        else:
+            renderer.remove("profiler")
+
+    def toggle_profile(self):
+        # Start cProfile, or stop it and write the results to
+        # profile_<n>.prof, logging the slowest functions.
+        # - self is the FrameTimer
+
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return
+
+        self.profile.disable()
+        self.profiles = self.profiles + 1
+        path = "profile_" + str(self.profiles) + ".prof"
+        self.profile.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(self.profile, stream=summary).sort_stats("cumulative").print_stats(15)
+        profile_log.info("profile written to %s", path, extra={"data": {"path": path, "summary": summary.getvalue().splitlines()}})
+        self.profile = None
+
+    def close(self):
+        # Stop profiling and finish the trace file.
+        # - self is the FrameTimer
+
+        if self.profile is not None:
+            self.toggle_profile()
+
+        if self.trace_writer is not None:
+            self.trace_file.close()
+            self.trace_writer = None
+        elif self.trace_json:
+            with open(self.trace_path, "w") as file:
+                json.dump({"columns": ["frame", "scene"] + PHASES + ["work", "dropped"],
+                           "frames": self.trace_rows, "stats": self.stats()}, file)
+
+
+class AllocationTracker:
+    # An object in this class reports what the game allocates and keeps,
+    # using tracemalloc. Each time a scene comes to the top, the memory
+    # traced since the last switch is charged to the scene that was
+    # playing, by the line that allocated it. It can also check that
+    # memory holds steady: once every game playing has ended steady
+    # encounters it remembers the traced size, and each time every game
+    # has ended steady more it raises AssertionError when memory grew more
+    # than tolerance past it. Encounters are counted per game, so in a
+    # process running many games the baseline waits for each one's first
+    # fights. Until start() is called it does nothing and costs nothing.
+
+    def __init__(self):
+        # Initialize an AllocationTracker that is not tracing.
+        # - self is the AllocationTracker to initialize
+
+        self.tracing = False
+        self.by_scene = True
+        self.scene = None # The scene playing since the last snapshot
+        self.snapshot = None
+        self.scenes = {} # name -> {"visits", "kept", "lines": {site: bytes}}
+        self.encounters = 0
+        self.games = {} # Game -> encounters it ended, for every game playing
+        self.rounds = 0 # Steady windows every game has ended
+        self.steady = None
+        self.tolerance = STEADY_TOLERANCE
+        self.baseline = None # (snapshot bytes, snapshot) once warmed up
+
+    def start(self, frames=1, steady=None, tolerance=STEADY_TOLERANCE, by_scene=True):
+        # Start tracing allocations.
+        # - self is the AllocationTracker
+        # - frames is how many stack frames each allocation keeps
+        # - steady is the number of encounters to warm up over and check
+        #   after, or None for no steady-state check
+        # - tolerance is how many bytes memory may grow past the baseline
+        # - by_scene is False to charge everything to one "all" entry,
+        #   for a process running many games at once
+
+        tracemalloc.start(frames)
+        self.tracing = True
+        self.by_scene = by_scene
+        self.steady = steady
+        self.tolerance = tolerance
+        self.scene = None if by_scene else "all"
+        self.snapshot = self.take()
+
+    def take(self):
+        # Return a snapshot of the traced memory.
+        # - self is the AllocationTracker
+
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def enter(self, name):
+        # Charge what was allocated and kept since the last switch to the
+        # scene that was playing, then start charging to a new one.
+        # - self is the AllocationTracker
+        # - name is the name of the scene coming to the top, or None
+
+        if not self.tracing or not self.by_scene:
+            return
+
+        gc.collect() # Only what is still reachable counts
+        snapshot = self.take()
+        if self.scene is not None:
+            self.charge(snapshot)
+        self.snapshot = snapshot
+        self.scene = name
+
+    def charge(self, snapshot):
+        # Add the difference between the last snapshot and snapshot to the
+        # current scene.
+        # - self is the AllocationTracker
+        # - snapshot is the newer snapshot
+
+        scene = self.scenes.setdefault(self.scene, {"visits": 0, "kept": 0, "lines": {}})
+        scene["visits"] = scene["visits"] + 1
+        for stat in snapshot.compare_to(self.snapshot, "lineno"):
+            if stat.size_diff:
+                site = str(stat.traceback[0])
+                scene["lines"][site] = scene["lines"].get(site, 0) + stat.size_diff
+                scene["kept"] = scene["kept"] + stat.size_diff
+
+    def join(self, game):
+        # Start counting a game's encounters for the steady-state check.
+        # - self is the AllocationTracker
+        # - game is the Game that started
+
+        if self.tracing:
+            self.games[game] = 0
+
+    def leave(self, game):
+        # Stop waiting on a game that ended.
+        # - self is the AllocationTracker
+        # - game is the Game that closed
+
+        self.games.pop(game, None)
+
+    def encounter(self, game):
+        # Count an encounter that ended and, when checking for a steady
+        # state and every game has ended another steady encounters, take
+        # the baseline or check memory against it.
+        # - self is the AllocationTracker
+        # - game is the Game whose encounter ended
+
+        if not self.tracing:
+            return
+
+        self.encounters = self.encounters + 1
+        self.games[game] = self.games.get(game, 0) + 1
+        if self.steady is None or min(self.games.values()) < (self.rounds + 1) * self.steady:
+            return
+        self.rounds = self.rounds + 1
+
+        gc.collect() # Only what is still reachable counts
+        snapshot = self.take()
+        size = sum(stat.size for stat in snapshot.statistics("filename")) # Leaves out imports, like the sites
+        if self.baseline is None:
+            self.baseline = (size, snapshot)
+            log.info("memory baseline %d bytes after %d encounters in each of %d games", size, self.steady, len(self.games),
+                     extra={"data": {"bytes": size, "encounters": self.encounters, "games": len(self.games)}})
+            return
+
+        growth = size - self.baseline[0]
+        log.info("memory %+d bytes since the baseline after %d more encounters in each game", growth, (self.rounds - 1) * self.steady,
+                 extra={"data": {"growth": growth, "encounters": self.encounters, "games": len(self.games)}})
+        if growth > self.tolerance:
+            sites = ["%+.1f KB  %s" % (stat.size_diff / 1024, stat.traceback[0])
+                     for stat in snapshot.compare_to(self.baseline[1], "lineno")[:REPORT_LINES]]
+            raise AssertionError("memory grew %d bytes in %d encounters in each of %d games after warming up:\n  %s" % (
+                growth, (self.rounds - 1) * self.steady, len(self.games), "\n  ".join(sites)))
+
+    def report(self):
+        # Return the memory report as a list of lines: for each scene, the
+        # bytes it kept and the sites that allocated most of them.
+        # - self is the AllocationTracker
+
+        current, peak = tracemalloc.get_traced_memory() if self.tracing else (0, 0)
+        lines = ["traced %.1f KB, peak %.1f KB, %d encounters, %d steady checks" % (current / 1024, peak / 1024, self.encounters,
+                                                                                     max(self.rounds - 1, 0))]
+        for name, scene in sorted(self.scenes.items(), key=lambda item: -item[1]["kept"]):
+            lines.append("%s: %d visits, %+.1f KB kept" % (name, scene["visits"], scene["kept"] / 1024))
+            sites = sorted(scene["lines"].items(), key=lambda item: -abs(item[1]))
+            for site, size in sites[:REPORT_LINES]:
+                lines.append("  %+9.1f KB  %s" % (size / 1024, site))
+        return lines
+
+    def close(self, path=None):
+        # Charge the last scene, write the report and stop tracing.
+        # - self is the AllocationTracker
+        # - path is a text file to write the report to, or None to only
+        #   log it
+
+        if not self.tracing:
+            return
+
+        gc.collect()
+        self.charge(self.take())
+        lines = self.report()
+        log.info(lines[0], extra={"data": {"report": lines}})
+        if path is not None:
+            with open(path, "w") as file:
+                file.write("\n".join(lines) + "\n")
+        tracemalloc.stop()
+        self.tracing = False
+
+
+# The one tracker every game reports its allocations to
+allocations = AllocationTracker()
@@ -0,0 +1,161 @@
+import pygame
+from gamelog import channel
+
+log = channel("render")
+
+# Circle images already drawn, keyed by (color, radius)
+circle_images = {}
+
+
+def circle_image(color, radius):
+    # Return a transparent surface with a filled circle on it, drawing each
+    # (color, radius) pair only once.
+    # - color is a pygame Color, color name or RGB tuple
+    # - radius is the circle's radius in pixels
+
+    key = (tuple(pygame.Color(color)), radius)
+    image = circle_images.get(key)
+
+    if image is None:
+        image = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+        pygame.draw.circle(image, color, (radius, radius), radius)
+        circle_images[key] = image
+
+    return image
+
+
+class Renderer:
+    # An object in this class draws one scene onto the display using dirty
+    # rectangles. The scene is a background surface plus named layers, each
+    # an image at a position. Only the areas where a layer was placed, moved,
+    # changed or removed are redrawn and passed to pygame.display.update, and
+    # when nothing changed present() does not touch the display at all.
+    # Each redraw hands all its layers to one batched Surface.blits call.
+    # The background is only built and painted when a present needs it, so
+    # a scene that is never presented holds no window-sized surface.
+
+    def __init__(self, surface, paint=None):
+        # Initialize a Renderer.
+        # - self is the Renderer to initialize
+        # - surface is the display window surface object
+        # - paint is the function that draws the scene's background onto
+        #   self.background, or None for a black background
+
+        self.surface = surface
+        self.paint = paint
+        self.background_surface = None
+        self.stale = True # The background must be painted before it is shown
+        self.layers = {} # name -> [image, rect], drawn in insertion order
+        self.dirty = []
+        self.full_redraw = True
+
+    @property
+    def background(self):
+        # The surface behind the layers, built the first time it is used
+
+        if self.background_surface is None:
+            self.background_surface = pygame.Surface(self.surface.get_size())
+            if pygame.display.get_surface() is not None:
+                self.background_surface = self.background_surface.convert()
+        return self.background_surface
+
+    def repaint(self, rect=None):
+        # Paint the background again before the next present, then redraw
+        # an area of it.
+        # - self is the Renderer
+        # - rect is the area that changed, or None for the whole window
+
+        self.stale = True
+        self.invalidate(rect)
+
+    def invalidate(self, rect=None):
+        # Redraw and present an area on the next present, used after the
+        # background changed or another scene drew over the window.
+        # - self is the Renderer
+        # - rect is the area to redraw, or None for the whole window
+
+        if rect is None:
+            self.full_redraw = True
+        elif not self.full_redraw: # A full redraw already covers it
+            rect = pygame.Rect(rect)
+            if rect not in self.dirty: # A scene that is not presented would pile up copies
+                self.dirty.append(rect)
+
+    def place(self, name, image, position):
+        # Show image at position as the layer called name. Nothing is marked
+        # dirty when the layer already shows the same image in the same place.
+        # - self is the Renderer
+        # - name is the layer's name
+        # - image is the surface to show
+        # - position is the top left corner as a Rect or (x, y)
+
+        rect = image.get_rect(topleft=(position[0], position[1]))
+        layer = self.layers.get(name)
+
+        if layer is None:
+            self.layers[name] = [image, rect]
+            self.dirty.append(rect)
+        elif layer[0] is not image or layer[1] != rect:
+            self.dirty.append(layer[1])
+            self.dirty.append(rect)
+            layer[0] = image
+            layer[1] = rect
+
+    def remove(self, *names):
+        # Take layers off the scene, marking where they were as dirty.
+        # - self is the Renderer
+        # - names are the names of the layers to remove
+
+        for name in names:
+            layer = self.layers.pop(name, None)
+            if layer is not None:
+                self.dirty.append(layer[1])
+
+    def clear(self):
+        # Take every layer off the scene.
+        # - self is the Renderer
+
+        self.remove(*list(self.layers))
+
+    def skip(self):
+        # Forget the areas a frame no one watched left dirty, so they do not
+        # pile up; the next present redraws the whole window instead.
+        # - self is the Renderer
+
+        self.dirty = []
+        self.full_redraw = True
+
+    def present(self):
+        # Redraw the dirty areas and show them on the display.
+        # Returns the number of rects passed to pygame.display.update, 0 on
+        # frames where nothing changed.
+        # - self is the Renderer
+
+        if self.stale and (self.full_redraw or self.dirty):
+            if self.paint is not None:
+                self.paint()
+            self.stale = False
+
+        if self.full_redraw:
+            self.surface.blit(self.background, (0, 0))
+            self.surface.blits([(image, rect) for image, rect in self.layers.values()], False)
+            pygame.display.update()
+            log.debug("full redraw")
+            self.full_redraw = False
+            self.dirty = []
+            return 1
+
+        if not self.dirty:
+            return 0
+
+        for dirty_rect in self.dirty:
+            self.surface.set_clip(dirty_rect)
+            self.surface.blits([(self.background, dirty_rect, dirty_rect)] +
+                               [(image, rect) for image, rect in self.layers.values() if rect.colliderect(dirty_rect)], False)
+        self.surface.set_clip(None)
+
+        pygame.display.update(self.dirty)
+        count = len(self.dirty)
+        log.debug("presented %d dirty rects", count)
+        self.dirty = []
+        return count
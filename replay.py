@@ -0,0 +1,189 @@
+import base64, json, pygame
+from savegame import pack, unpack
+
+# The events a recording keeps, with the attributes needed to rebuild them
+RECORDED_EVENTS = {pygame.QUIT: [],
+                   pygame.KEYDOWN: ["key"],
+                   pygame.KEYUP: ["key"],
+                   pygame.MOUSEBUTTONDOWN: ["pos", "button"],
+                   pygame.MOUSEBUTTONUP: ["pos", "button"]}
+
+# Version 2: every scene runs in the one game loop, so frames line up
+# differently from version 1 recordings
+RECORDING_VERSION = 2
+
+
+def decode(recorded):
+    # Return the pygame events of one recorded frame.
+    # - recorded is the frame's list of [type, attribute values...]
+
+    events = []
+    for values in recorded:
+        event_type = values[0]
+        names = RECORDED_EVENTS[event_type]
+        attributes = {}
+        for name, value in zip(names, values[1:]):
+            attributes[name] = tuple(value) if name == "pos" else value
+        events.append(pygame.event.Event(event_type, attributes))
+    return events
+
+
+def encode_save(state):
+    # Return a SaveState as text for a recording's header, or None.
+    # - state is the SaveState, or None
+
+    return None if state is None else base64.b64encode(pack(state)).decode("ascii")
+
+
+def decode_save(text):
+    # Return the SaveState a recording's header holds, or None.
+    # - text is what encode_save returned
+
+    return None if text is None else unpack(base64.b64decode(text))
+
+
+class InputRecorder:
+    # An object in this class is where the game's scenes get their events
+    # and frame times. It reads the real event queue and, when given a path,
+    # writes every key, mouse and quit event to it with its frame number
+    # and each frame's length, so the session can be replayed exactly. The
+    # header also keeps the save the session started from and what the
+    # quick-save slot held, so a replay never reads the player's files.
+
+    def __init__(self, seed, path=None, idle_timeout=0, loaded=None, quick_saved=None):
+        # Initialize an InputRecorder.
+        # - self is the InputRecorder to initialize
+        # - seed is the session's SessionRNG seed, saved with the recording
+        # - path is the file to record to, or None to only read events
+        # - idle_timeout is the most ms an idle frame sleeps waiting for an
+        #   event, 0 to sleep until one arrives
+        # - loaded is the SaveState the session starts from, or None for
+        #   the select screen
+        # - quick_saved is the SaveState in the quick-save slot, or None
+
+        self.frame = 0
+        self.idle_timeout = idle_timeout
+        self.file = None
+        self.frame_events = []
+        self.pending = None # The event that woke an idle frame, handed out first next frame
+
+        if path is not None:
+            self.file = open(path, "w")
+            self.file.write(json.dumps({"version": RECORDING_VERSION, "seed": seed, "loaded": encode_save(loaded),
+                                        "quick_saved": encode_save(quick_saved)}) + "\n")
+
+    def get(self):
+        # Return this frame's events, like pygame.event.get.
+        # - self is the InputRecorder
+
+        events = pygame.event.get()
+        if self.pending is not None:
+            events.insert(0, self.pending) # It was taken off the queue before the events still on it
+            self.pending = None
+
+        if self.file is not None:
+            for event in events:
+                names = RECORDED_EVENTS.get(event.type)
+                if names is not None:
+                    self.frame_events.append([event.type] + [getattr(event, name) for name in names])
+
+        return events
+
+    def tick(self, clock, fps, idle=False):
+        # End the frame, waiting so the game runs at most fps frames a
+        # second, and return the frame's length in ms, like Clock.tick.
+        # An idle frame (nothing moving or animating) instead sleeps until
+        # the next event arrives, so a still game uses no CPU. The time spent
+        # asleep is not game time: an idle frame counts as at most one
+        # frame, so the player's thinking time never plays out the next
+        # animation at once.
+        # - self is the InputRecorder
+        # - clock is the scene's pygame Clock
+        # - fps is the frame cap
+        # - idle is True when nothing will change until the player acts
+
+        if idle:
+            event = pygame.event.wait(self.idle_timeout)
+            if event.type != pygame.NOEVENT:
+                self.pending = event # Posting it again would put it behind events already queued
+            elapsed = min(clock.tick(), 1000 // fps) # tick() also restarts the clock after the wait
+        else:
+            elapsed = clock.tick(fps)
+
+        if self.file is not None:
+            self.file.write(json.dumps([self.frame, elapsed, self.frame_events]) + "\n")
+            self.frame_events = []
+
+        self.frame = self.frame + 1
+        return elapsed
+
+    def close(self):
+        # Finish the recording.
+        # - self is the InputRecorder
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class InputReplay:
+    # An object in this class plays back a recording made by InputRecorder.
+    # It hands each frame the events and frame length that were recorded,
+    # without waiting between frames, so a session replays at full speed
+    # and ends with a QUIT event once the recording runs out.
+
+    def __init__(self, path):
+        # Initialize an InputReplay.
+        # - self is the InputReplay to initialize
+        # - path is the recording to play back
+
+        with open(path) as file:
+            header = json.loads(file.readline())
+            if header.get("version") != RECORDING_VERSION:
+                raise ValueError("unsupported recording version: " + str(header.get("version")))
+            self.frames = [json.loads(line) for line in file if line.strip()]
+
+        self.seed = header["seed"]
+        self.loaded = decode_save(header.get("loaded")) # Where the session started, None for the select screen
+        self.quick_saved = decode_save(header.get("quick_saved")) # What F8 found before any F5
+        self.frame = 0
+        self.position = 0 # Index of the next recorded frame to play
+
+    def get(self):
+        # Return the recorded events of this frame. Each frame's events are
+        # only handed out once, even if a scene asks more than once.
+        # - self is the InputReplay
+
+        pygame.event.pump() # Keep the window responsive; real input is ignored
+
+        if self.position >= len(self.frames):
+            return [pygame.event.Event(pygame.QUIT)]
+
+        frame, elapsed, recorded = self.frames[self.position]
+        if frame != self.frame or not recorded:
+            return []
+
+        self.frames[self.position] = [frame, elapsed, []]
+        return decode(recorded)
+
+    def tick(self, clock, fps, idle=False):
+        # End the frame without waiting and return the recorded frame length.
+        # - self is the InputReplay
+        # - clock is the scene's pygame Clock
+        # - fps and idle are ignored; replays run as fast as possible
+
+        clock.tick()
+        elapsed = 0
+
+        if self.position < len(self.frames):
+            elapsed = self.frames[self.position][1]
+            self.position = self.position + 1
+
+        self.frame = self.frame + 1
+        return elapsed
+
+    def close(self):
+        # Nothing to finish when replaying.
+        # - self is the InputReplay
+
+        pass
@@ -0,0 +1,24 @@
+import random
+
+# The separate random streams a session rolls from
+STREAMS = ["encounter", "enemy", "combat"]
+
+
+class SessionRNG:
+    # An object in this class holds one seeded random.Random per part of
+    # the game (encounter rolls, enemy selection, combat rolls). Each stream
+    # is seeded from the session seed and its own name, so two sessions with
+    # the same seed roll the same numbers, and extra rolls in one stream
+    # never shift the numbers of another.
+
+    def __init__(self, seed=None):
+        # Initialize a SessionRNG.
+        # - self is the SessionRNG to initialize
+        # - seed is the session seed, a new random one when None
+
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+
+        self.seed = seed
+        for name in STREAMS:
+            setattr(self, name, random.Random(str(seed) + ":" + name))
@@ -0,0 +1,313 @@
+import mmap, os, queue, struct, sys, threading, zlib
+from array import array
+from assets import ASSET_DIR
+from gamelog import channel
+
+# Where the background autosave and the F5 quick-save slot are written
+AUTOSAVE_PATH = os.path.join(ASSET_DIR, "autosave.sav")
+QUICKSAVE_PATH = os.path.join(ASSET_DIR, "quicksave.slot")
+
+MAGIC = b"DQSV"
+SAVE_VERSION = 1
+
+# How many story flags and item types a save holds room for
+FLAG_COUNT = 4096
+ITEM_COUNT = 1024
+
+# The fixed layout of a save record, all little-endian:
+# - header: magic, version, spare, sequence number, crc32 of everything
+#   after the header
+# - hero: name, hp, attack pp, attack2 pp, exp (saved as 0 until heroes
+#   gain exp), world position x and y, steps until the next encounter
+# - flags: one bit per flag
+# - inventory: a uint16 count per item type
+HEADER = struct.Struct("<4sHHII")
+HERO = struct.Struct("<16sHHHIiiI")
+FLAG_BYTES = FLAG_COUNT // 8
+INVENTORY_BYTES = ITEM_COUNT * 2
+RECORD_SIZE = HEADER.size + HERO.size + FLAG_BYTES + INVENTORY_BYTES
+
+log = channel("save")
+
+
+class WorldState:
+    # An object in this class holds the story flags and inventory of a
+    # game, in the same fixed-size arrays the save file stores, so saving
+    # them is a copy of their bytes.
+    # - flags is a bytearray with one bit per flag
+    # - inventory is an array of uint16 item counts, indexed by item number
+
+    def __init__(self):
+        # Initialize a WorldState with every flag clear and no items.
+        # - self is the WorldState to initialize
+
+        self.flags = bytearray(FLAG_BYTES)
+        self.inventory = array("H", bytes(INVENTORY_BYTES))
+
+    def flag(self, number):
+        # Return True when a flag is set.
+        # - self is the WorldState
+        # - number is the flag's number, below FLAG_COUNT
+
+        return bool(self.flags[number >> 3] & (1 << (number & 7)))
+
+    def set_flag(self, number, value=True):
+        # Set or clear a flag.
+        # - self is the WorldState
+        # - number is the flag's number, below FLAG_COUNT
+        # - value is True to set the flag, False to clear it
+
+        if value:
+            self.flags[number >> 3] |= 1 << (number & 7)
+        else:
+            self.flags[number >> 3] &= ~(1 << (number & 7)) & 0xFF
+
+
+class SaveState:
+    # An object in this class is a snapshot of everything a save keeps.
+    # - hero_name is the hero's unit type
+    # - current_hp, attack1_pp and attack2_pp are the hero's hp and pp
+    # - exp is the hero's experience
+    # - position is the hero's [x, y] on the overworld
+    # - steps_left is how far the hero walks before the next encounter
+    # - world is the WorldState
+
+    __slots__ = ["hero_name", "current_hp", "attack1_pp", "attack2_pp", "exp", "position", "steps_left", "world"]
+
+    def __init__(self, hero_name, current_hp, attack1_pp, attack2_pp, exp, position, steps_left, world):
+        # Initialize a SaveState.
+        # - self is the SaveState to initialize
+
+        self.hero_name = hero_name
+        self.current_hp = current_hp
+        self.attack1_pp = attack1_pp
+        self.attack2_pp = attack2_pp
+        self.exp = exp
+        self.position = list(position)
+        self.steps_left = steps_left
+        self.world = world
+
+
+def pack_into(buffer, offset, state, sequence=0):
+    # Write a save record for state into a buffer, in place.
+    # - buffer is a writable buffer (bytearray or mmap) of at least
+    #   offset + RECORD_SIZE bytes
+    # - offset is where the record starts
+    # - state is the SaveState
+    # - sequence numbers the record, so the newest of several is known
+
+    body = offset + HEADER.size
+    HERO.pack_into(buffer, body, state.hero_name.encode("utf-8"), max(state.current_hp, 0),
+                   state.attack1_pp, state.attack2_pp, state.exp,
+                   state.position[0], state.position[1], max(state.steps_left, 0))
+
+    flags = body + HERO.size
+    buffer[flags:flags + FLAG_BYTES] = state.world.flags
+    inventory = state.world.inventory
+    if sys.byteorder == "big": # The file is little-endian whatever the machine
+        inventory = array("H", inventory)
+        inventory.byteswap()
+    buffer[flags + FLAG_BYTES:offset + RECORD_SIZE] = memoryview(inventory).cast("B")
+
+    crc = zlib.crc32(memoryview(buffer)[body:offset + RECORD_SIZE])
+    HEADER.pack_into(buffer, offset, MAGIC, SAVE_VERSION, 0, sequence, crc)
+
+
+def pack(state, sequence=0):
+    # Return a save record for state as bytes.
+    # - state is the SaveState
+    # - sequence numbers the record
+
+    buffer = bytearray(RECORD_SIZE)
+    pack_into(buffer, 0, state, sequence)
+    return bytes(buffer)
+
+
+def read_header(buffer, offset=0):
+    # Return the sequence number of a valid save record, or raise
+    # ValueError when the record is not a save, is from a newer version or
+    # was only partly written.
+    # - buffer holds the record
+    # - offset is where it starts
+
+    if len(buffer) < offset + RECORD_SIZE:
+        raise ValueError("save record is truncated")
+    magic, version, spare, sequence, crc = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise ValueError("not a save record")
+    if version != SAVE_VERSION:
+        raise ValueError("unsupported save version %d" % version)
+    if zlib.crc32(memoryview(buffer)[offset + HEADER.size:offset + RECORD_SIZE]) != crc:
+        raise ValueError("save record is corrupt")
+    return sequence
+
+
+def unpack(buffer, offset=0):
+    # Return the SaveState of a save record, or raise ValueError when it is
+    # not a valid one.
+    # - buffer holds the record
+    # - offset is where it starts
+
+    read_header(buffer, offset)
+
+    body = offset + HEADER.size
+    name, hp, pp1, pp2, exp, x, y, steps_left = HERO.unpack_from(buffer, body)
+
+    world = WorldState()
+    flags = body + HERO.size
+    world.flags[:] = buffer[flags:flags + FLAG_BYTES]
+    world.inventory = array("H", bytes(buffer[flags + FLAG_BYTES:offset + RECORD_SIZE]))
+    if sys.byteorder == "big":
+        world.inventory.byteswap()
+
+    return SaveState(name.rstrip(b"\0").decode("utf-8"), hp, pp1, pp2, exp, [x, y], steps_left, world)
+
+
+def write_file(path, data):
+    # Write a save file so that a crash leaves either the old or the new
+    # save, never half of one.
+    # - path is the file to write
+    # - data is the bytes to write
+
+    with open(path + ".tmp", "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def save(path, state):
+    # Write state to a save file.
+    # - path is the file to write
+    # - state is the SaveState
+
+    write_file(path, pack(state))
+
+
+def load(path):
+    # Return the SaveState in a save file, or raise ValueError when the
+    # file is not a valid save.
+    # - path is the file to read
+
+    with open(path, "rb") as file:
+        return unpack(file.read())
+
+
+class SaveSlot:
+    # An object in this class is a save slot kept mapped in memory, so a
+    # quick-save is a copy into the mapping that the OS writes out on its
+    # own. The slot holds two records and each save overwrites the older
+    # one, so a save cut off halfway still leaves the one before it.
+    # Without a path the slot is only kept in memory, for games that must
+    # not touch the player's saves (replays and server sessions).
+
+    def __init__(self, path=QUICKSAVE_PATH):
+        # Initialize a SaveSlot, creating its file when missing.
+        # - self is the SaveSlot to initialize
+        # - path is the slot's file, or None for a slot in memory only
+
+        self.file = None
+        if path is None:
+            self.map = mmap.mmap(-1, 2 * RECORD_SIZE)
+        else:
+            self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+            if os.fstat(self.file.fileno()).st_size != 2 * RECORD_SIZE:
+                self.file.truncate(2 * RECORD_SIZE)
+            self.map = mmap.mmap(self.file.fileno(), 2 * RECORD_SIZE)
+        self.sequence = max([sequence for sequence, offset in self.records()] or [0])
+
+    def records(self):
+        # Return (sequence, offset) of each valid record in the slot.
+        # - self is the SaveSlot
+
+        found = []
+        for offset in (0, RECORD_SIZE):
+            try:
+                found.append((read_header(self.map, offset), offset))
+            except ValueError:
+                pass
+        return found
+
+    def write(self, state):
+        # Save state over the older of the slot's two records.
+        # - self is the SaveSlot
+        # - state is the SaveState
+
+        self.sequence = self.sequence + 1
+        pack_into(self.map, (self.sequence % 2) * RECORD_SIZE, state, self.sequence)
+
+    def read(self):
+        # Return the newest SaveState in the slot, or None when it is empty.
+        # - self is the SaveSlot
+
+        records = self.records()
+        if not records:
+            return None
+        sequence, offset = max(records)
+        return unpack(self.map, offset)
+
+    def close(self):
+        # Write the slot out and close it.
+        # - self is the SaveSlot
+
+        if self.file is not None:
+            self.map.flush()
+        self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+
+class Autosaver:
+    # An object in this class writes saves from a background thread, so the
+    # game loop only pays for packing a snapshot (a few microseconds). When
+    # saves are requested faster than the disk takes them, only the newest
+    # is written.
+
+    def __init__(self, path=AUTOSAVE_PATH):
+        # Initialize an Autosaver and start its thread.
+        # - self is the Autosaver to initialize
+        # - path is the file autosaves go to
+
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.saves = 0 # Number of saves written
+        self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+        self.thread.start()
+
+    def request(self, state):
+        # Queue a save of state. The snapshot is packed now, so later
+        # changes to the game do not leak into it.
+        # - self is the Autosaver
+        # - state is the SaveState
+
+        self.queue.put(pack(state))
+
+    def run(self):
+        # Write queued saves until close() is called.
+        # - self is the Autosaver
+
+        running = True
+        while running:
+            data = self.queue.get()
+            while not self.queue.empty(): # Skip to the newest snapshot
+                newer = self.queue.get()
+                if newer is None:
+                    running = False
+                else:
+                    data = newer
+            if data is None:
+                return
+
+            try:
+                write_file(self.path, data)
+                self.saves = self.saves + 1
+                log.debug("autosaved to %s", self.path)
+            except OSError as error:
+                log.error("autosave failed: %s", error)
+
+    def close(self):
+        # Write any save still queued and stop the thread.
+        # - self is the Autosaver
+
+        self.queue.put(None)
+        self.thread.join()
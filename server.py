@@ -0,0 +1,555 @@
+import argparse, asyncio, gc, json, os, random, time
+from collections import deque
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # Sessions are never shown
+import pygame
+from assets import assets, GAME_IMAGES
+from DragonQuestModelOptions import Game, WALK_KEYS
+import combat
+from profiler import FrameTimer, allocations, percentile
+from replay import RECORDING_VERSION, decode, decode_save
+from rng import SessionRNG
+from policy import precompute
+from unit import names
+try:
+    import resource # Unix only: the process's peak memory for the report
+except ImportError:
+    resource = None
+
+# Ticks a second every session advances by, and the frame length in ms
+# each tick hands a bot's game
+TICK_RATE = 60
+
+# Where the server listens for recordings to replay
+HOST = "127.0.0.1"
+PORT = 7777
+
+# Recorded frames a socket session buffers before it stops reading, so a
+# fast client cannot fill the server's memory
+MAX_PENDING = 256
+
+# Seconds between throughput reports
+REPORT_EVERY = 5.0
+
+
+class SessionInput:
+    # An object in this class is where a session's game gets its events,
+    # in place of an InputRecorder. Frames are queued by a Bot or a socket
+    # as (events, ms the frame lasts) and handed out one per tick.
+
+    def __init__(self):
+        # Initialize a SessionInput with nothing queued.
+        # - self is the SessionInput to initialize
+
+        self.frames = deque()
+        self.events = [] # The events of the frame being played
+        self.finished = False # No more frames will be queued
+
+    def put(self, events, elapsed):
+        # Queue a frame.
+        # - self is the SessionInput
+        # - events is the frame's list of pygame events
+        # - elapsed is how many ms of game time the frame lasts
+
+        self.frames.append((events, elapsed))
+
+    def next_frame(self):
+        # Start the next queued frame and return its length in ms, or None
+        # when no frame has arrived yet. Once the input is finished and
+        # played out, every frame is a QUIT, like the end of an InputReplay.
+        # - self is the SessionInput
+
+        if self.frames:
+            self.events, elapsed = self.frames.popleft()
+            return elapsed
+        if self.finished:
+            self.events = [pygame.event.Event(pygame.QUIT)]
+            return 0
+        return None
+
+    def get(self):
+        # Return the events of the frame being played, like pygame.event.get.
+        # - self is the SessionInput
+
+        events = self.events
+        self.events = []
+        return events
+
+    def close(self):
+        # Nothing to finish.
+        # - self is the SessionInput
+
+        pass
+
+
+class Bot:
+    # An object in this class plays a game with scripted moves: it picks a
+    # hero, walks the overworld in random directions and fights with the
+    # move the solved policy likes best, now and then trying another one.
+    # Its choices come from its own seeded random.Random, so a bot session
+    # plays the same way every run.
+
+    def __init__(self, seed, ticks=None):
+        # Initialize a Bot.
+        # - self is the Bot to initialize
+        # - seed seeds the bot's choices
+        # - ticks is how many ticks the bot plays before quitting, or None
+        #   to play until the hero falls
+
+        self.rng = random.Random(seed)
+        self.ticks = ticks
+        self.played = 0
+        self.key = None # The arrow key held down
+        self.walk_left = 0 # Ticks until the bot picks a new direction
+        self.scene = None
+
+    def events(self, game):
+        # Return the events the bot sends this tick.
+        # - self is the Bot
+        # - game is the Game it plays
+
+        self.played = self.played + 1
+        if self.ticks is not None and self.played > self.ticks:
+            return [pygame.event.Event(pygame.QUIT)]
+
+        scene = game.scenes[-1]
+        entered = scene is not self.scene
+        self.scene = scene
+
+        if scene.name == "select":
+            rect = self.rng.choice([scene.rect_swordsman, scene.rect_archer])
+            return [click(rect)]
+        if scene.name == "overworld":
+            return self.walk(entered)
+        if scene.name == "battle":
+            return self.fight(scene)
+        if scene.name == "game_over":
+            return [pygame.event.Event(pygame.QUIT)]
+        return []
+
+    def walk(self, entered):
+        # Return the key events that keep the hero walking, turning to a
+        # random direction every few seconds and after every fight.
+        # - self is the Bot
+        # - entered is True on the first tick back on the overworld
+
+        self.walk_left = self.walk_left - 1
+        if self.walk_left > 0 and not entered:
+            return []
+
+        events = []
+        if self.key is not None:
+            events.append(pygame.event.Event(pygame.KEYUP, key=self.key))
+        self.key = self.rng.choice(list(WALK_KEYS))
+        self.walk_left = self.rng.randint(30, 240)
+        events.append(pygame.event.Event(pygame.KEYDOWN, key=self.key))
+        return events
+
+    def fight(self, battle):
+        # Return the clicks of the bot's next move once the battle waits
+        # for one: sometimes a new target, then the best move or, one time
+        # in five, any move the hero can make.
+        # - self is the Bot
+        # - battle is the Battle being fought
+
+        if not battle.can_attack or battle.timeline.busy():
+            return []
+
+        events = []
+        standing = [slot for slot in range(len(battle.enemies)) if battle.enemies[slot].current_hp > 0]
+        if len(battle.enemies) > 1 and standing and self.rng.random() < 0.3:
+            events.append(click(battle.enemy_rects[self.rng.choice(standing)]))
+
+        if self.rng.random() < 0.8:
+            action = battle.best_action()
+        else:
+            action = self.rng.choice(combat.legal_actions(battle.hero))
+        events.append(click(battle.action_rects[action]))
+        return events
+
+
+def click(rect):
+    # Return a click in the middle of rect.
+
+    return pygame.event.Event(pygame.MOUSEBUTTONUP, pos=rect.center, button=1)
+
+
+class Session:
+    # An object in this class is one game hosted by the server, with its
+    # own Game, scenes and SessionRNG and its own FrameTimer measuring what
+    # each of its ticks costs. A Bot drives it, or frames arrive from a
+    # recording sent over the socket. Its quick-save slot is kept in memory,
+    # so sessions never share or overwrite the player's saves.
+
+    def __init__(self, number, seed, surface, bot=None, tick_rate=TICK_RATE, draw=False, loaded=None, quick_saved=None):
+        # Initialize a Session at the character select screen, or where a
+        # recording's save left the hero.
+        # - self is the Session to initialize
+        # - number identifies the session in reports
+        # - seed is the session's SessionRNG seed
+        # - surface is the surface its scenes draw on, shared by every
+        #   session since no one watches it
+        # - bot is the Bot playing it, or None for socket input
+        # - tick_rate is the server's ticks a second, the session's frame budget
+        # - draw is True to draw and present every frame; without it the
+        #   session draws nothing at all
+        # - loaded and quick_saved are the SaveStates a recording started
+        #   from and found in its quick-save slot, or None
+
+        self.number = number
+        self.seed = seed
+        self.bot = bot
+        self.draw = draw
+        self.tick_ms = 1000 // tick_rate
+        self.input = SessionInput()
+        self.timer = FrameTimer(tick_rate)
+        self.game = Game(surface, self.input, SessionRNG(seed), self.timer)
+        self.game.begin(loaded, quick_saved)
+        self.game.switch_scenes()
+        self.game.battle # Built now rather than at the first fight, so the session's memory is all there from its first tick
+
+        self.ticks = 0
+        self.work = 0.0 # ms spent in all its ticks
+        self.battles = 0
+        self.scene = self.game.scenes[-1]
+
+    def step(self):
+        # Play one frame of the game. Returns False when a socket session
+        # has no frame to play yet.
+        # - self is the Session
+
+        if self.bot is not None:
+            self.input.put(self.bot.events(self.game), self.tick_ms)
+
+        elapsed = self.input.next_frame()
+        if elapsed is None:
+            return False
+
+        start = time.perf_counter()
+        self.game.step(self.draw, elapsed)
+        self.work = self.work + (time.perf_counter() - start) * 1000
+        self.ticks = self.ticks + 1
+
+        if self.game.scenes and self.game.scenes[-1] is not self.scene:
+            self.scene = self.game.scenes[-1]
+            if self.scene.name == "battle":
+                self.battles = self.battles + 1
+        return True
+
+    def done(self):
+        # Return True once the game has quit.
+        # - self is the Session
+
+        return not self.game.scenes
+
+    def summary(self):
+        # Return a dict of what happened in the session and what its ticks
+        # cost in ms.
+        # - self is the Session
+
+        stats = self.timer.stats()
+        hero = self.game.hero
+        return {"session": self.number, "seed": self.seed, "input": "bot" if self.bot is not None else "socket",
+                "ticks": self.ticks, "battles": self.battles, "game_over": self.scene.name == "game_over",
+                "hero": hero.name if hero is not None else None, "hp": hero.current_hp if hero is not None else None,
+                "tick_mean": self.work / self.ticks if self.ticks else 0.0,
+                "tick_p50": stats["p50"], "tick_p99": stats["p99"], "over_budget": stats["dropped"]}
+
+
+class Server:
+    # An object in this class hosts many Sessions in one process on a fixed
+    # timestep: every tick each session plays one frame, then the server
+    # waits for the next tick on the asyncio loop, which also serves the
+    # socket. When a tick takes longer than the step the ticks it owes are
+    # dropped rather than run back to back, and counted as late.
+
+    def __init__(self, surface, tick_rate=TICK_RATE, draw=False, fast=False):
+        # Initialize a Server with no sessions.
+        # - self is the Server to initialize
+        # - surface is the surface every session draws on
+        # - tick_rate is the ticks a second
+        # - draw is True to draw every session's frames
+        # - fast is True to run ticks back to back instead of in real time
+
+        self.surface = surface
+        self.tick_rate = tick_rate
+        self.draw = draw
+        self.fast = fast
+        self.sessions = []
+        self.results = [] # The summaries of the sessions that ended
+        self.ended = {} # Session -> Future a socket client waits on
+        self.count = 0 # Sessions started
+        self.ticks = 0 # Server ticks
+        self.session_ticks = 0 # Frames played across every session
+        self.late = 0 # Ticks that ran past their time
+        self.listening = False
+        self.stopping = False
+        self.started = time.perf_counter()
+        self.last_report = (self.started, 0)
+
+    def add(self, seed, bot=None, loaded=None, quick_saved=None):
+        # Start a session and return it.
+        # - self is the Server
+        # - seed is the session's seed
+        # - bot is the Bot playing it, or None for socket input
+        # - loaded and quick_saved are the saves a recording starts from
+
+        session = Session(self.count, seed, self.surface, bot, self.tick_rate, self.draw, loaded, quick_saved)
+        self.count = self.count + 1
+        self.sessions.append(session)
+        return session
+
+    def tick(self):
+        # Play one frame of every session and retire the ones that quit.
+        # - self is the Server
+
+        for session in self.sessions:
+            if session.step():
+                self.session_ticks = self.session_ticks + 1
+
+        if any(session.done() for session in self.sessions):
+            for session in [session for session in self.sessions if session.done()]:
+                self.end(session)
+        self.ticks = self.ticks + 1
+
+    def end(self, session):
+        # Retire a session, keeping its summary.
+        # - self is the Server
+        # - session is the Session that quit
+
+        self.sessions.remove(session)
+        session.game.close()
+        summary = session.summary()
+        self.results.append(summary)
+        future = self.ended.pop(session, None)
+        if future is not None and not future.done():
+            future.set_result(summary)
+
+    async def run(self, duration=None):
+        # Tick until every session ended (and the server is not listening),
+        # until duration seconds passed or until stop() is called.
+        # - self is the Server
+        # - duration is the most seconds to run, or None
+
+        loop = asyncio.get_running_loop()
+        step = 1 / self.tick_rate
+        next_tick = loop.time()
+        stop_at = None if duration is None else loop.time() + duration
+
+        while not self.stopping and (self.sessions or self.listening):
+            self.tick()
+
+            now = loop.time()
+            if now - self.last_report[0] >= REPORT_EVERY:
+                print(self.report_line(), flush=True)
+            if stop_at is not None and now >= stop_at:
+                break
+
+            if self.fast:
+                await asyncio.sleep(0) # Let the socket be served
+                continue
+            next_tick = next_tick + step
+            if next_tick < now:
+                self.late = self.late + 1
+                next_tick = now
+            await asyncio.sleep(next_tick - now)
+
+    def stop(self):
+        # Stop ticking after the current tick.
+        # - self is the Server
+
+        self.stopping = True
+
+    def stats(self):
+        # Return a dict of the server's throughput and the sessions' tick
+        # costs in ms, over the last window of every live session.
+        # - self is the Server
+
+        now = time.perf_counter()
+        seconds = now - self.started
+        work = sorted(ms for session in self.sessions for ms in session.timer.window)
+        slowest = max(self.sessions, key=lambda session: session.timer.stats()["p99"], default=None)
+        return {"seconds": seconds, "sessions": len(self.sessions), "started": self.count,
+                "ticks": self.ticks, "late": self.late, "session_ticks": self.session_ticks,
+                "session_ticks_per_second": self.session_ticks / seconds if seconds else 0.0,
+                "tick_p50": percentile(work, 0.50), "tick_p99": percentile(work, 0.99),
+                "tick_max": work[-1] if work else 0.0,
+                "slowest_session": slowest.number if slowest is not None else None,
+                "battles": sum(session.battles for session in self.sessions) + sum(result["battles"] for result in self.results),
+                "peak_rss_mb": peak_rss_mb()}
+
+    def report_line(self):
+        # Return a one line report of the throughput since the last one and
+        # the current tick costs.
+        # - self is the Server
+
+        now = time.perf_counter()
+        then, ticks = self.last_report
+        self.last_report = (now, self.session_ticks)
+        stats = self.stats()
+        rate = (self.session_ticks - ticks) / (now - then) if now > then else 0.0
+        return ("%6.0fs  sessions %4d  session ticks/s %8.0f  tick p50 %.3f p99 %.3f max %.3f ms  late %d  battles %d  rss %s MB" %
+                (stats["seconds"], stats["sessions"], rate, stats["tick_p50"], stats["tick_p99"], stats["tick_max"],
+                 stats["late"], stats["battles"], "%.0f" % stats["peak_rss_mb"] if stats["peak_rss_mb"] else "?"))
+
+    async def listen(self, host=HOST, port=PORT):
+        # Accept recordings over the socket, each played as a new session.
+        # Returns the asyncio server.
+        # - self is the Server
+        # - host and port are where to listen; keep host local
+
+        self.listening = True
+        return await asyncio.start_server(self.serve, host, port)
+
+    async def serve(self, reader, writer):
+        # Play the recording a client sends as a new session, then send
+        # back the session's summary as one JSON line. The client sends an
+        # InputRecorder file: its header line, then one line per frame.
+        # - self is the Server
+        # - reader and writer are the client's streams
+
+        try:
+            header = json.loads(await reader.readline())
+            if header.get("version") != RECORDING_VERSION:
+                raise ValueError("unsupported recording version: " + str(header.get("version")))
+            loaded = decode_save(header.get("loaded"))
+            quick_saved = decode_save(header.get("quick_saved"))
+        except ValueError as error:
+            writer.write((json.dumps({"error": str(error)}) + "\n").encode())
+            writer.close()
+            return
+
+        session = self.add(header["seed"], None, loaded, quick_saved)
+        ended = asyncio.get_running_loop().create_future()
+        self.ended[session] = ended
+
+        while not session.done():
+            while len(session.input.frames) > MAX_PENDING and not session.done():
+                await asyncio.sleep(1 / self.tick_rate)
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                frame, elapsed, recorded = json.loads(line)
+                session.input.put(decode(recorded), elapsed)
+        session.input.finished = True
+
+        summary = await ended
+        writer.write((json.dumps(summary) + "\n").encode())
+        await writer.drain()
+        writer.close()
+
+
+def peak_rss_mb():
+    # Return the most memory the process has used in MB, or None where the
+    # resource module is missing.
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if os.uname().sysname != "Darwin" else peak / 1024 / 1024 # macOS counts bytes
+
+
+async def send(path, host=HOST, port=PORT, clients=1):
+    # Send a recording to a server as clients sessions at once and return
+    # their summaries.
+    # - path is the InputRecorder file to send
+    # - host and port are where the server listens
+    # - clients is how many copies to play at the same time
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    async def one():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(data)
+        await writer.drain()
+        writer.write_eof()
+        summary = json.loads(await reader.readline())
+        writer.close()
+        return summary
+
+    return await asyncio.gather(*[one() for i in range(clients)])
+
+
+async def host(args):
+    # Run a server as the command line asks.
+    # - args are the parsed arguments
+
+    # Every session shares the solved policy tables: solving them now
+    # keeps the solves out of the ticks and out of the memory checks
+    precompute(names("hero"), names("enemy"))
+    if args.memory or args.steady:
+        allocations.start(steady=args.steady, by_scene=False) # Sessions switch scenes at once, so sites are not split by scene
+
+    server = Server(pygame.display.get_surface(), args.tick_rate, args.draw, args.fast)
+    for number in range(args.bots):
+        server.add(args.seed + number, Bot(args.seed + number, args.ticks))
+
+    # The bots' games live until the end: freezing them keeps the garbage
+    # collector from scanning them on every collection during the ticks
+    gc.collect()
+    gc.freeze()
+
+    listener = None
+    if args.listen:
+        listener = await server.listen(args.host, args.port)
+        print("listening on %s:%d" % (args.host, args.port), flush=True)
+
+    try:
+        await server.run(args.duration)
+    finally:
+        if listener is not None:
+            listener.close()
+        print(server.report_line())
+        allocations.close(args.memory)
+        if args.memory:
+            print("memory report written to " + args.memory)
+        if args.report:
+            with open(args.report, "w") as file:
+                json.dump({"server": server.stats(), "sessions": server.results + [session.summary() for session in server.sessions]}, file, indent=1)
+
+
+def main():
+    # Host bot and replayed sessions, or send a recording to a server.
+
+    parser = argparse.ArgumentParser(description="Host many headless game sessions on a fixed timestep and report their throughput.")
+    parser.add_argument("--bots", type=int, default=0, help="scripted bot sessions to start")
+    parser.add_argument("--ticks", type=int, help="ticks each bot plays before quitting (default: until its hero falls)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first bot; the others count up from it")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE, help="ticks a second")
+    parser.add_argument("--fast", action="store_true", help="run ticks back to back instead of in real time")
+    parser.add_argument("--draw", action="store_true", help="draw and present every session's frames")
+    parser.add_argument("--duration", type=float, help="seconds to run before stopping")
+    parser.add_argument("--listen", action="store_true", help="accept recordings to replay over the socket")
+    parser.add_argument("--host", default=HOST, help="address to listen on or send to")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on or send to")
+    parser.add_argument("--report", help="JSON file to write the server and session stats to")
+    parser.add_argument("--memory", help="text file to write the sites that allocated the memory kept to")
+    parser.add_argument("--steady", type=int, metavar="N",
+                        help="fail once memory grows over N more encounters in every session, after each has warmed up over N")
+    parser.add_argument("--send", metavar="RECORDING", help="send a recording to a listening server instead of hosting")
+    parser.add_argument("--clients", type=int, default=1, help="copies of the recording to send at once")
+    args = parser.parse_args()
+
+    if args.send:
+        for summary in asyncio.run(send(args.send, args.host, args.port, args.clients)):
+            print(json.dumps(summary))
+        return
+
+    if not args.bots and not args.listen:
+        parser.error("start some --bots or --listen for recordings")
+
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_mode((500, 400))
+    assets.preload(GAME_IMAGES)
+
+    try:
+        asyncio.run(host(args))
+    except KeyboardInterrupt:
+        pass
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
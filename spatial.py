@@ -0,0 +1,99 @@
+import pygame
+
+# Default width of a SpatialGrid cell in pixels
+CELL_SIZE = 64
+
+
+class SpatialGrid:
+    # An object in this class finds the map objects in an area quickly. The
+    # world is divided into square cells and each object is listed in every
+    # cell its rect touches, so a query only looks at the objects in the
+    # cells it covers: its cost depends on how many objects are nearby, not
+    # on how many the map holds.
+
+    def __init__(self, cell_size=CELL_SIZE):
+        # Initialize an empty SpatialGrid.
+        # - self is the SpatialGrid to initialize
+        # - cell_size is a cell's width in pixels, best a little larger
+        #   than the things usually queried
+
+        self.cell_size = cell_size
+        self.cells = {} # (cx, cy) -> list of (rect, item, number inserted)
+        self.count = 0
+        self.inserted = 0
+
+    def cell_keys(self, rect):
+        # Return the keys of every cell a rect touches.
+        # - self is the SpatialGrid
+        # - rect is a Rect in world coordinates
+
+        size = self.cell_size
+        return [(cx, cy) for cy in range(rect.top // size, (rect.bottom - 1) // size + 1)
+                         for cx in range(rect.left // size, (rect.right - 1) // size + 1)]
+
+    def insert(self, item, rect):
+        # Add an object to the grid.
+        # - self is the SpatialGrid
+        # - item is the object
+        # - rect is its area in world coordinates
+
+        entry = (pygame.Rect(rect), item, self.inserted)
+        for key in self.cell_keys(entry[0]):
+            self.cells.setdefault(key, []).append(entry)
+        self.count = self.count + 1
+        self.inserted = self.inserted + 1
+
+    def remove(self, item, rect):
+        # Take an object out of the grid.
+        # - self is the SpatialGrid
+        # - item is the object
+        # - rect is the area it was inserted with
+
+        rect = pygame.Rect(rect)
+        for key in self.cell_keys(rect):
+            cell = self.cells.get(key)
+            if cell is None:
+                continue
+            cell[:] = [entry for entry in cell if entry[1] is not item]
+            if not cell:
+                del self.cells[key]
+        self.count = self.count - 1
+
+    def query(self, rect):
+        # Return every object whose area overlaps rect, each once, in the
+        # order they were inserted.
+        # - self is the SpatialGrid
+        # - rect is a Rect in world coordinates
+
+        found = {}
+        for key in self.cell_keys(rect):
+            for entry in self.cells.get(key, ()):
+                if entry[0].colliderect(rect):
+                    found[entry[2]] = entry[1]
+        return [found[number] for number in sorted(found)]
+
+    def query_point(self, point):
+        # Return every object whose area covers a point.
+        # - self is the SpatialGrid
+        # - point is an (x, y) position in world coordinates
+
+        key = (point[0] // self.cell_size, point[1] // self.cell_size)
+        return [entry[1] for entry in self.cells.get(key, ()) if entry[0].collidepoint(point)]
+
+    def collides(self, rect):
+        # Return True when any object overlaps rect, stopping at the first.
+        # This runs every time something moves, so it walks the cells
+        # directly instead of building a list of their keys.
+        # - self is the SpatialGrid
+        # - rect is a Rect in world coordinates
+
+        size = self.cell_size
+        cells = self.cells
+        for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                cell = cells.get((cx, cy))
+                if cell is not None:
+                    for entry in cell:
+                        if entry[0].colliderect(rect):
+                            return True
+        return False
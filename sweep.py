@@ -0,0 +1,247 @@
+import argparse, json, multiprocessing, os, signal, time, types
+import numpy as np
+import balance
+from unit import UnitTemplate, catalog, names
+
+# Stats a sweep can vary: every number in a UnitTemplate
+STATS = [field for field in UnitTemplate.__slots__ if field not in ("name", "kind", "image_name")]
+
+# Columns written for every stat combination, after the swept stats
+RESULTS = [("win_rate", "float32"), ("draw_rate", "float32"), ("hp_lost", "float32"), ("turns_mean", "float32")]
+
+# The file in the output directory that records the settings and progress
+MANIFEST = "sweep.json"
+
+# Stat combinations handed to a worker at once
+CHUNK = 64
+
+
+def parse_range(text):
+    # Return the values of a stat range given as first:last[:step]
+    # (both ends included) or as a comma separated list.
+    # - text is the range as typed on the command line
+
+    if ":" not in text:
+        return [int(value) for value in text.split(",")]
+
+    parts = [int(value) for value in text.split(":")]
+    if len(parts) == 2:
+        parts.append(1)
+    first, last, step = parts
+    if step < 1 or last < first:
+        raise ValueError("a range needs first <= last and a positive step")
+    return list(range(first, last + 1, step))
+
+
+def swept_unit(name, stats):
+    # Return a stand-in for a full hp and pp Unit of a type, with some of
+    # its stats replaced. balance.simulate only reads stats, so this is all
+    # a sweep needs, and the shared templates stay untouched.
+    # - name is the unit type's name in the catalog
+    # - stats is a dict from stat name to its new value
+
+    template = catalog()[name]
+    values = {field: getattr(template, field) for field in UnitTemplate.__slots__}
+    values.update(stats)
+    unit = types.SimpleNamespace(**values)
+    unit.current_hp = unit.health
+    unit.attack1_current_pp = unit.attack1_max_pp
+    unit.attack2_current_pp = unit.attack2_max_pp
+    return unit
+
+
+def combination(spec, index):
+    # Return the dict of stat values at one position of the sweep's grid.
+    # The last stat changes fastest, like itertools.product.
+    # - spec is the sweep's settings
+    # - index is the combination's number
+
+    shape = [len(values) for name, values in spec["stats"]]
+    position = np.unravel_index(index, shape)
+    return {name: values[i] for (name, values), i in zip(spec["stats"], position)}
+
+
+def run_chunk(task):
+    # Fight every stat combination from start to stop and return the
+    # result columns. Each combination has its own seed made from the
+    # sweep's seed and its number, so its numbers are the same whichever
+    # worker runs it and however the grid is split.
+    # - task is (spec, start, stop): the sweep's settings and the first and
+    #   one past the last combination
+
+    spec, start, stop = task
+    columns = {name: np.zeros(stop - start, dtype=dtype) for name, dtype in RESULTS}
+
+    for row, index in enumerate(range(start, stop)):
+        stats = combination(spec, index)
+        hero_stats = stats if spec["side"] == "hero" else {}
+        enemy_stats = stats if spec["side"] == "enemy" else {}
+        hero = swept_unit(spec["hero"], hero_stats)
+        enemy = swept_unit(spec["enemy"], enemy_stats)
+
+        rng = np.random.default_rng([spec["seed"], index])
+        won, turns, hero_hp_left = balance.simulate(hero, enemy, spec["fights"], rng, balance.POLICIES[spec["policy"]])
+        drawn = balance.undecided(won, hero_hp_left)
+
+        columns["win_rate"][row] = won.mean()
+        columns["draw_rate"][row] = drawn.mean()
+        columns["hp_lost"][row] = hero.current_hp - hero_hp_left.mean()
+        columns["turns_mean"][row] = turns[~drawn].mean() if (~drawn).any() else np.nan
+
+    return columns
+
+
+def column_files(directory, spec):
+    # Return (name, dtype, path) for every column of a sweep's output: the
+    # swept stats first, then the results.
+    # - directory is the output directory
+    # - spec is the sweep's settings
+
+    columns = [(name, "int32") for name, values in spec["stats"]] + RESULTS
+    return [(name, dtype, os.path.join(directory, name + ".bin")) for name, dtype in columns]
+
+
+def write_manifest(directory, spec, rows):
+    # Record the sweep's settings and how many rows are safely written. The
+    # file is replaced in one step, so a crash leaves the last checkpoint.
+    # - directory is the output directory
+    # - spec is the sweep's settings
+    # - rows is the number of finished combinations
+
+    path = os.path.join(directory, MANIFEST)
+    columns = [[name, dtype] for name, dtype, column_path in column_files(directory, spec)]
+    with open(path + ".tmp", "w") as file:
+        json.dump({"spec": spec, "columns": columns, "rows": rows, "total": total(spec)}, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def total(spec):
+    # Return the number of stat combinations in a sweep.
+
+    count = 1
+    for name, values in spec["stats"]:
+        count = count * len(values)
+    return count
+
+
+def resume(directory, spec):
+    # Return how many combinations an earlier run of the same sweep
+    # finished, cutting each column file back to that many rows in case the
+    # run stopped between writing the columns and the checkpoint. Returns
+    # 0 for a new sweep.
+    # - directory is the output directory
+    # - spec is the sweep's settings
+
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return 0
+
+    with open(path) as file:
+        manifest = json.load(file)
+    if manifest["spec"] != spec:
+        raise ValueError(directory + " holds a sweep with other settings")
+
+    rows = manifest["rows"]
+    for name, dtype, column_path in column_files(directory, spec):
+        with open(column_path, "ab") as file:
+            file.truncate(rows * np.dtype(dtype).itemsize)
+    return rows
+
+
+def sweep(spec, directory, workers=None, chunk=CHUNK):
+    # Run a sweep across a pool of processes, appending each chunk's rows
+    # to the column files in grid order and checkpointing after every
+    # chunk. A sweep that was stopped carries on where it left off.
+    # - spec is the sweep's settings
+    # - directory is the output directory
+    # - workers is the number of processes (default: one per core)
+    # - chunk is the number of combinations per task
+
+    os.makedirs(directory, exist_ok=True)
+    start = resume(directory, spec)
+    count = total(spec)
+    write_manifest(directory, spec, start)
+
+    stats = [name for name, values in spec["stats"]]
+    files = [(name, dtype, open(path, "ab")) for name, dtype, path in column_files(directory, spec)]
+    bounds = [(first, min(first + chunk, count)) for first in range(start, count, chunk)]
+    began = time.perf_counter()
+
+    # Workers ignore Ctrl-C; the main process stops them all at once
+    pool = multiprocessing.Pool(workers, signal.signal, (signal.SIGINT, signal.SIG_IGN))
+    try:
+        # imap() hands back chunks in order while later ones still run
+        results = pool.imap(run_chunk, [(spec, first, stop) for first, stop in bounds])
+        for (first, stop), columns in zip(bounds, results):
+            grid = [combination(spec, index) for index in range(first, stop)]
+            for name in stats:
+                columns[name] = np.array([values[name] for values in grid], dtype="int32")
+            for name, dtype, file in files:
+                file.write(columns[name].astype(dtype).tobytes())
+                file.flush()
+            write_manifest(directory, spec, stop)
+
+            seconds = time.perf_counter() - began
+            print("%d/%d combinations  %.1f/s" % (stop, count, (stop - start) / seconds), flush=True)
+    finally:
+        # On Ctrl-C the chunks still running are dropped; the checkpoint
+        # keeps what was written
+        pool.terminate()
+        for name, dtype, file in files:
+            file.close()
+
+
+def load(directory):
+    # Return a finished (or checkpointed) sweep's columns as a dict from
+    # name to numpy array.
+    # - directory is the output directory
+
+    with open(os.path.join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+
+    return {name: np.fromfile(os.path.join(directory, name + ".bin"), dtype=dtype, count=manifest["rows"])
+            for name, dtype in manifest["columns"]}
+
+
+def main():
+    # Sweep stat ranges of one side of a matchup from the command line.
+
+    parser = argparse.ArgumentParser(description="Sweep unit stats over a grid and measure each matchup with seeded fights.")
+    parser.add_argument("directory", help="output directory; an unfinished sweep there is resumed")
+    parser.add_argument("--hero", choices=names("hero"), default=names("hero")[0], help="hero unit")
+    parser.add_argument("--enemy", choices=names("enemy"), default=names("enemy")[0], help="enemy unit")
+    parser.add_argument("--side", choices=["hero", "enemy"], default="enemy", help="which unit's stats are swept")
+    parser.add_argument("--stat", action="append", default=[], metavar="NAME=RANGE",
+                        help="a stat and its values, as first:last[:step] or a,b,c (repeatable)")
+    parser.add_argument("-n", "--fights", type=int, default=2000, help="fights per combination")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--policy", choices=sorted(balance.POLICIES), default="strongest", help="how the hero picks moves")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="combinations per task")
+    args = parser.parse_args()
+
+    stats = []
+    for text in args.stat:
+        name, equals, values = text.partition("=")
+        if name not in STATS:
+            parser.error("unknown stat %s (choose from %s)" % (name, ", ".join(STATS)))
+        try:
+            stats.append([name, parse_range(values)])
+        except ValueError as error:
+            parser.error("bad range for %s: %s" % (name, error))
+    if not stats:
+        parser.error("give at least one --stat to sweep")
+
+    spec = {"hero": args.hero, "enemy": args.enemy, "side": args.side, "stats": stats,
+            "fights": args.fights, "seed": args.seed, "policy": args.policy}
+
+    try:
+        sweep(spec, args.directory, args.workers, args.chunk)
+    except ValueError as error:
+        parser.error(str(error))
+    except KeyboardInterrupt:
+        print("stopped; run the same command again to resume")
+
+
+if __name__ == "__main__":
+    main()
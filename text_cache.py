@@ -0,0 +1,81 @@
+import pygame
+from collections import OrderedDict
+
+# The font every HUD string, prompt and banner in the game is drawn with
+GAME_FONT = ('Arial', 24, True)
+
+
+class TextCache:
+    # An object in this class renders text for the game. Each font is looked
+    # up with SysFont once, and each rendered string is kept as a surface
+    # keyed by (text, color, font), so a string is only rasterized again
+    # after its value changes. The least recently used surfaces are dropped
+    # once more than max_surfaces are held.
+
+    def __init__(self, max_surfaces=256):
+        # Initialize a TextCache.
+        # - self is the TextCache to initialize
+        # - max_surfaces is the most rendered strings kept at once
+
+        self.max_surfaces = max_surfaces
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+        self.renders = 0 # Number of times a string was actually rasterized
+
+    def get_font(self, font=GAME_FONT):
+        # Return the pygame Font for a (name, size, bold) key, resolving
+        # it through the system font list the first time only.
+        # - self is the TextCache
+        # - font is a (name, size, bold) tuple
+
+        found = self.fonts.get(font)
+
+        if found is None:
+            name, size, bold = font
+            found = pygame.font.SysFont(name, size, bold)
+            self.fonts[font] = found
+
+        return found
+
+    def preload(self, fonts):
+        # Look up fonts ahead of time, so the first frame that draws with
+        # them does not wait on the system font list.
+        # - self is the TextCache
+        # - fonts is a list of (name, size, bold) tuples
+
+        for font in fonts:
+            self.get_font(font)
+
+    def render(self, text, color, font=GAME_FONT):
+        # Return an antialiased surface of text, reusing the last one
+        # rendered with the same text, color and font.
+        # - self is the TextCache
+        # - text is the string to draw
+        # - color is a pygame Color, color name or RGB tuple
+        # - font is a (name, size, bold) tuple
+
+        color = tuple(pygame.Color(color))
+        key = (text, color, font)
+        surface = self.surfaces.get(key)
+
+        if surface is None:
+            surface = self.get_font(font).render(text, True, color)
+            self.renders = self.renders + 1
+            self.surfaces[key] = surface
+
+            if len(self.surfaces) > self.max_surfaces:
+                self.surfaces.popitem(last=False) # Drop the least recently used
+        else:
+            self.surfaces.move_to_end(key)
+
+        return surface
+
+    def clear(self):
+        # Drop every rendered string, keeping the resolved fonts.
+        # - self is the TextCache
+
+        self.surfaces.clear()
+
+
+# The one cache shared by every scene that draws text
+text_cache = TextCache()
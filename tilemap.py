@@ -0,0 +1,276 @@
+import json, os, random
+from collections import OrderedDict, namedtuple
+import pygame
+from assets import ASSET_DIR
+from gamelog import channel
+
+# The overworld's map header; its tiles are in the data file it names
+MAP_PATH = os.path.join(ASSET_DIR, "overworld.json")
+
+# How many chunk surfaces a TileMap keeps at most, so memory stays bounded
+# however large the map is
+MAX_CHUNKS = 32
+
+log = channel("render")
+
+# A thing placed on the map
+# - kind is "wall" (blocks movement); the overworld ignores other kinds
+# - name names the object, like "door" or "sign"
+# - rect is its area in world pixels
+MapObject = namedtuple("MapObject", "kind name rect")
+
+
+class Camera:
+    # An object in this class is the part of the world shown on screen. It
+    # follows a target, staying inside the world, and turns world
+    # positions into screen positions.
+    # - rect is the area of the world the camera sees
+    # - viewport is where on the screen that area is drawn
+
+    def __init__(self, viewport, world):
+        # Initialize a Camera.
+        # - self is the Camera to initialize
+        # - viewport is the Rect of the screen the map is drawn in
+        # - world is the Rect of the whole world
+
+        self.viewport = pygame.Rect(viewport)
+        self.world = pygame.Rect(world)
+        self.rect = pygame.Rect((0, 0), self.viewport.size)
+
+    def follow(self, target):
+        # Center the camera on target and return True if it moved.
+        # - self is the Camera
+        # - target is a Rect in world coordinates
+
+        rect = self.rect.copy()
+        rect.center = target.center
+        rect.clamp_ip(self.world)
+
+        if rect == self.rect:
+            return False
+        self.rect = rect
+        return True
+
+    def to_screen(self, rect):
+        # Return where a world Rect is drawn on the screen.
+        # - self is the Camera
+        # - rect is a Rect in world coordinates
+
+        return rect.move(self.viewport.x - self.rect.x, self.viewport.y - self.rect.y)
+
+
+class TileMap:
+    # An object in this class is a world made of square tiles, split into
+    # square chunks. The tiles stay on disk, one block of bytes per chunk,
+    # and each chunk is read and drawn into its own surface only when the
+    # camera comes near it. Drawing the map is then a handful of chunk
+    # blits, and chunks far from the camera are dropped once more than
+    # max_chunks are held. The walls of solid tiles are streamed the same
+    # way, but on their own, so a map that is never drawn still blocks.
+
+    def __init__(self, path=MAP_PATH, max_chunks=MAX_CHUNKS):
+        # Initialize a TileMap by reading its header.
+        # - self is the TileMap to initialize
+        # - path is the map's JSON header
+        # - max_chunks is the most chunk surfaces to keep
+
+        with open(path) as file:
+            header = json.load(file)
+
+        self.tile_size = header["tile_size"]
+        self.chunk_tiles = header["chunk_tiles"]
+        self.chunk_size = self.tile_size * self.chunk_tiles
+        self.chunks_wide, self.chunks_high = header["chunks"]
+        self.colors = [pygame.Color(tile["color"]) for tile in header["tiles"]]
+        self.tile_names = [tile["name"] for tile in header["tiles"]]
+        self.solid = [tile.get("solid", False) for tile in header["tiles"]]
+        self.objects = [MapObject(entry["kind"], entry["name"], pygame.Rect(entry["rect"]))
+                        for entry in header.get("objects", [])]
+        self.data_path = os.path.join(os.path.dirname(path), header["data"])
+        self.rect = pygame.Rect(0, 0, self.chunks_wide * self.chunk_size, self.chunks_high * self.chunk_size)
+
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict() # (cx, cy) -> Surface, least recently drawn first
+        self.wall_chunks = OrderedDict() # (cx, cy) -> list of wall MapObjects, least recently near first
+        self.loads = 0 # Number of chunks read from disk
+
+    def chunk_range(self, rect, margin=0):
+        # Return the chunk coordinates that rect overlaps, widened by margin
+        # chunks on every side and kept inside the map.
+        # - self is the TileMap
+        # - rect is a Rect in world coordinates
+
+        left = max(rect.left // self.chunk_size - margin, 0)
+        top = max(rect.top // self.chunk_size - margin, 0)
+        right = min((rect.right - 1) // self.chunk_size + margin, self.chunks_wide - 1)
+        bottom = min((rect.bottom - 1) // self.chunk_size + margin, self.chunks_high - 1)
+        return [(cx, cy) for cy in range(top, bottom + 1) for cx in range(left, right + 1)]
+
+    def read_chunk(self, cx, cy):
+        # Return the tile numbers of one chunk, row by row, read from disk.
+        # - self is the TileMap
+
+        count = self.chunk_tiles * self.chunk_tiles
+        with open(self.data_path, "rb") as file:
+            file.seek((cy * self.chunks_wide + cx) * count)
+            return file.read(count)
+
+    def load_chunk(self, cx, cy):
+        # Read one chunk and draw its tiles into a new surface.
+        # - self is the TileMap
+
+        tiles = self.read_chunk(cx, cy)
+        surface = pygame.Surface((self.chunk_size, self.chunk_size))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+
+        size = self.tile_size
+        for i in range(len(tiles)):
+            row, column = divmod(i, self.chunk_tiles)
+            surface.fill(self.colors[tiles[i]], (column * size, row * size, size, size))
+
+        self.loads = self.loads + 1
+        log.debug("loaded chunk %d,%d", cx, cy)
+        return surface
+
+    def stream(self, camera_rect):
+        # Load the chunks the camera sees or is about to see, and drop the
+        # least recently used ones past max_chunks.
+        # - self is the TileMap
+        # - camera_rect is the Rect of the world the camera sees
+
+        for key in self.chunk_range(camera_rect, 1):
+            if key not in self.chunks:
+                self.chunks[key] = self.load_chunk(*key)
+
+        while len(self.chunks) > self.max_chunks:
+            key, surface = self.chunks.popitem(last=False)
+            log.debug("evicted chunk %d,%d", key[0], key[1])
+
+    def chunk_walls(self, cx, cy):
+        # Return a wall MapObject for every run of solid tiles along a row of
+        # one chunk, read from disk.
+        # - self is the TileMap
+
+        found = []
+        size = self.tile_size
+        tiles = self.read_chunk(cx, cy)
+        for row in range(self.chunk_tiles):
+            start = None
+            for column in range(self.chunk_tiles + 1):
+                solid = column < self.chunk_tiles and self.solid[tiles[row * self.chunk_tiles + column]]
+                if solid and start is None:
+                    start = column
+                elif not solid and start is not None:
+                    x = (cx * self.chunk_tiles + start) * size
+                    y = (cy * self.chunk_tiles + row) * size
+                    found.append(MapObject("wall", self.tile_names[tiles[row * self.chunk_tiles + start]],
+                                           pygame.Rect(x, y, (column - start) * size, size)))
+                    start = None
+        return found
+
+    def stream_walls(self, camera_rect, grid):
+        # Add the walls of the chunks the camera sees or is about to see to
+        # grid, and take out those of the least recently near chunks past
+        # max_chunks.
+        # - self is the TileMap
+        # - camera_rect is the Rect of the world the camera sees
+        # - grid is the SpatialGrid the walls are kept in
+
+        for key in self.chunk_range(camera_rect, 1):
+            walls = self.wall_chunks.get(key)
+            if walls is None:
+                walls = self.chunk_walls(*key)
+                for wall in walls:
+                    grid.insert(wall, wall.rect)
+                self.wall_chunks[key] = walls
+                log.debug("indexed %d walls of chunk %d,%d", len(walls), key[0], key[1])
+            else:
+                self.wall_chunks.move_to_end(key)
+
+        while len(self.wall_chunks) > self.max_chunks:
+            key, walls = self.wall_chunks.popitem(last=False)
+            for wall in walls:
+                grid.remove(wall, wall.rect)
+            log.debug("dropped the walls of chunk %d,%d", key[0], key[1])
+
+    def draw(self, surface, camera):
+        # Draw what the camera sees onto surface, one blit per chunk.
+        # - self is the TileMap
+        # - surface is the surface to draw on
+        # - camera is the Camera
+
+        self.stream(camera.rect)
+
+        blits = []
+        for key in self.chunk_range(camera.rect):
+            self.chunks.move_to_end(key)
+            position = (camera.viewport.x + key[0] * self.chunk_size - camera.rect.x,
+                        camera.viewport.y + key[1] * self.chunk_size - camera.rect.y)
+            blits.append((self.chunks[key], position))
+
+        surface.set_clip(camera.viewport)
+        surface.blits(blits, False)
+        surface.set_clip(None)
+
+
+def generate(path, seed, chunks=(8, 8), chunk_tiles=16, tile_size=16):
+    # Write a new random map: mostly dirt, with patches of grass, ponds of
+    # water and rocks, as a JSON header at path and a tile data file next
+    # to it. Water and rock are solid, and the top left corner, where the
+    # hero starts, is kept clear.
+    # - path is the header file to write
+    # - seed makes the same map every time
+    # - chunks is the map's size in chunks (wide, high)
+    # - chunk_tiles is a chunk's width in tiles
+    # - tile_size is a tile's width in pixels
+
+    tiles = [{"name": "dirt", "color": "brown"},
+             {"name": "grass", "color": [96, 128, 56]},
+             {"name": "water", "color": [48, 80, 160], "solid": True},
+             {"name": "rock", "color": [112, 112, 112], "solid": True}]
+
+    rng = random.Random(seed)
+    width = chunks[0] * chunk_tiles
+    height = chunks[1] * chunk_tiles
+    grid = [[0] * width for row in range(height)]
+
+    # Round blobs of each tile type, grass first so water and rock win
+    for tile, count, radius in ((1, width * height // 400, 6), (2, width * height // 1600, 4), (3, width * height // 800, 1)):
+        for blob in range(count):
+            x = rng.randrange(width)
+            y = rng.randrange(height)
+            r = rng.randint(1, radius)
+            for row in range(max(y - r, 0), min(y + r + 1, height)):
+                for column in range(max(x - r, 0), min(x + r + 1, width)):
+                    if (row - y) ** 2 + (column - x) ** 2 <= r * r:
+                        grid[row][column] = tile
+
+    for row in range(4):
+        for column in range(4):
+            grid[row][column] = 0
+
+    data = bytearray()
+    for cy in range(chunks[1]):
+        for cx in range(chunks[0]):
+            for row in range(cy * chunk_tiles, (cy + 1) * chunk_tiles):
+                data.extend(grid[row][cx * chunk_tiles:(cx + 1) * chunk_tiles])
+
+    data_name = os.path.splitext(os.path.basename(path))[0] + ".tiles"
+    with open(os.path.join(os.path.dirname(path), data_name), "wb") as file:
+        file.write(data)
+    with open(path, "w") as file:
+        json.dump({"tile_size": tile_size, "chunk_tiles": chunk_tiles, "chunks": list(chunks),
+                   "tiles": tiles, "objects": [], "data": data_name}, file, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a random overworld map.")
+    parser.add_argument("path", nargs="?", default=MAP_PATH, help="map header to write")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--chunks", type=int, nargs=2, default=[8, 8], help="map size in chunks")
+    args = parser.parse_args()
+
+    generate(args.path, args.seed, tuple(args.chunks))
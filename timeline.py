@@ -0,0 +1,63 @@
+from collections import deque
+from gamelog import channel
+
+log = channel("combat")
+
+
+class Timeline:
+    # An object in this class plays animations without blocking the game.
+    # An animation is a generator: the code between two yields is one
+    # keyframe, and the number it yields is how many milliseconds to hold
+    # that keyframe before the next one runs. Animations are queued and
+    # played one after another as the main loop's clock advances, so events
+    # keep being handled while they play. Each finished animation is logged
+    # on the combat channel (at debug level) with the milliseconds from
+    # being queued to its last keyframe.
+
+    def __init__(self):
+        # Initialize a Timeline.
+        # - self is the Timeline to initialize
+
+        self.queue = deque() # [name, generator, start time] waiting to play
+        self.current = None
+        self.wait = 0 # Milliseconds left on the current keyframe
+        self.time = 0 # Milliseconds this timeline has been advanced in total
+
+    def start(self, animation, name="animation"):
+        # Queue an animation to play after the ones already queued.
+        # - self is the Timeline
+        # - animation is a generator yielding keyframe durations in ms
+        # - name labels the animation in the log
+
+        self.queue.append([name, animation, self.time])
+
+    def busy(self):
+        # Return True while an animation is playing or queued.
+        # - self is the Timeline
+
+        return self.current is not None or len(self.queue) > 0
+
+    def advance(self, elapsed):
+        # Move the timeline forward, running every keyframe that is due.
+        # - self is the Timeline
+        # - elapsed is the number of ms since the last advance (Clock.tick)
+
+        self.time = self.time + elapsed
+        self.wait = self.wait - elapsed
+
+        while self.wait <= 0:
+
+            if self.current is None:
+                if not self.queue:
+                    self.wait = 0 # Idle time is not owed to the next animation
+                    return
+                self.current = self.queue.popleft()
+
+            name, animation, start_time = self.current
+
+            try:
+                self.wait = self.wait + (next(animation) or 0)
+            except StopIteration:
+                ms = self.time - start_time
+                log.debug("%s finished after %d ms", name, ms, extra={"data": {"animation": name, "ms": ms}})
+                self.current = None
@@ -0,0 +1,180 @@
+import json, os
+
+# The data file every unit's stats are read from, next to the code like the
+# images. Reading it needs no pygame, so the combat tools import quickly
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "units.json")
+
+# Stats a unit type may leave out of the data file, and their values
+STAT_DEFAULTS = {"attack2": 0, "attack1_max_pp": 0, "attack2_max_pp": 0, "increased_defence": 0}
+
+# Most finished Units of one type a UnitPool keeps for reuse, enough for
+# the largest party
+MAX_FREE = 32
+
+
+class UnitTemplate:
+    # An object in this class holds the fixed stats of one type of unit,
+    # shared by every unit of that type and never changed after loading.
+    # - health is the total damage a unit can take before dying
+    # - attack is the damage of its first attack, attack2 of its second
+    # - defense is the damage it nullifies per attack
+    # - speed decides which unit moves first
+    # - line_up_chance is the % chance to strike all enemies
+    # - dodge_chance is the % chance to dodge an attack
+    # - crit_chance is the % chance to deal a critical hit
+    # - attack1_max_pp and attack2_max_pp are how often each attack can be used
+    # - increased_defence is the defense added while defending
+    # - image_name is the sprite's name in the asset cache
+
+    __slots__ = ["name", "kind", "health", "attack", "attack2", "defense", "speed",
+                 "line_up_chance", "dodge_chance", "crit_chance",
+                 "attack1_max_pp", "attack2_max_pp", "increased_defence", "image_name"]
+
+    def __init__(self, name, kind, stats):
+        # Initialize a UnitTemplate.
+        # - self is the UnitTemplate to initialize
+        # - name is the unit type's name, like "slime"
+        # - kind is "hero" or "enemy"
+        # - stats is the unit type's dict from the data file
+
+        values = dict(STAT_DEFAULTS)
+        values.update(stats)
+        values["image_name"] = values.pop("image")
+        values["name"] = name
+        values["kind"] = kind
+
+        for field in self.__slots__:
+            object.__setattr__(self, field, values.pop(field))
+        if values:
+            raise ValueError("unknown stats for " + name + ": " + ", ".join(sorted(values)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("unit templates cannot be changed")
+
+
+class Unit:
+    # An object here represents a hero or enemy unit. It only holds what
+    # changes during play (hp and pp); every other stat is read from the
+    # unit type's shared UnitTemplate.
+
+    __slots__ = ["template", "current_hp", "attack1_current_pp", "attack2_current_pp"]
+
+    def __init__(self, name):
+        # Initialize a Unit at full hp and pp.
+        # - self is the Unit to initialize
+        # - name is the unit type's name in the catalog
+
+        self.template = catalog()[name]
+        self.reset()
+
+    def reset(self):
+        # Put the unit back at full hp and pp.
+        # - self is the Unit
+
+        template = self.template
+        self.current_hp = template.health
+        self.attack1_current_pp = template.attack1_max_pp
+        self.attack2_current_pp = template.attack2_max_pp
+
+    @property
+    def character_image(self):
+        # The unit's sprite, shared by every unit of its type and only
+        # decoded once it is first drawn
+
+        from assets import assets # Only drawing a unit needs pygame
+        return assets.get(self.template.image_name)
+
+
+def stat_property(field):
+    # Return a read-only property that reads a stat from a unit's template.
+    # - field is the stat's name
+
+    return property(lambda unit: getattr(unit.template, field))
+
+
+for field in UnitTemplate.__slots__:
+    setattr(Unit, field, stat_property(field))
+
+
+class UnitPool:
+    # An object in this class keeps the enemy Units of finished fights, so
+    # the next fights reuse them at full hp instead of building new ones
+    # and a long session's encounters leave no garbage behind.
+
+    def __init__(self, max_free=MAX_FREE):
+        # Initialize an empty UnitPool.
+        # - self is the UnitPool to initialize
+        # - max_free is the most Units of one type it keeps
+
+        self.max_free = max_free
+        self.free = {} # name -> list of finished Units of that type
+        self.made = 0 # Units built because none were free
+        self.reused = 0
+
+    def acquire(self, name):
+        # Return a Unit of a type at full hp and pp, reusing a finished one
+        # when there is one.
+        # - self is the UnitPool
+        # - name is the unit type's name in the catalog
+
+        free = self.free.get(name)
+        if free:
+            unit = free.pop()
+            unit.reset()
+            self.reused = self.reused + 1
+            return unit
+
+        self.made = self.made + 1
+        return Unit(name)
+
+    def release(self, units):
+        # Take back Units whose fight is over. They must not be used again
+        # until acquire() hands them out.
+        # - self is the UnitPool
+        # - units is a list of Units
+
+        for unit in units:
+            free = self.free.setdefault(unit.template.name, [])
+            if len(free) < self.max_free:
+                free.append(unit)
+
+
+# The one pool every game's encounters take their enemies from
+unit_pool = UnitPool()
+
+
+templates = None
+
+
+def catalog():
+    # Return the dict of every UnitTemplate by name, loading the data file
+    # the first time only.
+
+    global templates
+
+    if templates is None:
+        templates = load_catalog(CATALOG_PATH)
+
+    return templates
+
+
+def load_catalog(path):
+    # Read a unit data file and return its UnitTemplates by name.
+    # - path is the JSON file to read
+
+    with open(path) as file:
+        data = json.load(file)
+
+    loaded = {}
+    for kind, section in (("hero", "heroes"), ("enemy", "enemies")):
+        for name, stats in data.get(section, {}).items():
+            loaded[name] = UnitTemplate(name, kind, stats)
+
+    return loaded
+
+
+def names(kind):
+    # Return the names of every unit of a kind ("hero" or "enemy") in the
+    # order the data file lists them.
+
+    return [name for name, template in catalog().items() if template.kind == kind]